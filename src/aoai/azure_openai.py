@@ -2,22 +2,70 @@
 `azure_openai.py` is a module for managing interactions with the Azure OpenAI API within our application.
 
 """
+import asyncio
 import base64
 import json
 import os
+import threading
 import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from typing import Any, Dict, List, Literal, Optional, Tuple, Union
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import matplotlib.image as mpimg
 import matplotlib.pyplot as plt
+import numpy as np
 import openai
+import pandas as pd
 import requests
 from dotenv import load_dotenv
-from openai import AzureOpenAI
-
-from src.aoai.tokenizer import AzureOpenAITokenizer
-from src.aoai.utils import extract_rate_limit_and_usage_info
+from openai import NOT_GIVEN, AsyncAzureOpenAI, AzureOpenAI
+from openai.types import CreateEmbeddingResponse
+from openai.types.chat import ChatCompletion
+
+from src.aoai.calibration import TokenCalibrator
+from src.aoai.conversation import ConversationHistory
+from src.aoai.embedding_cache import EmbeddingCache
+from src.aoai.hedging import HedgingPolicy
+from src.aoai.rate_limiter import AdaptiveRateLimiter, get_shared_rate_limiter
+from src.aoai.response_cache import ResponseCache
+from src.aoai.retry import RetryPolicy
+from src.aoai.scheduler import PriorityScheduler, get_shared_scheduler
+from src.aoai.semantic_cache import (
+    SemanticResponseCache,
+    context_fingerprint,
+    normalize_query,
+)
+from src.aoai.router import FAILOVER_ERRORS, DeploymentEndpoint, DeploymentRouter
+from src.aoai.single_flight import SingleFlight, get_shared_single_flight
+from src.aoai.streaming import StreamMetrics
+from src.aoai.telemetry import CallRecord, MetricsRegistry, get_metrics
+from src.aoai.tokenizer import (
+    EMBEDDING_ENCODING,
+    AzureOpenAITokenizer,
+    EncodingRegistry,
+    get_encoding_registry,
+)
+from src.aoai.transport import get_shared_http_client, get_shared_session
+from src.aoai.utils import (
+    extract_rate_limit_and_usage_info,
+    summarize_token_estimation_results,
+)
 from utils.ml_logging import get_logger
 
 # Load environment variables from .env file
@@ -26,6 +74,15 @@ load_dotenv()
 # Set up logger
 logger = get_logger()
 
+# Azure OpenAI accepts at most 2048 inputs per embeddings request
+EMBEDDING_MAX_INPUTS = 2048
+
+# Token budget of a single embeddings request; each input must also fit the model's context (8191 tokens)
+EMBEDDING_MAX_BATCH_TOKENS = 100_000
+
+# Request parameters that add prompt tokens the estimate does not count, left out of token calibration
+UNCALIBRATED_PARAMETERS = ("tools", "functions", "response_format", "extra_body")
+
 
 class AzureOpenAIManager:
     """
@@ -45,6 +102,19 @@ class AzureOpenAIManager:
         embedding_model_name: Optional[str] = None,
         dalle_model_name: Optional[str] = None,
         whisper_model_name: Optional[str] = None,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        router: Optional[DeploymentRouter] = None,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        response_cache: Optional[ResponseCache] = None,
+        semantic_cache: Optional[SemanticResponseCache] = None,
+        http_session: Optional[requests.Session] = None,
+        single_flight: Optional[SingleFlight] = None,
+        scheduler: Optional[PriorityScheduler] = None,
+        metrics: Optional[MetricsRegistry] = None,
+        hedging: Optional[HedgingPolicy] = None,
+        encodings: Optional[EncodingRegistry] = None,
+        token_calibrator: Optional[TokenCalibrator] = None,
     ):
         """
         Initializes the Azure OpenAI Manager with necessary configurations.
@@ -56,6 +126,32 @@ class AzureOpenAIManager:
         :param chat_model_name: The Chat Model Name. If not provided, it will be fetched from the environment variable "AZURE_AOAI_CHAT_MODEL_NAME".
         :param embedding_model_name: The Embedding Model Deployment ID. If not provided, it will be fetched from the environment variable "AZURE_AOAI_EMBEDDING_DEPLOYMENT_ID".
         :param dalle_model_name: The DALL-E Model Deployment ID. If not provided, it will be fetched from the environment variable "AZURE_AOAI_DALLE_MODEL_DEPLOYMENT_ID".
+        :param whisper_model_name: The Whisper Model Deployment ID. If not provided, it will be fetched from the environment variable "AZURE_AOAI_WHISPER_MODEL_DEPLOYMENT_ID".
+        :param rate_limiter: The client-side rate limiter gating every call. Defaults to the process-wide shared limiter.
+        :param retry_policy: The policy used to retry transient failures. Defaults to `RetryPolicy()`.
+        :param router: A pool of chat deployments to balance and fail over across. If not provided, it is built from
+            the environment variable "AZURE_OPENAI_DEPLOYMENTS" when set; otherwise only `chat_model_name` is used.
+        :param embedding_cache: An on-disk cache consulted before embedding texts. If not provided, it is built from
+            the environment variable "AZURE_OPENAI_EMBEDDING_CACHE_DIR" when set.
+        :param response_cache: An exact-match cache for non-streaming chat completions. If not provided, it is built
+            from the environment variable "AZURE_OPENAI_RESPONSE_CACHE_TTL" when set; otherwise caching is disabled.
+        :param semantic_cache: A similarity cache answering paraphrased chat queries. If not provided, it is built
+            from the environment variable "AZURE_OPENAI_SEMANTIC_CACHE_THRESHOLD" when set; otherwise it is disabled.
+        :param http_session: The pooled session used for raw REST calls. Defaults to the process-wide shared session.
+        :param single_flight: The group coalescing identical in-flight requests into one upstream call. Defaults to
+            the process-wide shared group, so identical requests from concurrent sessions are coalesced.
+        :param scheduler: The scheduler admitting requests to the rate limiter by priority class and tenant (see
+            `request_priority`). Defaults to the process-wide scheduler of `rate_limiter`.
+        :param metrics: The registry recording the latency, tokens, payload sizes and estimated cost of every
+            call. Defaults to the process-wide registry.
+        :param hedging: The policy duplicating slow chat completions to another deployment of the pool. If not
+            provided, it is built from the environment variable "AZURE_OPENAI_HEDGING_QUANTILE" when set;
+            otherwise hedging is disabled. Hedging is inactive without a router of at least two deployments.
+        :param encodings: The registry resolving the tokenizer encoding of each deployment. Defaults to the
+            process-wide registry, which starts loading its encodings in the background.
+        :param token_calibrator: The calibrator fitting the token estimates of each model to the prompt tokens
+            of responses. Defaults to the process-wide calibrator, built from the environment variable
+            "AZURE_OPENAI_TOKEN_CALIBRATION_PATH" when set; otherwise estimates are not calibrated.
 
         """
         self.api_key = api_key or os.getenv("AZURE_OPENAI_KEY")
@@ -81,13 +177,42 @@ class AzureOpenAIManager:
             "AZURE_AOAI_WHISPER_MODEL_DEPLOYMENT_ID"
         )
 
+        # Retries are owned by `retry_policy`, so the SDK's built-in retries are disabled
         self.openai_client = AzureOpenAI(
             api_key=self.api_key,
             api_version=self.api_version,
             azure_endpoint=self.azure_endpoint,
+            max_retries=0,
+            http_client=get_shared_http_client(),
         )
-
-        self.tokenizer = AzureOpenAITokenizer()
+        self.http_session = http_session or get_shared_session()
+
+        # Async clients are shared per event loop: httpx connection pools cannot outlive the loop
+        # they were created on, and Streamlit pages call `asyncio.run` once per interaction.
+        self._async_openai_clients = weakref.WeakKeyDictionary()
+
+        self.tokenizer = AzureOpenAITokenizer(calibrator=token_calibrator)
+        self.encodings = encodings or get_encoding_registry()
+        self.encodings.warm_up()
+        self.rate_limiter = rate_limiter or get_shared_rate_limiter()
+        self.scheduler = scheduler or get_shared_scheduler(self.rate_limiter)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.router = router or DeploymentRouter.from_env(self.rate_limiter)
+        if self.router is not None and self.router.rate_limiter is None:
+            self.router.rate_limiter = self.rate_limiter
+        self.embedding_cache = embedding_cache or EmbeddingCache.from_env()
+        self.response_cache = response_cache or ResponseCache.from_env()
+        self.semantic_cache = semantic_cache or SemanticResponseCache.from_env()
+        self.single_flight = single_flight or get_shared_single_flight()
+        self.metrics = metrics or get_metrics()
+        self.hedging = hedging or HedgingPolicy.from_env()
+        if self.hedging is not None and (
+            self.router is None or len(self.router.deployments) < 2
+        ):
+            logger.warning(
+                "Hedging is inactive: it needs a router with at least two deployments"
+            )
+            self.hedging = None
 
         self._validate_api_configurations()
 
@@ -102,6 +227,28 @@ class AzureOpenAIManager:
         """
         return self.openai_client
 
+    def get_async_azure_openai_client(self) -> AsyncAzureOpenAI:
+        """
+        Returns the asynchronous OpenAI client bound to the running event loop.
+
+        The client shares the configuration of the synchronous client and is reused by every
+        `async_*` method running on the same loop, so concurrent coroutines multiplex over a
+        single connection pool.
+
+        :return: The AsyncAzureOpenAI client.
+        """
+        loop = asyncio.get_running_loop()
+        client = self._async_openai_clients.get(loop)
+        if client is None:
+            client = AsyncAzureOpenAI(
+                api_key=self.api_key,
+                api_version=self.api_version,
+                azure_endpoint=self.azure_endpoint,
+                max_retries=0,
+            )
+            self._async_openai_clients[loop] = client
+        return client
+
     def _validate_api_configurations(self):
         """
         Validates if all necessary configurations are set.
@@ -122,40 +269,1432 @@ class AzureOpenAIManager:
                 "One or more OpenAI API setup variables are empty. Please review your environment variables and `SETTINGS.md`"
             )
 
-    def generate_completion_response(
+    def _rate_limit_key(self, deployment: str) -> str:
+        """
+        Returns the key identifying a deployment's quota in the rate limiter.
+
+        :param deployment: The deployment name.
+        :return: The rate limiter key, unique across endpoints.
+        """
+        return f"{self.azure_endpoint}|{deployment}"
+
+    def _estimate_request_tokens(
+        self,
+        messages: Optional[List[Dict[str, Any]]] = None,
+        text: Optional[Union[str, List[str]]] = None,
+        max_tokens: Optional[int] = None,
+        deployment: Optional[str] = None,
+    ) -> int:
+        """
+        Estimates the quota a request consumes: prompt tokens plus `max_tokens`, as Azure OpenAI counts it.
+
+        Falls back to a characters/4 heuristic if the tokenizer is unavailable, so estimation never fails a call.
+
+        :param messages: The chat messages of the request, if any.
+        :param text: The prompt or input text(s) of the request, if any.
+        :param max_tokens: The maximum number of tokens to generate.
+        :param deployment: The deployment the request is sent to, which determines the encoding. Defaults to
+            the chat deployment.
+        :return: The estimated token cost.
+        """
+        try:
+            model = self.encodings.model_for(deployment or self.chat_model_name)
+            tokens = 0
+            if messages:
+                tokens += self.tokenizer.estimate_tokens_azure_openai(messages, model)
+            if text:
+                for item in [text] if isinstance(text, str) else text:
+                    tokens += self.tokenizer.estimate_tokens_completion(item, model)
+        except Exception as e:
+            logger.debug(f"Token estimation failed, using heuristic: {e}")
+            tokens = len(json.dumps(messages or text or "", default=str)) // 4
+        return tokens + (max_tokens or 0)
+
+    def _count_text_tokens(
+        self, texts: List[str], deployment: Optional[str] = None
+    ) -> List[int]:
+        """
+        Counts the tokens of each text with the encoding of an embedding deployment (cl100k_base unless its
+        model says otherwise).
+
+        Falls back to a characters/4 heuristic if the encoding is unavailable.
+
+        :param texts: The texts to count.
+        :param deployment: The embedding deployment. Defaults to `embedding_model_name`.
+        :return: The token count of each text, in input order.
+        """
+        try:
+            encoding = self.encodings.for_deployment(
+                deployment or self.embedding_model_name, EMBEDDING_ENCODING
+            )
+            return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+        except Exception as e:
+            logger.debug(f"Token counting failed, using heuristic: {e}")
+            return [max(1, len(text) // 4) for text in texts]
+
+    def count_tokens(self, text: str, deployment: Optional[str] = None) -> int:
+        """
+        Counts the tokens of a text with the encoding of a deployment.
+
+        Falls back to a characters/4 heuristic if the encoding is unavailable.
+
+        :param text: The text to count.
+        :param deployment: The deployment the text is sent to. Defaults to the chat deployment.
+        :return: The number of tokens.
+        """
+        try:
+            encoding = self.encodings.for_deployment(deployment or self.chat_model_name)
+            return len(encoding.encode_ordinary(text))
+        except Exception as e:
+            logger.debug(f"Token counting failed, using heuristic: {e}")
+            return max(1, len(text) // 4)
+
+    def estimate_request_tokens(
+        self,
+        messages: Optional[List[Dict[str, Any]]] = None,
+        text: Optional[Union[str, List[str]]] = None,
+        max_tokens: Optional[int] = None,
+        deployment: Optional[str] = None,
+    ) -> int:
+        """
+        Estimates the quota a request consumes: prompt tokens plus `max_tokens`, as the rate limiter admits it.
+
+        :param messages: The chat messages of the request, if any.
+        :param text: The prompt or input text(s) of the request, if any.
+        :param max_tokens: The maximum number of tokens to generate.
+        :param deployment: The deployment the request is sent to. Defaults to the chat deployment.
+        :return: The estimated token cost.
+        """
+        return self._estimate_request_tokens(
+            messages, text=text, max_tokens=max_tokens, deployment=deployment
+        )
+
+    def chunk_text(
+        self,
+        text: Union[str, Iterable[str]],
+        max_tokens: int,
+        overlap_tokens: int = 0,
+        deployment: Optional[str] = None,
+    ) -> Iterator[str]:
+        """
+        Splits a text into chunks of at most `max_tokens` tokens of a deployment's encoding, on markdown,
+        paragraph and sentence boundaries (see `AzureOpenAITokenizer.chunk_text`).
+
+        :param text: The text, or an iterable of text pieces such as the lines of a file.
+        :param max_tokens: The maximum number of tokens of a chunk.
+        :param overlap_tokens: The number of tokens each chunk repeats from the end of the previous one.
+        :param deployment: The deployment the chunks are sent to. Defaults to the chat deployment.
+        :return: A generator of chunks.
+        """
+        return self.tokenizer.chunk_text(
+            text,
+            max_tokens,
+            overlap_tokens,
+            self.encodings.model_for(deployment or self.chat_model_name),
+        )
+
+    @staticmethod
+    def _plan_embedding_batches(
+        token_counts: List[int],
+        max_inputs: int = EMBEDDING_MAX_INPUTS,
+        max_batch_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+    ) -> List[Tuple[int, int]]:
+        """
+        Packs consecutive inputs into batches bounded by an input count and a token budget.
+
+        :param token_counts: The token count of each input, in input order.
+        :param max_inputs: The maximum number of inputs per batch.
+        :param max_batch_tokens: The maximum number of tokens per batch. An input larger than the budget gets its own batch.
+        :return: The batches as (start, end) index ranges over the inputs.
+        """
+        batches = []
+        start, batch_tokens = 0, 0
+        for index, count in enumerate(token_counts):
+            if index > start and (
+                index - start >= max_inputs or batch_tokens + count > max_batch_tokens
+            ):
+                batches.append((start, index))
+                start, batch_tokens = index, 0
+            batch_tokens += count
+        if start < len(token_counts):
+            batches.append((start, len(token_counts)))
+        return batches
+
+    @staticmethod
+    def _decode_embeddings(response: Any, out: np.ndarray, offset: int) -> None:
+        """
+        Writes the embeddings of a response into rows of `out`, decoding base64 payloads without
+        going through Python floats.
+
+        :param response: The parsed embeddings response.
+        :param out: The float32 matrix receiving the embeddings.
+        :param offset: The row of `out` matching the first input of the request.
+        """
+        for item in response.data:
+            if isinstance(item.embedding, str):
+                vector = np.frombuffer(base64.b64decode(item.embedding), dtype="<f4")
+            else:
+                vector = np.asarray(item.embedding, dtype=np.float32)
+            out[offset + item.index] = vector
+
+    @classmethod
+    def _assemble_embeddings(
+        cls, count: int, batches: List[Tuple[int, int]], responses: List[Any]
+    ) -> np.ndarray:
+        """
+        Decodes the responses of all batches into a single matrix.
+
+        :param count: The total number of inputs.
+        :param batches: The (start, end) ranges of the batches.
+        :param responses: The parsed response of each batch.
+        :return: A float32 array of shape (count, dimensions) in input order.
+        """
+        first = responses[0].data[0].embedding
+        dimensions = (
+            len(base64.b64decode(first)) // 4 if isinstance(first, str) else len(first)
+        )
+        out = np.empty((count, dimensions), dtype=np.float32)
+        for (start, _), response in zip(batches, responses):
+            cls._decode_embeddings(response, out, start)
+        logger.info(
+            f"Created {count} embeddings of {dimensions} dimensions in {len(batches)} requests"
+        )
+        return out
+
+    def _lookup_cached_embeddings(
+        self, deployment: str, dimensions: Optional[int], texts: List[str]
+    ) -> Tuple[List[Optional[np.ndarray]], List[int]]:
+        """
+        Looks the texts up in the embedding cache, if one is configured.
+
+        :param deployment: The embedding deployment.
+        :param dimensions: The requested dimensions, None for the model default.
+        :param texts: The texts to embed.
+        :return: A tuple of (cached vector or None per text, indices of the texts still to embed).
+        """
+        if self.embedding_cache is None:
+            return [None] * len(texts), list(range(len(texts)))
+        try:
+            cached = self.embedding_cache.get_many(deployment, dimensions, texts)
+        except Exception as e:
+            logger.warning(f"Embedding cache lookup failed: {e}")
+            return [None] * len(texts), list(range(len(texts)))
+        pending = [index for index, vector in enumerate(cached) if vector is None]
+        logger.info(
+            f"Embedding cache: {len(texts) - len(pending)} hits, {len(pending)} misses"
+        )
+        return cached, pending
+
+    def _merge_cached_embeddings(
+        self,
+        deployment: str,
+        dimensions: Optional[int],
+        texts: List[str],
+        cached: List[Optional[np.ndarray]],
+        pending: List[int],
+        fresh: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Stores freshly created embeddings in the cache and merges them with the cached ones.
+
+        :param deployment: The embedding deployment.
+        :param dimensions: The requested dimensions, None for the model default.
+        :param texts: All the texts being embedded.
+        :param cached: The cached vector or None per text.
+        :param pending: The indices of the texts that were embedded.
+        :param fresh: The embeddings of the pending texts, in the order of `pending`.
+        :return: A float32 array of shape (len(texts), dimensions) in input order.
+        """
+        if self.embedding_cache is None:
+            return fresh
+        try:
+            self.embedding_cache.put_many(
+                deployment, dimensions, [texts[index] for index in pending], fresh
+            )
+        except Exception as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+        if len(pending) == len(texts):
+            return fresh
+        out = np.empty((len(texts), fresh.shape[1]), dtype=np.float32)
+        for index, vector in enumerate(cached):
+            if vector is not None:
+                out[index] = vector
+        out[pending] = fresh
+        return out
+
+    @staticmethod
+    def _cached_embedding_response(deployment: str, vector: np.ndarray) -> str:
+        """
+        Renders a cached vector in the JSON shape returned by `generate_embedding`.
+
+        :param deployment: The embedding deployment.
+        :param vector: The cached embedding.
+        :return: The embedding response as a JSON string, reporting no token usage.
+        """
+        response = CreateEmbeddingResponse(
+            data=[{"embedding": vector.tolist(), "index": 0, "object": "embedding"}],
+            model=deployment,
+            object="list",
+            usage={"prompt_tokens": 0, "total_tokens": 0},
+        )
+        return response.model_dump_json(indent=2)
+
+    def _semantic_fingerprint(
+        self,
+        conversation_history: List[Dict[str, Any]],
+        user_message: Dict[str, Any],
+        **params,
+    ) -> str:
+        """
+        Fingerprints the context of a chat query: everything except the query text itself.
+
+        :param conversation_history: The conversation history, including the system message.
+        :param user_message: The user message carrying the query and any images.
+        :param params: The sampling parameters of the request.
+        :return: The context fingerprint.
+        """
+        content = user_message["content"]
+        attachments = (
+            [part for part in content if part.get("type") != "text"]
+            if isinstance(content, list)
+            else []
+        )
+        return context_fingerprint(
+            deployment=self.chat_model_name,
+            history=conversation_history,
+            attachments=attachments,
+            **params,
+        )
+
+    def _semantic_cache_lookup(
+        self, query: str, fingerprint: str
+    ) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        Embeds the normalized query and looks it up in the semantic cache.
+
+        :param query: The user query.
+        :param fingerprint: The context fingerprint.
+        :return: A tuple of (cached answer or None, query embedding or None if the cache is unavailable).
+        """
+        if self.semantic_cache is None or not self.embedding_model_name:
+            return None, None
+        vectors = self.generate_embeddings([normalize_query(query)])
+        if vectors is None:
+            return None, None
+        hit = self.semantic_cache.lookup(fingerprint, vectors[0])
+        return (hit[0] if hit else None), vectors[0]
+
+    async def _async_semantic_cache_lookup(
+        self, query: str, fingerprint: str
+    ) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        Awaitable counterpart of `_semantic_cache_lookup`.
+
+        :param query: The user query.
+        :param fingerprint: The context fingerprint.
+        :return: A tuple of (cached answer or None, query embedding or None if the cache is unavailable).
+        """
+        if self.semantic_cache is None or not self.embedding_model_name:
+            return None, None
+        vectors = await self.async_generate_embeddings([normalize_query(query)])
+        if vectors is None:
+            return None, None
+        hit = self.semantic_cache.lookup(fingerprint, vectors[0])
+        return (hit[0] if hit else None), vectors[0]
+
+    @staticmethod
+    def _operation_name(create: Callable[..., Any]) -> str:
+        """
+        Returns the name of the API operation performed by a creation method, for metrics.
+
+        :param create: A `with_raw_response` creation method of an OpenAI client.
+        :return: The operation, e.g. "chat.completions" or "embeddings".
+        """
+        module = getattr(create, "__module__", None) or ""
+        if module.startswith("openai.resources."):
+            return module[len("openai.resources.") :]
+        return getattr(create, "__name__", "unknown")
+
+    @staticmethod
+    def _record_response(call: CallRecord, raw_response: Any, response: Any) -> None:
+        """
+        Records the payload sizes and usage of a response in the metrics of its call.
+
+        :param call: The record of the call.
+        :param raw_response: The raw response of the call.
+        :param response: The parsed response.
+        """
+        http_response = raw_response.http_response
+        try:
+            call.request_bytes = len(http_response.request.content)
+        except Exception:  # streamed request bodies (e.g. audio uploads) are not kept
+            pass
+        try:
+            call.response_bytes = len(http_response.content)
+        except Exception:  # the body of a stream is read by its consumer
+            pass
+        call.set_usage(
+            getattr(response, "usage", None), getattr(response, "model", None)
+        )
+
+    def _calibrate(
+        self, deployment: str, request: Dict[str, Any], prompt_tokens: Optional[int]
+    ) -> None:
+        """
+        Feeds the prompt tokens billed for a chat completion to the token calibrator of the tokenizer.
+
+        :param deployment: The deployment that answered.
+        :param request: The parameters of the request.
+        :param prompt_tokens: The `prompt_tokens` reported by the response, if any.
+        """
+        if prompt_tokens is None or any(
+            parameter in request for parameter in UNCALIBRATED_PARAMETERS
+        ):
+            return
+        try:
+            self.tokenizer.record_usage(
+                request.get("messages"),
+                prompt_tokens,
+                self.encodings.model_for(deployment),
+            )
+        except Exception as e:
+            logger.debug(f"Token calibration failed: {e}")
+
+    def _attempt(
+        self,
+        create: Callable[..., Any],
+        key: str,
+        deployment: str,
+        tokens: int,
+        on_latency: Optional[Callable[[float], None]] = None,
+        **kwargs,
+    ) -> Any:
+        """
+        Performs a single attempt: admits it through the scheduler and rate limiter, sends it and feeds the
+        response headers back.
+
+        :param create: A `with_raw_response` creation method of an OpenAI client.
+        :param key: The rate limiter key of the deployment.
+        :param deployment: The deployment to call.
+        :param tokens: The estimated token cost of the request.
+        :param on_latency: Called with the duration of the HTTP request when it succeeds, excluding the time
+            spent waiting for admission. Optional.
+        :param kwargs: The parameters of the request.
+        :return: The parsed response.
+        """
+        self.scheduler.acquire(key, tokens)
+        with self.metrics.track(
+            "openai", self._operation_name(create), deployment
+        ) as call:
+            sent_at = time.monotonic()
+            try:
+                raw_response = create(model=deployment, **kwargs)
+            except openai.RateLimitError as e:
+                self.rate_limiter.penalize(key, tokens, e.response.headers)
+                raise
+            except openai.APIStatusError as e:
+                self.rate_limiter.update_from_headers(key, tokens, e.response.headers)
+                raise
+            except Exception:
+                self.rate_limiter.release(key, tokens)
+                raise
+            if on_latency is not None:
+                on_latency(time.monotonic() - sent_at)
+            self.rate_limiter.update_from_headers(key, tokens, raw_response.headers)
+            response = raw_response.parse()
+            self._record_response(call, raw_response, response)
+            self.encodings.learn_from_response(deployment, response)
+            self._calibrate(
+                deployment,
+                kwargs,
+                getattr(getattr(response, "usage", None), "prompt_tokens", None),
+            )
+            return response
+
+    async def _async_attempt(
+        self,
+        create: Callable[..., Any],
+        key: str,
+        deployment: str,
+        tokens: int,
+        on_latency: Optional[Callable[[float], None]] = None,
+        **kwargs,
+    ) -> Any:
+        """
+        Awaitable counterpart of `_attempt`.
+
+        :param create: A `with_raw_response` creation method of an async OpenAI client.
+        :param key: The rate limiter key of the deployment.
+        :param deployment: The deployment to call.
+        :param tokens: The estimated token cost of the request.
+        :param on_latency: Called with the duration of the HTTP request when it succeeds, excluding the time
+            spent waiting for admission, or with its elapsed time as a lower bound when it is cancelled in
+            flight. Optional.
+        :param kwargs: The parameters of the request.
+        :return: The parsed response.
+        """
+        await self.scheduler.async_acquire(key, tokens)
+        with self.metrics.track(
+            "openai", self._operation_name(create), deployment
+        ) as call:
+            sent_at = time.monotonic()
+            try:
+                raw_response = await create(model=deployment, **kwargs)
+            except asyncio.CancelledError:
+                # e.g. the losing attempt of a hedged request
+                self.rate_limiter.release(key, tokens)
+                if on_latency is not None:
+                    on_latency(time.monotonic() - sent_at)
+                raise
+            except openai.RateLimitError as e:
+                self.rate_limiter.penalize(key, tokens, e.response.headers)
+                raise
+            except openai.APIStatusError as e:
+                self.rate_limiter.update_from_headers(key, tokens, e.response.headers)
+                raise
+            except Exception:
+                self.rate_limiter.release(key, tokens)
+                raise
+            if on_latency is not None:
+                on_latency(time.monotonic() - sent_at)
+            self.rate_limiter.update_from_headers(key, tokens, raw_response.headers)
+            response = raw_response.parse()
+            self._record_response(call, raw_response, response)
+            self.encodings.learn_from_response(deployment, response)
+            self._calibrate(
+                deployment,
+                kwargs,
+                getattr(getattr(response, "usage", None), "prompt_tokens", None),
+            )
+            return response
+
+    def _call_with_rate_limit(
+        self, create: Callable[..., Any], deployment: str, tokens: int, **kwargs
+    ) -> Any:
+        """
+        Performs a request under the retry policy. Each attempt is admitted through the rate limiter
+        and feeds the response headers back to it.
+
+        :param create: A `with_raw_response` creation method of the OpenAI client.
+        :param deployment: The deployment to call.
+        :param tokens: The estimated token cost of the request.
+        :param kwargs: The parameters of the request.
+        :return: The parsed response.
+        """
+        key = self._rate_limit_key(deployment)
+        flight_key = self._single_flight_key(deployment, kwargs)
+        if flight_key is None:
+            return self.retry_policy.call(
+                self._attempt, create, key, deployment, tokens, **kwargs
+            )
+        return self.single_flight.do(
+            flight_key,
+            self.retry_policy.call,
+            self._attempt,
+            create,
+            key,
+            deployment,
+            tokens,
+            **kwargs,
+        )
+
+    async def _async_call_with_rate_limit(
+        self, create: Callable[..., Any], deployment: str, tokens: int, **kwargs
+    ) -> Any:
+        """
+        Awaitable counterpart of `_call_with_rate_limit`.
+
+        :param create: A `with_raw_response` creation method of the async OpenAI client.
+        :param deployment: The deployment to call.
+        :param tokens: The estimated token cost of the request.
+        :param kwargs: The parameters of the request.
+        :return: The parsed response.
+        """
+        key = self._rate_limit_key(deployment)
+        flight_key = self._single_flight_key(deployment, kwargs)
+        if flight_key is None:
+            return await self.retry_policy.async_call(
+                self._async_attempt, create, key, deployment, tokens, **kwargs
+            )
+        return await self.single_flight.async_do(
+            flight_key,
+            self.retry_policy.async_call,
+            self._async_attempt,
+            create,
+            key,
+            deployment,
+            tokens,
+            **kwargs,
+        )
+
+    def _single_flight_key(
+        self, deployment: str, kwargs: Dict[str, Any]
+    ) -> Optional[str]:
+        """
+        Returns the key under which identical in-flight requests are coalesced, or None if the request must not be.
+
+        Streaming responses can only be consumed once, so streaming requests are never coalesced.
+
+        :param deployment: The deployment the request targets.
+        :param kwargs: The parameters of the request.
+        :return: The single-flight key or None.
+        """
+        if self.single_flight is None or kwargs.get("stream"):
+            return None
+        return self.single_flight.make_key(self.azure_endpoint, deployment, **kwargs)
+
+    def _response_cache_key(
+        self, kwargs: Dict[str, Any], cache_response: bool = False
+    ) -> Optional[str]:
+        """
+        Returns the response cache key of a chat completion request, or None if it must not be cached.
+
+        Only requests with a temperature of 0 are cached, unless the caller opts in with `cache_response`, so a
+        sampled answer is not replayed to every caller. A seed is not enough: it is only best-effort determinism.
+        Streaming requests are never cached; every other parameter, including the messages, temperature, top_p,
+        max_tokens and seed, is part of the key.
+
+        :param kwargs: The parameters of the request.
+        :param cache_response: Whether the caller accepts a cached answer to a sampled request.
+        :return: The cache key or None.
+        """
+        if self.response_cache is None or kwargs.get("stream"):
+            return None
+        if kwargs.get("temperature") != 0 and not cache_response:
+            return None
+        return self.response_cache.make_key(self.chat_model_name, kwargs)
+
+    def _call_chat_completions(self, tokens: int, **kwargs) -> Any:
+        """
+        Creates a chat completion, answering identical non-streaming requests from the response cache when
+        one is configured.
+
+        :param tokens: The estimated token cost of the request.
+        :param kwargs: The parameters of the request. `cache_response=True` opts a request with a non-zero
+            temperature in to the response cache.
+        :return: The parsed chat completion.
+        """
+        cache_key = self._response_cache_key(
+            kwargs, kwargs.pop("cache_response", False)
+        )
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return ChatCompletion.model_validate_json(cached)
+        response = self._call_chat_completions_uncached(tokens, **kwargs)
+        if cache_key is not None:
+            self.response_cache.set(cache_key, response.model_dump_json())
+        return response
+
+    def _latency_recorder(self, latencies: List[float]) -> Callable[[float], None]:
+        """
+        Returns the `on_latency` callback of a routed chat completion attempt, which keeps the HTTP latency of
+        the attempt for the router and feeds it to the hedging policy.
+
+        :param latencies: The list the latency of the attempt is appended to.
+        :return: The callback.
+        """
+
+        def record(latency: float) -> None:
+            latencies.append(latency)
+            if self.hedging is not None:
+                self.hedging.record_latency(latency)
+
+        return record
+
+    def _call_chat_completions_uncached(self, tokens: int, **kwargs) -> Any:
+        """
+        Sends a chat completion request to the configured chat deployment, or across the deployment pool when a
+        router is configured. With a router, a 429, 5xx or connection failure fails over to the next
+        deployment; only when every deployment failed does the retry policy back off. With a hedging policy, an
+        attempt slower than the learned latency percentile is duplicated to the next deployment.
+
+        :param tokens: The estimated token cost of the request.
+        :param kwargs: The parameters of the request.
+        :return: The parsed chat completion.
+        """
+        if self.router is None:
+            return self._call_with_rate_limit(
+                self.openai_client.chat.completions.with_raw_response.create,
+                self.chat_model_name,
+                tokens,
+                **kwargs,
+            )
+
+        claim_lock = threading.Lock()
+
+        def attempt_on(targets: List[DeploymentEndpoint], claimed: Set[str]) -> Any:
+            last_error: Optional[Exception] = None
+            for target in targets:
+                # Each deployment is tried by one leg of a hedged request only
+                with claim_lock:
+                    if target.key in claimed:
+                        continue
+                    claimed.add(target.key)
+                latencies: List[float] = []
+                try:
+                    response = self._attempt(
+                        target.get_client().chat.completions.with_raw_response.create,
+                        target.key,
+                        target.deployment_name,
+                        tokens,
+                        on_latency=self._latency_recorder(latencies),
+                        **kwargs,
+                    )
+                except FAILOVER_ERRORS as e:
+                    self.router.record_failure(target, e)
+                    logger.warning(
+                        f"Deployment '{target.key}' failed ({type(e).__name__}); failing over"
+                    )
+                    last_error = e
+                    continue
+                self.router.record_success(target, latencies[0])
+                return response
+            raise last_error or RuntimeError(
+                "Every deployment is tried by the other leg"
+            )
+
+        def routed_attempt() -> Any:
+            targets = self.router.candidates()
+            claimed: Set[str] = set()
+            if self.hedging is None or len(targets) < 2:
+                return attempt_on(targets, claimed)
+            return self.hedging.run(
+                lambda: attempt_on(targets, claimed),
+                lambda: attempt_on(targets[1:], claimed),
+                timed=False,
+            )
+
+        return self._call_routed(routed_attempt, kwargs)
+
+    def _call_routed(
+        self, routed_attempt: Callable[[], Any], kwargs: Dict[str, Any]
+    ) -> Any:
+        """
+        Performs a chat completion attempt function under the retry policy, coalescing identical requests.
+
+        :param routed_attempt: The function performing one attempt of the request.
+        :param kwargs: The parameters of the request.
+        :return: The parsed chat completion.
+        """
+        flight_key = self._single_flight_key(self.chat_model_name, kwargs)
+        if flight_key is None:
+            return self.retry_policy.call(routed_attempt)
+        return self.single_flight.do(flight_key, self.retry_policy.call, routed_attempt)
+
+    async def _async_call_chat_completions(self, tokens: int, **kwargs) -> Any:
+        """
+        Awaitable counterpart of `_call_chat_completions`.
+
+        :param tokens: The estimated token cost of the request.
+        :param kwargs: The parameters of the request.
+        :return: The parsed chat completion.
+        """
+        cache_key = self._response_cache_key(
+            kwargs, kwargs.pop("cache_response", False)
+        )
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return ChatCompletion.model_validate_json(cached)
+        response = await self._async_call_chat_completions_uncached(tokens, **kwargs)
+        if cache_key is not None:
+            self.response_cache.set(cache_key, response.model_dump_json())
+        return response
+
+    async def _async_call_chat_completions_uncached(self, tokens: int, **kwargs) -> Any:
+        """
+        Awaitable counterpart of `_call_chat_completions_uncached`.
+
+        :param tokens: The estimated token cost of the request.
+        :param kwargs: The parameters of the request.
+        :return: The parsed chat completion.
+        """
+        if self.router is None:
+            return await self._async_call_with_rate_limit(
+                self.get_async_azure_openai_client().chat.completions.with_raw_response.create,
+                self.chat_model_name,
+                tokens,
+                **kwargs,
+            )
+
+        async def attempt_on(
+            targets: List[DeploymentEndpoint], claimed: Set[str]
+        ) -> Any:
+            last_error: Optional[Exception] = None
+            for target in targets:
+                # Each deployment is tried by one leg of a hedged request only
+                if target.key in claimed:
+                    continue
+                claimed.add(target.key)
+                latencies: List[float] = []
+                try:
+                    response = await self._async_attempt(
+                        target.get_async_client().chat.completions.with_raw_response.create,
+                        target.key,
+                        target.deployment_name,
+                        tokens,
+                        on_latency=self._latency_recorder(latencies),
+                        **kwargs,
+                    )
+                except FAILOVER_ERRORS as e:
+                    self.router.record_failure(target, e)
+                    logger.warning(
+                        f"Deployment '{target.key}' failed ({type(e).__name__}); failing over"
+                    )
+                    last_error = e
+                    continue
+                self.router.record_success(target, latencies[0])
+                return response
+            raise last_error or RuntimeError(
+                "Every deployment is tried by the other leg"
+            )
+
+        async def routed_attempt() -> Any:
+            targets = self.router.candidates()
+            claimed: Set[str] = set()
+            if self.hedging is None or len(targets) < 2:
+                return await attempt_on(targets, claimed)
+            return await self.hedging.async_run(
+                lambda: attempt_on(targets, claimed),
+                lambda: attempt_on(targets[1:], claimed),
+                timed=False,
+            )
+
+        return await self._async_call_routed(routed_attempt, kwargs)
+
+    async def _async_call_routed(
+        self, routed_attempt: Callable[[], Awaitable[Any]], kwargs: Dict[str, Any]
+    ) -> Any:
+        """
+        Awaitable counterpart of `_call_routed`.
+
+        :param routed_attempt: The coroutine function performing one attempt of the request.
+        :param kwargs: The parameters of the request.
+        :return: The parsed chat completion.
+        """
+        flight_key = self._single_flight_key(self.chat_model_name, kwargs)
+        if flight_key is None:
+            return await self.retry_policy.async_call(routed_attempt)
+        return await self.single_flight.async_do(
+            flight_key, self.retry_policy.async_call, routed_attempt
+        )
+
+    def generate_completion_response(
+        self,
+        query: str,
+        temperature: float = 0.5,
+        max_tokens: int = 100,
+        model_name: Optional[str] = None,
+        top_p: float = 1.0,
+        **kwargs,
+    ) -> Optional[str]:
+        """
+        Generates a text completion using Azure OpenAI's Foundation models.
+
+        :param query: The input text query for the model.
+        :param temperature: Controls randomness in the output. Default to 0.5.
+        :param max_tokens: Maximum number of tokens to generate. Defaults to 100.
+        :param model_name: The name of the AI model to use. Defaults to None.
+        :param top_p: The cumulative probability cutoff for token selection. Defaults to 1.0.
+
+        :return: The generated text or None if an error occurs.
+        """
+        try:
+            response = self._call_with_rate_limit(
+                self.openai_client.completions.with_raw_response.create,
+                model_name or self.completion_model_name,
+                self._estimate_request_tokens(
+                    text=query,
+                    max_tokens=max_tokens,
+                    deployment=model_name or self.completion_model_name,
+                ),
+                prompt=query,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=top_p,
+                **kwargs,
+            )
+
+            completion = response.choices[0].text.strip()
+            logger.info(f"Generated completion: {completion}")
+            return completion
+
+        except openai.APIConnectionError as e:
+            logger.error("The server could not be reached")
+            logger.error(e.__cause__)
+            return None
+        except openai.RateLimitError:
+            logger.error("A 429 status code was received; we should back off a bit.")
+            return None
+        except openai.APIStatusError as e:
+            logger.error("Another non-200-range status code was received")
+            logger.error(e.status_code)
+            logger.error(e.response)
+            return None
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            return None
+
+    def create_chat_completion(
+        self,
+        messages: List[Dict[str, Any]],
+        tokens: Optional[int] = None,
+        **kwargs,
+    ) -> ChatCompletion:
+        """
+        Creates a chat completion on the chat deployment with every admission, caching and resilience layer of
+        the manager: response cache, request coalescing, priority scheduler, rate limiter, deployment router,
+        hedging and retry policy. Errors are raised, not logged.
+
+        :param messages: The chat messages.
+        :param tokens: The token cost admitted for the request. Defaults to `estimate_request_tokens`.
+        :param kwargs: The other chat completion parameters, e.g. "temperature" or "max_tokens".
+        :return: The chat completion.
+        """
+        if tokens is None:
+            tokens = self.estimate_request_tokens(
+                messages, max_tokens=kwargs.get("max_tokens")
+            )
+        return self._call_chat_completions(tokens, messages=messages, **kwargs)
+
+    async def async_create_chat_completion(
+        self,
+        messages: List[Dict[str, Any]],
+        tokens: Optional[int] = None,
+        **kwargs,
+    ) -> ChatCompletion:
+        """
+        Awaitable counterpart of `create_chat_completion`.
+
+        :param messages: The chat messages.
+        :param tokens: The token cost admitted for the request. Defaults to `estimate_request_tokens`.
+        :param kwargs: The other chat completion parameters, e.g. "temperature" or "max_tokens".
+        :return: The chat completion.
+        """
+        if tokens is None:
+            tokens = self.estimate_request_tokens(
+                messages, max_tokens=kwargs.get("max_tokens")
+            )
+        return await self._async_call_chat_completions(
+            tokens, messages=messages, **kwargs
+        )
+
+    async def async_generate_chat_completion_response(
+        self,
+        conversation_history: List[Dict[str, str]],
+        query: str,
+        system_message_content: str = """You are an AI assistant that
+          helps people find information. Please be precise, polite, and concise.""",
+        temperature: float = 0.7,
+        deployment_name: str = None,
+        max_tokens: int = 150,
+        seed: int = 42,
+        top_p: float = 1.0,
+        **kwargs,
+    ):
+        """
+        Asynchronously generates a text completion using Azure OpenAI's Foundation models.
+        This method utilizes the chat completion API to respond to queries based on the conversation history.
+
+        :param conversation_history: A list of past conversation messages formatted as dictionaries.
+        :param query: The user's current query or message.
+        :param system_message_content: Instructions for the AI on how to behave during the completion.
+        :param temperature: Controls randomness in the generation, lower values mean less random completions.
+        :param max_tokens: The maximum number of tokens to generate.
+        :param seed: Seed for random number generator for reproducibility.
+        :param top_p: Nucleus sampling parameter controlling the size of the probability mass considered for token generation.
+        :return: The generated text completion or None if an error occurs.
+        """
+
+        messages_for_api = conversation_history + [
+            {"role": "system", "content": system_message_content},
+            {"role": "user", "content": query},
+        ]
+
+        response = None
+        try:
+            request = dict(
+                messages=messages_for_api,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                seed=seed,
+                top_p=top_p,
+                **kwargs,
+            )
+            tokens = self._estimate_request_tokens(
+                messages_for_api, max_tokens=max_tokens
+            )
+            if deployment_name:
+                response = await self._async_call_with_rate_limit(
+                    self.get_async_azure_openai_client().chat.completions.with_raw_response.create,
+                    deployment_name,
+                    tokens,
+                    **request,
+                )
+            else:
+                response = await self._async_call_chat_completions(tokens, **request)
+            if kwargs.get("stream"):
+                # Drain the stream without blocking the event loop
+                response_content = ""
+                async for event in response:
+                    if event.choices:
+                        event_text = event.choices[0].delta
+                        if event_text and event_text.content:
+                            response_content += event_text.content
+                return response_content
+            return response.choices[0].message.content
+        except Exception as e:
+            logger.error(f"An error occurred: {str(e)}")
+
+        return None
+
+    async def async_generate_chat_response(
+        self,
+        query: str,
+        conversation_history: Optional[Union[List[Dict[str, Any]], ConversationHistory]] = None,
+        image_paths: List[str] = None,
+        image_bytes: List[bytes] = None,
+        system_message_content: str = "You are an AI assistant that helps people find information. Please be precise, polite, and concise.",
+        temperature: float = 0.7,
+        max_tokens: int = 150,
+        seed: int = 42,
+        top_p: float = 1.0,
+        **kwargs,
+    ) -> Tuple[Optional[str], Optional[List[Dict[str, Any]]]]:
+        """
+        Asynchronously generates a text response considering the conversation history.
+
+        Mirrors `generate_chat_response` but awaits the shared `AsyncAzureOpenAI` client, so many
+        calls can run concurrently on one event loop without a thread per request.
+
+        :param query: The latest query to generate a response for.
+        :param conversation_history: A list of message dictionaries or a `ConversationHistory` representing the
+            conversation history. A `ConversationHistory` keeps the prompt within its token budget.
+        :param image_paths: A list of paths to images to include in the query.
+        :param image_bytes: A list of raw images to include in the query.
+        :param system_message_content: The content of the system message.
+        :param temperature: Controls randomness in the output. Defaults to 0.7.
+        :param max_tokens: Maximum number of tokens to generate. Defaults to 150.
+        :param seed: Random seed for deterministic output. Defaults to 42.
+        :param top_p: The cumulative probability cutoff for token selection. Defaults to 1.0.
+
+        :return: A tuple with the generated text response and the updated conversation history, or (None, None) if an error occurs.
+        """
+        try:
+            conversation_history, history_messages = self._prepare_history(
+                conversation_history, system_message_content
+            )
+            user_message = self._build_user_message(query, image_paths, image_bytes)
+            messages_for_api = history_messages + [user_message]
+            fingerprint = self._semantic_fingerprint(
+                history_messages,
+                user_message,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                seed=seed,
+                top_p=top_p,
+                **kwargs,
+            )
+            response_content, query_vector = await self._async_semantic_cache_lookup(
+                query, fingerprint
+            )
+            if response_content is None:
+                logger.info(f"Sending async request to Azure OpenAI with query: {query}")
+                response = await self._async_call_chat_completions(
+                    self._estimate_request_tokens(messages_for_api, max_tokens=max_tokens),
+                    messages=messages_for_api,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    seed=seed,
+                    top_p=top_p,
+                    **kwargs,
+                )
+                response_content = response.choices[0].message.content
+                if query_vector is not None and response_content:
+                    self.semantic_cache.store(
+                        fingerprint,
+                        query_vector,
+                        response_content,
+                        response.usage.total_tokens if response.usage else 0,
+                    )
+
+            await self._async_record_turn(
+                conversation_history, user_message, response_content
+            )
+
+            return response_content, conversation_history
+
+        except openai.APIConnectionError as e:
+            logger.error("The server could not be reached")
+            logger.error(e.__cause__)
+            return None, None
+        except openai.RateLimitError:
+            logger.error("A 429 status code was received; we should back off a bit.")
+            return None, None
+        except openai.APIStatusError as e:
+            logger.error("Another non-200-range status code was received")
+            logger.error(e.status_code)
+            logger.error(e.response)
+            return None, None
+        except Exception as e:
+            logger.error(f"Contextual response generation error: {e}")
+            return None, None
+
+    def _stream_options(self) -> Dict[str, Any]:
+        """
+        Returns the request parameters asking the service to report usage at the end of a stream.
+
+        `stream_options` is only accepted from API version 2024-09-01-preview on; with older versions usage is
+        estimated from the streamed text instead.
+
+        :return: The extra request parameters.
+        """
+        if self.api_version >= "2024-09-01":
+            return {"stream_options": {"include_usage": True}}
+        return {}
+
+    def _finish_stream(self, metrics: StreamMetrics) -> StreamMetrics:
+        """
+        Completes the metrics of a stream, estimating the completion tokens when usage was not reported.
+
+        :param metrics: The metrics of the stream.
+        :return: The completed metrics.
+        """
+        completion_tokens = None
+        if metrics.usage is None:
+            completion_tokens = self.count_tokens(metrics.content)
+        metrics.finish(completion_tokens)
+        self.metrics.record_stream("openai", self.chat_model_name, metrics)
+        return metrics
+
+    def stream_chat_response(
+        self,
+        query: str,
+        conversation_history: Optional[Union[List[Dict[str, Any]], ConversationHistory]] = None,
+        image_paths: List[str] = None,
+        image_bytes: List[bytes] = None,
+        system_message_content: str = "You are an AI assistant that helps people find information. Please be precise, polite, and concise.",
+        temperature: float = 0.7,
+        max_tokens: int = 150,
+        seed: int = 42,
+        top_p: float = 1.0,
+        **kwargs,
+    ) -> Iterator[Union[str, StreamMetrics]]:
+        """
+        Streams a text response considering the conversation history.
+
+        Yields each text delta as soon as it arrives, then a final `StreamMetrics` with the full response, the
+        usage and the time-to-first-token and tokens/sec of the stream. The conversation history is updated once
+        the stream completes. Errors are logged and end the stream.
+
+        :param query: The latest query to generate a response for.
+        :param conversation_history: A list of message dictionaries or a `ConversationHistory` representing the
+            conversation history. A `ConversationHistory` keeps the prompt within its token budget.
+        :param image_paths: A list of paths to images to include in the query.
+        :param image_bytes: A list of raw images to include in the query.
+        :param system_message_content: The content of the system message.
+        :param temperature: Controls randomness in the output. Defaults to 0.7.
+        :param max_tokens: Maximum number of tokens to generate. Defaults to 150.
+        :param seed: Random seed for deterministic output. Defaults to 42.
+        :param top_p: The cumulative probability cutoff for token selection. Defaults to 1.0.
+
+        :return: An iterator of text deltas followed by the stream metrics.
+        """
+        response = None
+        try:
+            conversation_history, history_messages = self._prepare_history(
+                conversation_history, system_message_content
+            )
+            user_message = self._build_user_message(query, image_paths, image_bytes)
+            messages_for_api = history_messages + [user_message]
+            logger.info(f"Streaming request to Azure OpenAI with query: {query}")
+
+            metrics = StreamMetrics()
+            response = self._call_chat_completions(
+                self._estimate_request_tokens(messages_for_api, max_tokens=max_tokens),
+                messages=messages_for_api,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                seed=seed,
+                top_p=top_p,
+                stream=True,
+                **self._stream_options(),
+                **kwargs,
+            )
+            for event in response:
+                if event.usage is not None:
+                    metrics.usage = event.usage
+                if event.choices and event.choices[0].delta.content:
+                    metrics.on_delta(event.choices[0].delta.content)
+                    yield event.choices[0].delta.content
+
+            self._record_turn(conversation_history, user_message, metrics.content)
+            yield self._finish_stream(metrics)
+
+        except openai.APIConnectionError as e:
+            logger.error("The server could not be reached")
+            logger.error(e.__cause__)
+        except openai.RateLimitError:
+            logger.error("A 429 status code was received; we should back off a bit.")
+        except openai.APIStatusError as e:
+            logger.error("Another non-200-range status code was received")
+            logger.error(e.status_code)
+            logger.error(e.response)
+        except Exception as e:
+            logger.error(f"Streaming response generation error: {e}")
+        finally:
+            if response is not None:
+                response.close()
+
+    async def async_stream_chat_response(
+        self,
+        query: str,
+        conversation_history: Optional[Union[List[Dict[str, Any]], ConversationHistory]] = None,
+        image_paths: List[str] = None,
+        image_bytes: List[bytes] = None,
+        system_message_content: str = "You are an AI assistant that helps people find information. Please be precise, polite, and concise.",
+        temperature: float = 0.7,
+        max_tokens: int = 150,
+        seed: int = 42,
+        top_p: float = 1.0,
+        **kwargs,
+    ) -> AsyncIterator[Union[str, StreamMetrics]]:
+        """
+        Asynchronously streams a text response considering the conversation history. See `stream_chat_response`.
+
+        :param query: The latest query to generate a response for.
+        :param conversation_history: A list of message dictionaries or a `ConversationHistory` representing the
+            conversation history. A `ConversationHistory` keeps the prompt within its token budget.
+        :param image_paths: A list of paths to images to include in the query.
+        :param image_bytes: A list of raw images to include in the query.
+        :param system_message_content: The content of the system message.
+        :param temperature: Controls randomness in the output. Defaults to 0.7.
+        :param max_tokens: Maximum number of tokens to generate. Defaults to 150.
+        :param seed: Random seed for deterministic output. Defaults to 42.
+        :param top_p: The cumulative probability cutoff for token selection. Defaults to 1.0.
+
+        :return: An async iterator of text deltas followed by the stream metrics.
+        """
+        response = None
+        try:
+            conversation_history, history_messages = self._prepare_history(
+                conversation_history, system_message_content
+            )
+            user_message = self._build_user_message(query, image_paths, image_bytes)
+            messages_for_api = history_messages + [user_message]
+            logger.info(f"Streaming async request to Azure OpenAI with query: {query}")
+
+            metrics = StreamMetrics()
+            response = await self._async_call_chat_completions(
+                self._estimate_request_tokens(messages_for_api, max_tokens=max_tokens),
+                messages=messages_for_api,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                seed=seed,
+                top_p=top_p,
+                stream=True,
+                **self._stream_options(),
+                **kwargs,
+            )
+            async for event in response:
+                if event.usage is not None:
+                    metrics.usage = event.usage
+                if event.choices and event.choices[0].delta.content:
+                    metrics.on_delta(event.choices[0].delta.content)
+                    yield event.choices[0].delta.content
+
+            await self._async_record_turn(
+                conversation_history, user_message, metrics.content
+            )
+            yield self._finish_stream(metrics)
+
+        except openai.APIConnectionError as e:
+            logger.error("The server could not be reached")
+            logger.error(e.__cause__)
+        except openai.RateLimitError:
+            logger.error("A 429 status code was received; we should back off a bit.")
+        except openai.APIStatusError as e:
+            logger.error("Another non-200-range status code was received")
+            logger.error(e.status_code)
+            logger.error(e.response)
+        except Exception as e:
+            logger.error(f"Streaming response generation error: {e}")
+        finally:
+            if response is not None:
+                await response.close()
+
+    async def async_generate_embedding(
+        self, input_text: str, model_name: Optional[str] = None, **kwargs
+    ) -> Optional[str]:
+        """
+        Asynchronously generates an embedding for the given input text.
+
+        :param input_text: The text to generate an embedding for.
+        :param model_name: The name of the model to use for generating the embedding. If None, the default embedding model is used.
+        :param kwargs: Additional parameters for the API request.
+        :return: The embedding as a JSON string, or None if an error occurred.
+        """
+        deployment = model_name or self.embedding_model_name
+        cached, pending = self._lookup_cached_embeddings(
+            deployment, kwargs.get("dimensions"), [input_text]
+        )
+        if not pending:
+            return self._cached_embedding_response(deployment, cached[0])
+        try:
+            response = await self._async_call_with_rate_limit(
+                self.get_async_azure_openai_client().embeddings.with_raw_response.create,
+                deployment,
+                sum(self._count_text_tokens([input_text], deployment)),
+                input=input_text,
+                **kwargs,
+            )
+            self._merge_cached_embeddings(
+                deployment,
+                kwargs.get("dimensions"),
+                [input_text],
+                cached,
+                pending,
+                np.asarray([response.data[0].embedding], dtype=np.float32),
+            )
+            return response.model_dump_json(indent=2)
+
+        except openai.APIConnectionError as e:
+            logger.error("The server could not be reached")
+            logger.error(e.__cause__)
+            return None
+        except openai.RateLimitError:
+            logger.error("A 429 status code was received; we should back off a bit.")
+            return None
+        except openai.APIStatusError as e:
+            logger.error("Another non-200-range status code was received")
+            logger.error(e.status_code)
+            logger.error(e.response)
+            return None
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            return None
+
+    async def async_generate_embeddings(
+        self,
+        texts: List[str],
+        model_name: Optional[str] = None,
+        max_inputs: int = EMBEDDING_MAX_INPUTS,
+        max_batch_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+        max_concurrency: int = 4,
+        **kwargs,
+    ) -> Optional[np.ndarray]:
+        """
+        Asynchronously generates embeddings for many texts. See `generate_embeddings`.
+
+        :param texts: The texts to generate embeddings for.
+        :param model_name: The name of the model to use for generating the embeddings. If None, the default embedding model is used.
+        :param max_inputs: The maximum number of inputs per request.
+        :param max_batch_tokens: The maximum number of tokens per request.
+        :param max_concurrency: The maximum number of requests in flight.
+        :param kwargs: Additional parameters for the API request (e.g. `dimensions`).
+        :return: A float32 array of shape (len(texts), dimensions) in input order, or None if an error occurred.
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        deployment = model_name or self.embedding_model_name
+        cached, pending = self._lookup_cached_embeddings(
+            deployment, kwargs.get("dimensions"), texts
+        )
+        if not pending:
+            return np.stack(cached).astype(np.float32, copy=False)
+        pending_texts = [texts[index] for index in pending]
+        token_counts = self._count_text_tokens(pending_texts, deployment)
+        batches = self._plan_embedding_batches(
+            token_counts, max_inputs, max_batch_tokens
+        )
+        client = self.get_async_azure_openai_client()
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def embed_batch(batch: Tuple[int, int]) -> Any:
+            start, end = batch
+            async with semaphore:
+                return await self._async_call_with_rate_limit(
+                    client.embeddings.with_raw_response.create,
+                    deployment,
+                    sum(token_counts[start:end]),
+                    input=pending_texts[start:end],
+                    encoding_format="base64",
+                    **kwargs,
+                )
+
+        try:
+            responses = await asyncio.gather(
+                *(embed_batch(batch) for batch in batches)
+            )
+            fresh = self._assemble_embeddings(len(pending_texts), batches, responses)
+            return self._merge_cached_embeddings(
+                deployment, kwargs.get("dimensions"), texts, cached, pending, fresh
+            )
+        except openai.APIConnectionError as e:
+            logger.error("The server could not be reached")
+            logger.error(e.__cause__)
+            return None
+        except openai.RateLimitError:
+            logger.error("A 429 status code was received; we should back off a bit.")
+            return None
+        except openai.APIStatusError as e:
+            logger.error("Another non-200-range status code was received")
+            logger.error(e.status_code)
+            logger.error(e.response)
+            return None
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            return None
+
+    async def async_generate_image(
         self,
-        query: str,
-        temperature: float = 0.5,
-        max_tokens: int = 100,
-        model_name: Optional[str] = None,
-        top_p: float = 1.0,
-        **kwargs,
+        prompt: str,
+        model: Optional[str] = None,
+        n: Optional[int] = 1,
+        quality: Literal["standard", "hd"] = "hd",
+        response_format: Optional[str] = None,
+        size: Literal[
+            "256x256", "512x512", "1024x1024", "1792x1024", "1024x1792"
+        ] = "1024x1024",
+        style: Literal["vivid", "natural"] = "vivid",
+        user: Optional[str] = None,
+        extra_headers: Optional[dict] = None,
+        extra_query: Optional[dict] = None,
+        extra_body: Optional[dict] = None,
+        timeout: Optional[float] = None,
     ) -> Optional[str]:
         """
-        Generates a text completion using Azure OpenAI's Foundation models.
+        Asynchronously generates an image for the given prompt using Azure OpenAI's DALL-E model.
 
-        :param query: The input text query for the model.
-        :param temperature: Controls randomness in the output. Default to 0.5.
-        :param max_tokens: Maximum number of tokens to generate. Defaults to 100.
-        :param model_name: The name of the AI model to use. Defaults to None.
-        :param top_p: The cumulative probability cutoff for token selection. Defaults to 1.0.
+        See `generate_image` for the meaning and defaults of each parameter. A parameter set to None is left out
+        of the request, so the service default applies. Displaying the picture is not supported here since it
+        would block the event loop.
 
-        :return: The generated text or None if an error occurs.
+        :return: The URL of the generated image, or None if an error occurred.
         """
         try:
-            response = self.openai_client.completions.create(
-                model=model_name or self.completion_model_name,
-                prompt=query,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                top_p=top_p,
-                **kwargs,
+            response = await self._async_call_with_rate_limit(
+                self.get_async_azure_openai_client().images.with_raw_response.generate,
+                model or self.dalle_model_name,
+                0,
+                prompt=prompt,
+                n=NOT_GIVEN if n is None else n,
+                quality=NOT_GIVEN if quality is None else quality,
+                response_format=(
+                    NOT_GIVEN if response_format is None else response_format
+                ),
+                size=NOT_GIVEN if size is None else size,
+                style=NOT_GIVEN if style is None else style,
+                user=NOT_GIVEN if user is None else user,
+                extra_headers=extra_headers,
+                extra_query=extra_query,
+                extra_body=extra_body,
+                timeout=timeout,
             )
-
-            completion = response.choices[0].text.strip()
-            logger.info(f"Generated completion: {completion}")
-            return completion
-
+            image_url = response.data[0].url
+            logger.info(f"Generated image URL: {image_url}")
+            return image_url
         except openai.APIConnectionError as e:
             logger.error("The server could not be reached")
             logger.error(e.__cause__)
@@ -172,61 +1711,62 @@ class AzureOpenAIManager:
             logger.error(f"OpenAI API error: {e}")
             return None
 
-    async def async_generate_chat_completion_response(
+    async def async_transcribe_audio_with_whisper(
         self,
-        conversation_history: List[Dict[str, str]],
-        query: str,
-        system_message_content: str = """You are an AI assistant that
-          helps people find information. Please be precise, polite, and concise.""",
-        temperature: float = 0.7,
-        deployment_name: str = None,
-        max_tokens: int = 150,
-        seed: int = 42,
-        top_p: float = 1.0,
-        **kwargs,
+        audio_file_path: str,
+        language: str = "en",
+        prompt: str = "Transcribe the following audio file to text.",
+        response_format: Literal["json", "text", "srt", "verbose_json", "vtt"] = "text",
+        temperature: float = 0.5,
+        timestamp_granularities: Optional[List[Literal["word", "segment"]]] = None,
+        extra_headers=None,
+        extra_query=None,
+        extra_body=None,
+        timeout: Union[float, None] = None,
     ):
         """
-        Asynchronously generates a text completion using Azure OpenAI's Foundation models.
-        This method utilizes the chat completion API to respond to queries based on the conversation history.
-
-        :param conversation_history: A list of past conversation messages formatted as dictionaries.
-        :param query: The user's current query or message.
-        :param system_message_content: Instructions for the AI on how to behave during the completion.
-        :param temperature: Controls randomness in the generation, lower values mean less random completions.
-        :param max_tokens: The maximum number of tokens to generate.
-        :param seed: Seed for random number generator for reproducibility.
-        :param top_p: Nucleus sampling parameter controlling the size of the probability mass considered for token generation.
-        :return: The generated text completion or None if an error occurs.
-        """
+        Asynchronously transcribes an audio file using the Whisper model.
 
-        messages_for_api = conversation_history + [
-            {"role": "system", "content": system_message_content},
-            {"role": "user", "content": query},
-        ]
+        See `transcribe_audio_with_whisper` for the meaning of each parameter.
 
-        response = None
+        :return: Transcription object with the audio transcription, or None if an error occurred.
+        """
         try:
-            response = self.openai_client.chat.completions.create(
-                model=deployment_name or self.chat_model_name,
-                messages=messages_for_api,
+            # Upload bytes rather than a file handle so a retried attempt re-sends the whole file
+            with open(audio_file_path, "rb") as audio_file:
+                audio = (os.path.basename(audio_file_path), audio_file.read())
+            result = await self._async_call_with_rate_limit(
+                self.get_async_azure_openai_client().audio.transcriptions.with_raw_response.create,
+                self.whisper_model_name,
+                0,
+                file=audio,
+                language=language,
+                prompt=prompt,
+                response_format=response_format,
                 temperature=temperature,
-                max_tokens=max_tokens,
-                seed=seed,
-                top_p=top_p,
-                **kwargs,
+                timestamp_granularities=timestamp_granularities or [],
+                extra_headers=extra_headers,
+                extra_query=extra_query,
+                extra_body=extra_body,
+                timeout=timeout,
             )
-            # Process and output the completion text
-            for event in response:
-                if event.choices:
-                    event_text = event.choices[0].delta
-                    if event_text:
-                        print(event_text.content, end="", flush=True)
-                        time.sleep(0.01)  # Maintain minimal sleep to reduce latency
+            return result
+        except openai.APIConnectionError as e:
+            logger.error("The server could not be reached")
+            logger.error(e.__cause__)
+            return None
+        except openai.RateLimitError:
+            logger.error("A 429 status code was received; we should back off a bit.")
+            return None
+        except openai.APIStatusError as e:
+            logger.error("Another non-200-range status code was received")
+            logger.error(e.status_code)
+            logger.error(e.response)
+            return None
         except Exception as e:
-            print(f"An error occurred: {str(e)}")
+            logger.error(f"Contextual response generation error: {e}")
+            return None
 
-        return response
-    
     def generate_image(
         self,
         prompt: str,
@@ -267,9 +1807,11 @@ class AzureOpenAIManager:
         :raises Exception: If an error occurs while making the API request.
         """
         try:
-            response = self.openai_client.images.generate(
+            response = self._call_with_rate_limit(
+                self.openai_client.images.with_raw_response.generate,
+                model or self.dalle_model_name,
+                0,
                 prompt=prompt,
-                model=model or self.dalle_model_name,
                 n=n,
                 quality=quality,
                 response_format=response_format,
@@ -285,7 +1827,7 @@ class AzureOpenAIManager:
             logger.info(f"Generated image URL: {image_url}")
 
             if show_picture:
-                response_image = requests.get(image_url)
+                response_image = self.http_session.get(image_url)
                 img = mpimg.imread(BytesIO(response_image.content))
 
                 # Create a new figure and add the image to it
@@ -348,10 +1890,16 @@ class AzureOpenAIManager:
             Transcription object with the audio transcription.
         """
         try:
+            # Upload bytes rather than a file handle so a retried attempt re-sends the whole file
+            with open(audio_file_path, "rb") as audio_file:
+                audio = (os.path.basename(audio_file_path), audio_file.read())
+
             # Create the transcription request
-            result = self.openai_client.audio.transcriptions.create(
-                file=open(audio_file_path, "rb"),
-                model=self.whisper_model_name,
+            result = self._call_with_rate_limit(
+                self.openai_client.audio.transcriptions.with_raw_response.create,
+                self.whisper_model_name,
+                0,
+                file=audio,
                 language=language,
                 prompt=prompt,
                 response_format=response_format,
@@ -379,10 +1927,223 @@ class AzureOpenAIManager:
             logger.error(f"Contextual response generation error: {e}")
             return None
 
+    @staticmethod
+    def _build_user_message(
+        query: str,
+        image_paths: Optional[Union[str, List[str]]] = None,
+        image_bytes: Optional[List[bytes]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Builds the user message for the chat completion API, attaching any images as base64 data URLs.
+
+        :param query: The text of the user message.
+        :param image_paths: A path or list of paths to images to include in the message.
+        :param image_bytes: A list of raw images to include in the message. Takes precedence over `image_paths`.
+        :return: A dictionary formatted as a user message.
+        """
+        user_message = {
+            "role": "user",
+            "content": [{"type": "text", "text": query}],
+        }
+
+        if image_bytes:
+            for image in image_bytes:
+                encoded_image = base64.b64encode(image).decode("utf-8")
+                user_message["content"].append(
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{encoded_image}",
+                        },
+                    }
+                )
+        elif image_paths:
+            if isinstance(image_paths, str):
+                image_paths = [image_paths]
+            for image_path in image_paths:
+                try:
+                    with open(image_path, "rb") as image_file:
+                        encoded_image = base64.b64encode(image_file.read()).decode(
+                            "utf-8"
+                        )
+                        user_message["content"].append(
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:image/jpeg;base64,{encoded_image}",
+                                },
+                            }
+                        )
+                except Exception as e:
+                    logger.error(f"Error processing image {image_path}: {e}")
+
+        return user_message
+
+    def _prepare_history(
+        self,
+        conversation_history: Optional[Union[List[Dict[str, Any]], ConversationHistory]],
+        system_message_content: str,
+    ) -> Tuple[Union[List[Dict[str, Any]], ConversationHistory], List[Dict[str, Any]]]:
+        """
+        Sets the system message of a conversation history and returns the messages to send before the query.
+
+        :param conversation_history: A list of message dictionaries, a `ConversationHistory`, or None for a new list.
+        :param system_message_content: The content of the system message.
+        :return: A tuple of (the history to update after the turn, the history messages for the request).
+        """
+        if isinstance(conversation_history, ConversationHistory):
+            conversation_history.system_message = system_message_content
+            return conversation_history, conversation_history.to_messages()
+        if conversation_history is None:
+            conversation_history = []
+        system_message = {"role": "system", "content": system_message_content}
+        if not conversation_history or conversation_history[0] != system_message:
+            conversation_history.insert(0, system_message)
+        return conversation_history, list(conversation_history)
+
+    def _record_turn(
+        self,
+        conversation_history: Union[List[Dict[str, Any]], ConversationHistory],
+        user_message: Dict[str, Any],
+        response_content: str,
+    ) -> None:
+        """
+        Appends a turn to the conversation history. A `ConversationHistory` over its budget has its oldest
+        turns folded into the rolling summary.
+
+        :param conversation_history: The history to update.
+        :param user_message: The user message of the turn.
+        :param response_content: The assistant's response.
+        """
+        if not isinstance(conversation_history, ConversationHistory):
+            conversation_history.append(user_message)
+            conversation_history.append({"role": "assistant", "content": response_content})
+            return
+        conversation_history.add_turn(user_message, response_content)
+        evicted = conversation_history.evict_over_budget()
+        if evicted:
+            summary = self.summarize_conversation(conversation_history.summary, evicted)
+            if summary:
+                conversation_history.set_summary(summary)
+            else:
+                logger.warning(
+                    f"Dropped {len(evicted)} messages from the conversation history without summarizing them"
+                )
+
+    async def _async_record_turn(
+        self,
+        conversation_history: Union[List[Dict[str, Any]], ConversationHistory],
+        user_message: Dict[str, Any],
+        response_content: str,
+    ) -> None:
+        """
+        Awaitable counterpart of `_record_turn`.
+
+        :param conversation_history: The history to update.
+        :param user_message: The user message of the turn.
+        :param response_content: The assistant's response.
+        """
+        if not isinstance(conversation_history, ConversationHistory):
+            self._record_turn(conversation_history, user_message, response_content)
+            return
+        conversation_history.add_turn(user_message, response_content)
+        evicted = conversation_history.evict_over_budget()
+        if evicted:
+            summary = await self.async_summarize_conversation(
+                conversation_history.summary, evicted
+            )
+            if summary:
+                conversation_history.set_summary(summary)
+            else:
+                logger.warning(
+                    f"Dropped {len(evicted)} messages from the conversation history without summarizing them"
+                )
+
+    @staticmethod
+    def _summary_request(
+        previous_summary: Optional[str], messages: List[Dict[str, Any]]
+    ) -> List[Dict[str, str]]:
+        """
+        Builds the messages asking the model to fold evicted turns into the running summary.
+
+        :param previous_summary: The current summary, if any.
+        :param messages: The evicted messages, oldest first.
+        :return: The messages for the summarization request.
+        """
+        transcript = "\n\n".join(
+            f"{message['role']}: {message['content']}" for message in messages
+        )
+        return [
+            {
+                "role": "system",
+                "content": "You maintain a running summary of a conversation. Merge the previous summary and "
+                "the new messages into one concise summary. Keep facts, decisions, names, numbers, requested "
+                "formats and open questions; drop pleasantries. Answer with the summary only.",
+            },
+            {
+                "role": "user",
+                "content": f"Previous summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}",
+            },
+        ]
+
+    def summarize_conversation(
+        self,
+        previous_summary: Optional[str],
+        messages: List[Dict[str, Any]],
+        max_tokens: int = 400,
+    ) -> Optional[str]:
+        """
+        Folds messages evicted from a conversation history into its running summary.
+
+        :param previous_summary: The current summary, if any.
+        :param messages: The evicted messages, oldest first.
+        :param max_tokens: The maximum length of the new summary.
+        :return: The new summary, or None if an error occurred.
+        """
+        request = self._summary_request(previous_summary, messages)
+        try:
+            response = self._call_chat_completions(
+                self._estimate_request_tokens(request, max_tokens=max_tokens),
+                messages=request,
+                temperature=0,
+                max_tokens=max_tokens,
+            )
+            return response.choices[0].message.content
+        except Exception as e:
+            logger.error(f"Conversation summarization error: {e}")
+            return None
+
+    async def async_summarize_conversation(
+        self,
+        previous_summary: Optional[str],
+        messages: List[Dict[str, Any]],
+        max_tokens: int = 400,
+    ) -> Optional[str]:
+        """
+        Asynchronously folds messages evicted from a conversation history into its running summary.
+
+        :param previous_summary: The current summary, if any.
+        :param messages: The evicted messages, oldest first.
+        :param max_tokens: The maximum length of the new summary.
+        :return: The new summary, or None if an error occurred.
+        """
+        request = self._summary_request(previous_summary, messages)
+        try:
+            response = await self._async_call_chat_completions(
+                self._estimate_request_tokens(request, max_tokens=max_tokens),
+                messages=request,
+                temperature=0,
+                max_tokens=max_tokens,
+            )
+            return response.choices[0].message.content
+        except Exception as e:
+            logger.error(f"Conversation summarization error: {e}")
+            return None
+
     def generate_chat_response(
         self,
         query: str,
-        conversation_history: List[Dict[str, str]] = [],
+        conversation_history: Optional[Union[List[Dict[str, Any]], ConversationHistory]] = None,
         image_paths: List[str] = None,
         image_bytes: List[bytes] = None,
         system_message_content: str = "You are an AI assistant that helps people find information. Please be precise, polite, and concise.",
@@ -396,7 +2157,8 @@ class AzureOpenAIManager:
         """
         Generates a text response considering the conversation history.
 
-        :param conversation_history: A list of message dictionaries representing the conversation history.
+        :param conversation_history: A list of message dictionaries or a `ConversationHistory` representing the
+            conversation history. A `ConversationHistory` keeps the prompt within its token budget.
         :param query: The latest query to generate a response for.
         :param image_paths: A list of paths to images to include in the query.
         :param system_message_content: The content of the system message. Defaults to "You are an AI assistant that helps people find information. Please be precise, polite, and concise."
@@ -409,76 +2171,56 @@ class AzureOpenAIManager:
         :return: The generated text response or None if an error occurs.
         """
         try:
-            system_message = {"role": "system", "content": system_message_content}
-            if not conversation_history or conversation_history[0] != system_message:
-                conversation_history.insert(0, system_message)
-
-            user_message = {
-                "role": "user",
-                "content": [{"type": "text", "text": query}],
-            }
-
-            if image_bytes:
-                for image in image_bytes:
-                    encoded_image = base64.b64encode(image).decode("utf-8")
-                    user_message["content"].append(
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{encoded_image}",
-                            },
-                        }
-                    )
-            elif image_paths:
-                if isinstance(image_paths, str):
-                    image_paths = [image_paths]
-                for image_path in image_paths:
-                    try:
-                        with open(image_path, "rb") as image_file:
-                            encoded_image = base64.b64encode(image_file.read()).decode(
-                                "utf-8"
-                            )
-                            user_message["content"].append(
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{encoded_image}",
-                                    },
-                                }
-                            )
-                    except Exception as e:
-                        logger.error(f"Error processing image {image_path}: {e}")
-
-            messages_for_api = conversation_history + [user_message]
-            logger.info(f"Sending request to Azure OpenAI with query: {query}")
-
-            response = self.openai_client.chat.completions.create(
-                model=self.chat_model_name,
-                messages=messages_for_api,
+            conversation_history, history_messages = self._prepare_history(
+                conversation_history, system_message_content
+            )
+            user_message = self._build_user_message(query, image_paths, image_bytes)
+            messages_for_api = history_messages + [user_message]
+            fingerprint = self._semantic_fingerprint(
+                history_messages,
+                user_message,
                 temperature=temperature,
                 max_tokens=max_tokens,
                 seed=seed,
                 top_p=top_p,
-                stream=stream,
                 **kwargs,
             )
+            response_content, query_vector = (
+                (None, None)
+                if stream
+                else self._semantic_cache_lookup(query, fingerprint)
+            )
+            if response_content is None:
+                logger.info(f"Sending request to Azure OpenAI with query: {query}")
+                response = self._call_chat_completions(
+                    self._estimate_request_tokens(messages_for_api, max_tokens=max_tokens),
+                    messages=messages_for_api,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    seed=seed,
+                    top_p=top_p,
+                    stream=stream,
+                    **kwargs,
+                )
 
-            if stream:
-                response_content = ""
-                for event in response:
-                    if event.choices:
-                        event_text = event.choices[0].delta
-                        if event_text is None or event_text.content is None:
-                            continue
-                        print(event_text.content, end="", flush=True)
-                        response_content += event_text.content
-                        time.sleep(0.001)  # Maintain minimal sleep to reduce latency
-                        # FIXME: Add a check for the end of the conversation
-            else:
-                response_content = response.choices[0].message.content
-
-            conversation_history.append(user_message)
-            conversation_history.append({"role": "system", "content": response_content})
+                if stream:
+                    # Use `stream_chat_response` to consume deltas as they arrive
+                    response_content = "".join(
+                        event.choices[0].delta.content
+                        for event in response
+                        if event.choices and event.choices[0].delta.content
+                    )
+                else:
+                    response_content = response.choices[0].message.content
+                    if query_vector is not None and response_content:
+                        self.semantic_cache.store(
+                            fingerprint,
+                            query_vector,
+                            response_content,
+                            response.usage.total_tokens if response.usage else 0,
+                        )
+
+            self._record_turn(conversation_history, user_message, response_content)
 
             return response_content, conversation_history
 
@@ -538,9 +2280,11 @@ class AzureOpenAIManager:
         :raises Exception: If an error occurs while making the API request.
         """
         try:
-            response = self.openai_client.images.generate(
+            response = self._call_with_rate_limit(
+                self.openai_client.images.with_raw_response.generate,
+                model or self.dalle_model_name,
+                0,
                 prompt=prompt,
-                model=model or self.dalle_model_name,
                 n=n,
                 quality=quality,
                 response_format=response_format,
@@ -556,7 +2300,7 @@ class AzureOpenAIManager:
             logger.info(f"Generated image URL: {image_url}")
 
             if show_picture:
-                response_image = requests.get(image_url)
+                response_image = self.http_session.get(image_url)
                 img = mpimg.imread(BytesIO(response_image.content))
 
                 # Create a new figure and add the image to it
@@ -598,15 +2342,33 @@ class AzureOpenAIManager:
         :return: The embedding as a JSON string, or None if an error occurred.
         :raises Exception: If an error occurs while making the API request.
         """
+        deployment = model_name or self.embedding_model_name
+        cached, pending = self._lookup_cached_embeddings(
+            deployment, kwargs.get("dimensions"), [input_text]
+        )
+        if not pending:
+            return self._cached_embedding_response(deployment, cached[0])
         try:
-            response = self.openai_client.embeddings.create(
+            response = self._call_with_rate_limit(
+                self.openai_client.embeddings.with_raw_response.create,
+                deployment,
+                sum(self._count_text_tokens([input_text], deployment)),
                 input=input_text,
-                model=model_name or self.embedding_model_name,
                 **kwargs,
             )
+            self._merge_cached_embeddings(
+                deployment,
+                kwargs.get("dimensions"),
+                [input_text],
+                cached,
+                pending,
+                np.asarray([response.data[0].embedding], dtype=np.float32),
+            )
 
             embedding = response.model_dump_json(indent=2)
-            logger.info(f"Created embedding: {embedding}")
+            logger.info(
+                f"Created embedding of {len(response.data[0].embedding)} dimensions"
+            )
             return embedding
 
         except openai.APIConnectionError as e:
@@ -625,6 +2387,76 @@ class AzureOpenAIManager:
             logger.error(f"OpenAI API error: {e}")
             return None
 
+    def generate_embeddings(
+        self,
+        texts: List[str],
+        model_name: Optional[str] = None,
+        max_inputs: int = EMBEDDING_MAX_INPUTS,
+        max_batch_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+        max_concurrency: int = 4,
+        **kwargs,
+    ) -> Optional[np.ndarray]:
+        """
+        Generates embeddings for many texts, packing them into token-bounded batches sent concurrently.
+
+        Embeddings are requested base64-encoded and decoded straight into a contiguous float32 matrix.
+
+        :param texts: The texts to generate embeddings for.
+        :param model_name: The name of the model to use for generating the embeddings. If None, the default embedding model is used.
+        :param max_inputs: The maximum number of inputs per request.
+        :param max_batch_tokens: The maximum number of tokens per request.
+        :param max_concurrency: The maximum number of requests in flight.
+        :param kwargs: Additional parameters for the API request (e.g. `dimensions`).
+        :return: A float32 array of shape (len(texts), dimensions) in input order, or None if an error occurred.
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        deployment = model_name or self.embedding_model_name
+        cached, pending = self._lookup_cached_embeddings(
+            deployment, kwargs.get("dimensions"), texts
+        )
+        if not pending:
+            return np.stack(cached).astype(np.float32, copy=False)
+        pending_texts = [texts[index] for index in pending]
+        token_counts = self._count_text_tokens(pending_texts, deployment)
+        batches = self._plan_embedding_batches(
+            token_counts, max_inputs, max_batch_tokens
+        )
+
+        def embed_batch(batch: Tuple[int, int]) -> Any:
+            start, end = batch
+            return self._call_with_rate_limit(
+                self.openai_client.embeddings.with_raw_response.create,
+                deployment,
+                sum(token_counts[start:end]),
+                input=pending_texts[start:end],
+                encoding_format="base64",
+                **kwargs,
+            )
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                responses = list(executor.map(embed_batch, batches))
+            fresh = self._assemble_embeddings(len(pending_texts), batches, responses)
+            return self._merge_cached_embeddings(
+                deployment, kwargs.get("dimensions"), texts, cached, pending, fresh
+            )
+        except openai.APIConnectionError as e:
+            logger.error("The server could not be reached")
+            logger.error(e.__cause__)
+            return None
+        except openai.RateLimitError:
+            logger.error("A 429 status code was received; we should back off a bit.")
+            return None
+        except openai.APIStatusError as e:
+            logger.error("Another non-200-range status code was received")
+            logger.error(e.status_code)
+            logger.error(e.response)
+            return None
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            return None
+
     def call_azure_openai_chat_completions_api(
         self, body: dict = None, api_version: str = "2023-11-01"
     ):
@@ -642,29 +2474,142 @@ class AzureOpenAIManager:
             "api-key": self.api_key,
         }
 
-        with requests.Session() as session:
-            session.headers.update(headers)
+        body = body or {}
+        rate_limit_key = self._rate_limit_key(self.chat_model_name)
+        tokens = self._estimate_request_tokens(
+            body.get("messages"), max_tokens=body.get("max_tokens")
+        )
 
-            try:
-                response = session.post(url, json=body)
+        def attempt() -> requests.Response:
+            self.scheduler.acquire(rate_limit_key, tokens)
+            with self.metrics.track(
+                "openai", "chat.completions", self.chat_model_name
+            ) as call:
+                try:
+                    response = self.http_session.post(url, headers=headers, json=body)
+                except Exception:
+                    self.rate_limiter.release(rate_limit_key, tokens)
+                    raise
+                if response.status_code == 429:
+                    self.rate_limiter.penalize(rate_limit_key, tokens, response.headers)
+                else:
+                    self.rate_limiter.update_from_headers(
+                        rate_limit_key, tokens, response.headers
+                    )
+                call.request_bytes = len(response.request.body or b"")
+                call.response_bytes = len(response.content)
                 response.raise_for_status()  # Raises HTTPError for bad responses
-            except requests.ConnectionError as e:
-                logger.error("The server could not be reached")
-                logger.error(e.__cause__)
-                return None, None, {}
-            except requests.HTTPError as e:
+                payload = response.json()
+                call.set_usage(payload.get("usage"), payload.get("model"))
+                self._calibrate(
+                    self.chat_model_name,
+                    body,
+                    (payload.get("usage") or {}).get("prompt_tokens"),
+                )
+                return response
+
+        try:
+            response = self.retry_policy.call(attempt)
+        except requests.ConnectionError as e:
+            logger.error("The server could not be reached")
+            logger.error(e.__cause__)
+            return None, None, {}
+        except requests.HTTPError as e:
+            if e.response.status_code == 429:
+                logger.error("A 429 status code was received; we should back off a bit.")
+            else:
                 logger.error(
-                    "A 429 status code was received; we should back off a bit."
+                    f"A {e.response.status_code} status code was received from the API."
                 )
-                return response.status_code, e.response.json(), {}
-            except Exception as err:
-                logger.error(f"An error occurred: {err}")
-                return None, None, {}
+            return e.response.status_code, e.response.json(), {}
+        except Exception as err:
+            logger.error(f"An error occurred: {err}")
+            return None, None, {}
 
         # Extract rate limit headers and usage details
         rate_limit_headers = extract_rate_limit_and_usage_info(response)
         return response.status_code, response.json(), rate_limit_headers
 
+    async def async_analyze_chat_completion_token_count_results(
+        self,
+        conversations: List[List[Dict[str, Any]]],
+        model: Optional[str] = None,
+        deployments: Optional[List[str]] = None,
+        max_concurrency: int = 16,
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Measures the accuracy of the token estimator against the prompt tokens reported by Azure OpenAI.
+
+        Every conversation is sent concurrently to each deployment with `max_tokens=1`, over the pooled async
+        client and under the rate limiter, and its estimate is compared with `usage.prompt_tokens`.
+        With a token calibrator, the estimates use the calibrated coefficients and the responses feed the
+        calibration.
+
+        :param conversations: A list of conversations, each a list of chat messages.
+        :param model: The model name used for estimation. Defaults to the model reported by each response,
+            so the accuracy is measured for the model actually serving the deployment.
+        :param deployments: The deployments to measure. Defaults to the chat deployment.
+        :param max_concurrency: The maximum number of requests in flight.
+        :return: A tuple of (one row per conversation and deployment, the per-model bias and variance table from
+            `summarize_token_estimation_results`). Failed requests are logged and left out.
+        """
+        deployments = deployments or [self.chat_model_name]
+        semaphore = asyncio.Semaphore(max_concurrency)
+        client = self.get_async_azure_openai_client()
+
+        async def measure(
+            index: int, deployment: str, conversation: List[Dict[str, Any]]
+        ) -> Optional[Dict[str, Any]]:
+            async with semaphore:
+                try:
+                    response = await self._async_call_with_rate_limit(
+                        client.chat.completions.with_raw_response.create,
+                        deployment,
+                        self._estimate_request_tokens(conversation, max_tokens=1),
+                        messages=conversation,
+                        max_tokens=1,
+                        temperature=0,
+                    )
+                except Exception as e:
+                    logger.warning(
+                        f"Token count request failed for conversation {index} on '{deployment}': {e}"
+                    )
+                    return None
+            return {
+                "conversation": index,
+                "deployment": deployment,
+                "model": response.model,
+                "estimated_tokens": self.tokenizer.estimate_tokens_azure_openai(
+                    conversation, model or response.model
+                ),
+                "actual_tokens": response.usage.prompt_tokens,
+            }
+
+        measurements = await asyncio.gather(
+            *(
+                measure(index, deployment, conversation)
+                for deployment in deployments
+                for index, conversation in enumerate(conversations)
+            )
+        )
+        results = pd.DataFrame(
+            [m for m in measurements if m is not None],
+            columns=[
+                "conversation",
+                "deployment",
+                "model",
+                "estimated_tokens",
+                "actual_tokens",
+            ],
+        )
+        failed = len(measurements) - len(results)
+        summary = summarize_token_estimation_results(results)
+        logger.info(
+            f"Token estimation accuracy over {len(results)} requests ({failed} failed):\n"
+            f"{summary.to_string()}"
+        )
+        return results, summary
+
     def analyze_chat_completion_token_count_results(
         self, conversations: List[List[Dict[str, Any]]], model: str
     ) -> Tuple[List[Dict[str, Any]], int, int]:
@@ -672,49 +2617,34 @@ class AzureOpenAIManager:
         Analyze a list of conversations to compare the estimated token counts against actual values.
         This function is intended to analyze results from Azure OpenAI's chat completion API.
 
+        The conversations are measured concurrently; see `async_analyze_chat_completion_token_count_results`
+        for the per-model bias and variance table.
+
         :param conversations: A list of conversation prompts.
         :param model: The name of the model used for token estimation.
 
         :return: A tuple containing the analysis results, total estimated tokens, and total actual tokens.
+        :raises RuntimeError: If called from a running event loop, e.g. in a notebook or an async app.
         """
-        analysis_results = []
-        total_estimated = 0
-        total_actual = 0
-
-        for conversation in conversations:
-            body = {
-                "max_tokens": 24,
-                "temperature": 1,
-                "top_p": 1,
-                "user": "",
-                "n": 1,
-                "presence_penalty": 0,
-                "frequency_penalty": 0,
-                "messages": conversation,
-            }
-
-            (
-                status_code,
-                response,
-                rate_limit_info,
-            ) = self.call_azure_openai_chat_completions_api(
-                body=body, api_version="2023-05-15"
-            )
-
-            if status_code != 200:
-                print(f"API call failed for conversation: {json.dumps(conversation)}")
-                continue
-
-            estimated_tokens = self.tokenizer.estimate_tokens_azure_openai(
-                conversation, model
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError(
+                "analyze_chat_completion_token_count_results cannot run inside an event loop; "
+                "await async_analyze_chat_completion_token_count_results instead."
             )
-            actual_tokens = rate_limit_info["prompt-tokens"]
-
-            analysis_results.append(
-                {"estimated_tokens": estimated_tokens, "actual_tokens": actual_tokens}
+        results, _ = asyncio.run(
+            self.async_analyze_chat_completion_token_count_results(
+                conversations, model=model
             )
-
-            total_estimated += estimated_tokens
-            total_actual += actual_tokens
-
-        return analysis_results, total_estimated, total_actual
+        )
+        analysis_results = results[["estimated_tokens", "actual_tokens"]].to_dict(
+            "records"
+        )
+        return (
+            analysis_results,
+            int(results["estimated_tokens"].sum()),
+            int(results["actual_tokens"].sum()),
+        )
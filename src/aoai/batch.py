@@ -0,0 +1,603 @@
+"""
+`batch.py` is a module for running large, non-interactive workloads through the Azure OpenAI batch API.
+
+Requests (chat, vision or embeddings) are serialized to a JSONL file, one request per line with a `custom_id`,
+submitted as a batch job, polled until the job reaches a terminal state, and the results are re-associated with
+their requests by `custom_id`. Batch jobs run against a separate quota at batch pricing, so nightly jobs such as
+re-summarizing archives do not compete with interactive traffic.
+
+The upload, job and output calls go through a `BatchExecutor`: `AzureBatchExecutor` uses the Azure OpenAI files
+and batches endpoints, and `LocalBatchExecutor` is a stand-in that runs the same file through the regular
+endpoints of an `AzureOpenAIManager`, for development and for resources without a batch deployment.
+"""
+
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Protocol,
+    Tuple,
+    Union,
+)
+
+from openai import AzureOpenAI
+
+from src.aoai.scheduler import request_priority
+from src.aoai.transport import get_shared_http_client
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+# Job states after which a batch never changes again
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+CHAT_COMPLETIONS_URL = "/chat/completions"
+EMBEDDINGS_URL = "/embeddings"
+
+# The batch API is only available from this API version on
+DEFAULT_BATCH_API_VERSION = "2024-10-21"
+
+
+class BatchExecutor(Protocol):
+    """
+    The interface of the service running batch jobs.
+    """
+
+    def submit(self, input_path: str, endpoint: str, completion_window: str) -> str:
+        """
+        Uploads a JSONL request file and starts a batch job.
+
+        :param input_path: The path of the JSONL request file.
+        :param endpoint: The endpoint every request of the file targets, e.g. "/chat/completions".
+        :param completion_window: The time frame within which the job must complete, e.g. "24h".
+        :return: The job ID.
+        """
+        ...
+
+    def retrieve(self, job_id: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Returns the state of a batch job.
+
+        :param job_id: The job ID.
+        :return: A tuple of (status, details such as request counts).
+        """
+        ...
+
+    def read_output(self, job_id: str) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the result lines of a finished job, successes and errors alike.
+
+        :param job_id: The job ID.
+        :return: An iterator over the parsed result lines.
+        """
+        ...
+
+
+class AzureBatchExecutor:
+    """
+    Runs batch jobs with the Azure OpenAI files and batches endpoints.
+    """
+
+    def __init__(self, client: AzureOpenAI):
+        """
+        Initialize the executor.
+
+        :param client: An Azure OpenAI client on an API version supporting batches (2024-07-01-preview or later).
+        """
+        self.client = client
+
+    @classmethod
+    def from_manager(cls, manager: Any) -> "AzureBatchExecutor":
+        """
+        Builds an executor on the endpoint and key of a manager, using the API version from
+        "AZURE_OPENAI_BATCH_API_VERSION" or 2024-10-21.
+
+        :param manager: The `AzureOpenAIManager` whose resource hosts the batch deployment.
+        :return: The executor.
+        """
+        return cls(
+            AzureOpenAI(
+                api_key=manager.api_key,
+                api_version=os.getenv("AZURE_OPENAI_BATCH_API_VERSION")
+                or DEFAULT_BATCH_API_VERSION,
+                azure_endpoint=manager.azure_endpoint,
+                http_client=get_shared_http_client(),
+            )
+        )
+
+    def submit(self, input_path: str, endpoint: str, completion_window: str) -> str:
+        """
+        Uploads a JSONL request file and starts a batch job.
+
+        :param input_path: The path of the JSONL request file.
+        :param endpoint: The endpoint every request of the file targets.
+        :param completion_window: The time frame within which the job must complete.
+        :return: The job ID.
+        """
+        with open(input_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        job = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=endpoint,
+            completion_window=completion_window,
+        )
+        return job.id
+
+    def retrieve(self, job_id: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Returns the state of a batch job.
+
+        :param job_id: The job ID.
+        :return: A tuple of (status, the job as a dictionary).
+        """
+        job = self.client.batches.retrieve(job_id)
+        return job.status, job.model_dump()
+
+    def read_output(self, job_id: str) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the lines of a job's output and error files.
+
+        :param job_id: The job ID.
+        :return: An iterator over the parsed result lines.
+        """
+        job = self.client.batches.retrieve(job_id)
+        for file_id in (job.output_file_id, job.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    yield json.loads(line)
+
+
+class LocalBatchExecutor:
+    """
+    A stand-in for the batch service that runs each request of the file through a manager's regular endpoints,
+    under its rate limiter and retry policy, and writes the results in the batch output format.
+    """
+
+    def __init__(
+        self,
+        manager: Any,
+        max_workers: int = 4,
+        output_directory: Optional[str] = None,
+        priority: str = "background",
+        tenant: str = "batch",
+    ):
+        """
+        Initialize the executor.
+
+        :param manager: The `AzureOpenAIManager` performing the requests.
+        :param max_workers: The maximum number of requests in flight per job.
+        :param output_directory: Where output files are written. Defaults to next to the input file.
+        :param priority: The scheduler priority class of the requests, "background" so interactive traffic goes first.
+        :param tenant: The tenant the requests are accounted to by the scheduler.
+        """
+        self.manager = manager
+        self.max_workers = max_workers
+        self.output_directory = output_directory
+        self.priority = priority
+        self.tenant = tenant
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, input_path: str, endpoint: str, completion_window: str) -> str:
+        """
+        Starts running a JSONL request file in a background thread.
+
+        :param input_path: The path of the JSONL request file.
+        :param endpoint: The endpoint every request of the file targets.
+        :param completion_window: Ignored; local jobs run immediately.
+        :return: The job ID.
+        """
+        job_id = f"local-batch-{uuid.uuid4().hex}"
+        output_path = os.path.join(
+            self.output_directory or os.path.dirname(os.path.abspath(input_path)),
+            f"{job_id}_output.jsonl",
+        )
+        with self._lock:
+            self._jobs[job_id] = {
+                "status": "in_progress",
+                "output_path": output_path,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            }
+        threading.Thread(
+            target=self._run, args=(job_id, input_path, endpoint), daemon=True
+        ).start()
+        return job_id
+
+    def _execute(self, endpoint: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Performs a single request of the file.
+
+        :param endpoint: The endpoint the request targets.
+        :param body: The request body, including the deployment as "model".
+        :return: The response as a dictionary.
+        """
+        body = dict(body)
+        deployment = body.pop("model")
+        if endpoint == CHAT_COMPLETIONS_URL:
+            create = (
+                self.manager.openai_client.chat.completions.with_raw_response.create
+            )
+            tokens = self.manager._estimate_request_tokens(
+                body.get("messages"),
+                max_tokens=body.get("max_tokens"),
+                deployment=deployment,
+            )
+        elif endpoint == EMBEDDINGS_URL:
+            create = self.manager.openai_client.embeddings.with_raw_response.create
+            tokens = self.manager._estimate_request_tokens(
+                text=body.get("input"), deployment=deployment
+            )
+        else:
+            raise ValueError(f"Unsupported batch endpoint: {endpoint}")
+        response = self.manager._call_with_rate_limit(
+            create, deployment, tokens, **body
+        )
+        return response.model_dump()
+
+    def _run_line(self, endpoint: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Performs a request line and formats its outcome as a batch output line.
+
+        :param endpoint: The endpoint the request targets.
+        :param request: The request line.
+        :return: The output line.
+        """
+        line = {"id": f"local-{uuid.uuid4().hex}", "custom_id": request["custom_id"]}
+        try:
+            with request_priority(self.priority, self.tenant):
+                body = self._execute(endpoint, request["body"])
+            line.update(response={"status_code": 200, "body": body}, error=None)
+        except Exception as e:
+            status_code = getattr(e, "status_code", None)
+            line.update(
+                response=(
+                    {"status_code": status_code, "body": None} if status_code else None
+                ),
+                error={"code": type(e).__name__, "message": str(e)},
+            )
+        return line
+
+    def _run(self, job_id: str, input_path: str, endpoint: str) -> None:
+        """
+        Runs every request of a job and writes the output file.
+
+        :param job_id: The job ID.
+        :param input_path: The path of the JSONL request file.
+        :param endpoint: The endpoint every request targets.
+        """
+        job = self._jobs[job_id]
+        try:
+            requests = list(read_jsonl(input_path))
+            with self._lock:
+                job["request_counts"]["total"] = len(requests)
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool, open(
+                job["output_path"], "w", encoding="utf-8"
+            ) as output:
+                for line in pool.map(
+                    lambda request: self._run_line(endpoint, request), requests
+                ):
+                    output.write(json.dumps(line, ensure_ascii=False) + "\n")
+                    outcome = "failed" if line["error"] else "completed"
+                    with self._lock:
+                        job["request_counts"][outcome] += 1
+            with self._lock:
+                job["status"] = "completed"
+        except Exception as e:
+            logger.error(f"Local batch job {job_id} failed: {e}")
+            with self._lock:
+                job["status"] = "failed"
+                job["errors"] = str(e)
+
+    def retrieve(self, job_id: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Returns the state of a local job.
+
+        :param job_id: The job ID.
+        :return: A tuple of (status, details).
+        """
+        with self._lock:
+            job = self._jobs[job_id]
+            return job["status"], {**job, "request_counts": dict(job["request_counts"])}
+
+    def read_output(self, job_id: str) -> Iterator[Dict[str, Any]]:
+        """
+        Yields the lines of a local job's output file.
+
+        :param job_id: The job ID.
+        :return: An iterator over the parsed result lines.
+        """
+        output_path = self._jobs[job_id]["output_path"]
+        if os.path.exists(output_path):
+            yield from read_jsonl(output_path)
+
+
+def write_jsonl(lines: Iterable[Dict[str, Any]], path: str) -> int:
+    """
+    Writes dictionaries to a JSONL file, one per line.
+
+    :param lines: The dictionaries to write.
+    :param path: The path of the file.
+    :return: The number of lines written.
+    """
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def read_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Reads a JSONL file lazily, skipping blank lines.
+
+    :param path: The path of the file.
+    :return: An iterator over the parsed lines.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class BatchJobManager:
+    """
+    Builds, submits and collects batch jobs of chat, vision and embedding requests for an `AzureOpenAIManager`.
+    """
+
+    def __init__(
+        self,
+        manager: Any,
+        executor: Optional[BatchExecutor] = None,
+        chat_deployment: Optional[str] = None,
+        embedding_deployment: Optional[str] = None,
+        completion_window: str = "24h",
+        poll_interval: float = 60.0,
+    ):
+        """
+        Initialize the batch job manager.
+
+        :param manager: The `AzureOpenAIManager` whose resource and deployments are used.
+        :param executor: The service running the jobs. Defaults to `AzureBatchExecutor.from_manager(manager)`.
+        :param chat_deployment: The batch deployment for chat and vision requests. Defaults to the environment
+            variable "AZURE_AOAI_BATCH_DEPLOYMENT_ID" or the manager's chat deployment.
+        :param embedding_deployment: The batch deployment for embedding requests. Defaults to the environment
+            variable "AZURE_AOAI_BATCH_EMBEDDING_DEPLOYMENT_ID" or the manager's embedding deployment.
+        :param completion_window: The time frame within which jobs must complete.
+        :param poll_interval: The number of seconds between two status checks.
+        """
+        self.manager = manager
+        self.executor = executor or AzureBatchExecutor.from_manager(manager)
+        self.chat_deployment = (
+            chat_deployment
+            or os.getenv("AZURE_AOAI_BATCH_DEPLOYMENT_ID")
+            or manager.chat_model_name
+        )
+        self.embedding_deployment = (
+            embedding_deployment
+            or os.getenv("AZURE_AOAI_BATCH_EMBEDDING_DEPLOYMENT_ID")
+            or manager.embedding_model_name
+        )
+        self.completion_window = completion_window
+        self.poll_interval = poll_interval
+        self._ids = itertools.count()
+
+    def _custom_id(self, custom_id: Optional[str]) -> str:
+        """
+        Returns the given custom ID, or a generated one.
+
+        :param custom_id: The caller's ID for the request, if any.
+        :return: The custom ID.
+        """
+        return custom_id if custom_id is not None else f"request-{next(self._ids)}"
+
+    def chat_request(
+        self,
+        messages: List[Dict[str, Any]],
+        custom_id: Optional[str] = None,
+        **params: Any,
+    ) -> Dict[str, Any]:
+        """
+        Builds a chat completion request line.
+
+        :param messages: The chat messages.
+        :param custom_id: The ID under which the result is returned. Generated if not provided.
+        :param params: Additional parameters of the request, e.g. temperature or max_tokens.
+        :return: The request line.
+        """
+        return {
+            "custom_id": self._custom_id(custom_id),
+            "method": "POST",
+            "url": CHAT_COMPLETIONS_URL,
+            "body": {"model": self.chat_deployment, "messages": messages, **params},
+        }
+
+    def vision_request(
+        self,
+        query: str,
+        image_paths: Optional[Union[str, List[str]]] = None,
+        image_bytes: Optional[List[bytes]] = None,
+        system_message_content: Optional[str] = None,
+        custom_id: Optional[str] = None,
+        **params: Any,
+    ) -> Dict[str, Any]:
+        """
+        Builds a chat completion request line with images attached as base64 data URLs.
+
+        :param query: The text of the user message.
+        :param image_paths: A path or list of paths to images to include in the message.
+        :param image_bytes: A list of raw images to include in the message.
+        :param system_message_content: The content of the system message, if any.
+        :param custom_id: The ID under which the result is returned. Generated if not provided.
+        :param params: Additional parameters of the request.
+        :return: The request line.
+        """
+        messages = []
+        if system_message_content:
+            messages.append({"role": "system", "content": system_message_content})
+        messages.append(
+            self.manager._build_user_message(query, image_paths, image_bytes)
+        )
+        return self.chat_request(messages, custom_id=custom_id, **params)
+
+    def embedding_request(
+        self,
+        input: Union[str, List[str]],
+        custom_id: Optional[str] = None,
+        **params: Any,
+    ) -> Dict[str, Any]:
+        """
+        Builds an embedding request line.
+
+        :param input: The text or texts to embed.
+        :param custom_id: The ID under which the result is returned. Generated if not provided.
+        :param params: Additional parameters of the request, e.g. dimensions.
+        :return: The request line.
+        """
+        return {
+            "custom_id": self._custom_id(custom_id),
+            "method": "POST",
+            "url": EMBEDDINGS_URL,
+            "body": {"model": self.embedding_deployment, "input": input, **params},
+        }
+
+    def submit(self, requests: Iterable[Dict[str, Any]], input_path: str) -> str:
+        """
+        Writes request lines to a JSONL file and submits it as a batch job.
+
+        :param requests: The request lines; they must all target the same endpoint and have unique custom IDs.
+        :param input_path: The path of the JSONL file to write.
+        :return: The job ID.
+        :raises ValueError: If the requests are empty, mix endpoints or repeat a custom ID.
+        """
+        endpoints = set()
+        custom_ids = set()
+
+        def validated() -> Iterator[Dict[str, Any]]:
+            for request in requests:
+                if request["custom_id"] in custom_ids:
+                    raise ValueError(f"Duplicate custom_id: {request['custom_id']}")
+                custom_ids.add(request["custom_id"])
+                endpoints.add(request["url"])
+                if len(endpoints) > 1:
+                    raise ValueError(
+                        f"A batch job targets a single endpoint, got {sorted(endpoints)}"
+                    )
+                yield request
+
+        count = write_jsonl(validated(), input_path)
+        if not count:
+            raise ValueError("A batch job needs at least one request")
+        job_id = self.executor.submit(
+            input_path, endpoints.pop(), self.completion_window
+        )
+        logger.info(f"Submitted batch job {job_id} with {count} requests")
+        return job_id
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> str:
+        """
+        Polls a batch job until it reaches a terminal state.
+
+        :param job_id: The job ID.
+        :param timeout: The maximum number of seconds to wait. None waits for the job's completion window.
+        :return: The terminal status, or the last status seen if the timeout expired.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            status, details = self.executor.retrieve(job_id)
+            if status in TERMINAL_STATUSES:
+                logger.info(
+                    f"Batch job {job_id} {status}: {details.get('request_counts')}"
+                )
+                return status
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.warning(f"Stopped waiting for batch job {job_id} ({status})")
+                return status
+            logger.info(f"Batch job {job_id} is {status}")
+            time.sleep(self.poll_interval)
+
+    def results(
+        self, job_id: str, custom_ids: Optional[Iterable[str]] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Collects the results of a finished batch job by custom ID.
+
+        :param job_id: The job ID.
+        :param custom_ids: The custom IDs submitted, so missing results are reported. Optional.
+        :return: A dictionary mapping each custom ID to {"status_code", "body", "error"}; "body" is the response
+            body (a chat completion or embedding response) or None, and "error" describes a failed request.
+        """
+        results = {}
+        for line in self.executor.read_output(job_id):
+            response = line.get("response") or {}
+            status_code = response.get("status_code")
+            body = response.get("body")
+            error = line.get("error")
+            if (
+                error is None
+                and status_code is not None
+                and not 200 <= status_code < 300
+            ):
+                # A request rejected by the service comes back with its error in the response body
+                error = body.get("error") if isinstance(body, dict) else None
+                error = error or {
+                    "code": str(status_code),
+                    "message": f"Request failed with status code {status_code}",
+                }
+            results[line["custom_id"]] = {
+                "status_code": status_code,
+                "body": body,
+                "error": error,
+            }
+        for custom_id in custom_ids or ():
+            if custom_id not in results:
+                results[custom_id] = {
+                    "status_code": None,
+                    "body": None,
+                    "error": {"code": "missing", "message": "No result returned"},
+                }
+        failed = sum(1 for result in results.values() if result["error"])
+        if failed:
+            logger.warning(
+                f"Batch job {job_id}: {failed} of {len(results)} requests failed"
+            )
+        return results
+
+    def run(
+        self,
+        requests: Iterable[Dict[str, Any]],
+        input_path: str,
+        timeout: Optional[float] = None,
+    ) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        Submits request lines as a batch job, waits for it and returns its results by custom ID.
+
+        :param requests: The request lines.
+        :param input_path: The path of the JSONL file to write.
+        :param timeout: The maximum number of seconds to wait for the job.
+        :return: The results as returned by `results`, or None if the job did not complete.
+        """
+        requests = list(requests)
+        try:
+            job_id = self.submit(requests, input_path)
+            status = self.wait(job_id, timeout=timeout)
+            if status != "completed":
+                logger.error(f"Batch job {job_id} ended as {status}")
+                return None
+            return self.results(job_id, [request["custom_id"] for request in requests])
+        except Exception as e:
+            logger.error(f"Batch job error: {e}")
+            return None
@@ -0,0 +1,621 @@
+"""
+`benchmark.py` is a module providing a client-side throughput benchmark of the Azure OpenAI layer.
+
+The benchmark drives `AzureOpenAIManager` (and `GPT4VisionManager` when its dependencies are installed) against
+the local `MockAzureOpenAIServer`, started in a subprocess so that its CPU time is not charged to the client. It
+sweeps concurrency, payload (text or several images) and streaming mode, and reports for every scenario:
+
+- requests per second and latency percentiles of a timed run;
+- CPU seconds per request of the client process;
+- client-side overhead per request, from a profiled run: base64 encoding, JSON serialization, logging and
+  tokenizer calls.
+
+Results are saved as JSON. Given the results of a previous run as a baseline, scenarios whose throughput dropped
+or whose CPU per request grew beyond a tolerance are reported as regressions, and the command exits with status 1:
+
+    python -m src.aoai.benchmark --output benchmark.json --baseline benchmark-main.json
+"""
+
+import argparse
+import asyncio
+import cProfile
+import json
+import os
+import platform
+import pstats
+import socket
+import subprocess  # nosec B404
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+REPOSITORY_ROOT = Path(__file__).resolve().parents[2]
+
+PAYLOADS = ("text", "multi_image")
+
+CLIENTS = ("AzureOpenAIManager", "GPT4VisionManager")
+
+# Client-side overhead categories, matched on the file of the profiled functions
+OVERHEAD_CATEGORIES: Dict[str, Callable[[str, str], bool]] = {
+    "base64": lambda filename, function: filename.endswith("base64.py"),
+    "json": lambda filename, function: f"{os.sep}json{os.sep}" in filename,
+    "logging": lambda filename, function: f"{os.sep}logging{os.sep}" in filename,
+    "tokenizer": lambda filename, function: f"{os.sep}tiktoken" in filename
+    or filename.endswith(os.path.join("aoai", "tokenizer.py"))
+    or function == "count_tokens",
+}
+
+
+class Scenario:
+    """
+    One point of the benchmark sweep.
+    """
+
+    def __init__(self, client: str, payload: str, stream: bool, concurrency: int):
+        """
+        Initialize the scenario.
+
+        :param client: The client driven: "AzureOpenAIManager" or "GPT4VisionManager".
+        :param payload: "text" for a text query, "multi_image" for a query with several images.
+        :param stream: Whether the response is streamed.
+        :param concurrency: The number of requests in flight.
+        """
+        self.client = client
+        self.payload = payload
+        self.stream = stream
+        self.concurrency = concurrency
+
+    @property
+    def name(self) -> str:
+        """
+        Returns the stable name of the scenario, used to compare runs.
+
+        :return: The scenario name.
+        """
+        mode = "stream" if self.stream else "complete"
+        return f"{self.client}/{self.payload}/{mode}/c{self.concurrency}"
+
+
+def build_scenarios(
+    concurrency: List[int],
+    payloads: List[str],
+    stream_modes: List[bool],
+    clients: List[str],
+) -> List[Scenario]:
+    """
+    Builds the sweep of scenarios. The vision client neither streams nor sends text-only payloads.
+
+    :param concurrency: The concurrency levels.
+    :param payloads: The payloads.
+    :param stream_modes: The streaming modes.
+    :param clients: The clients to drive.
+    :return: The scenarios.
+    """
+    scenarios = []
+    for client in clients:
+        for payload in payloads:
+            for stream in stream_modes:
+                if client == "GPT4VisionManager" and (stream or payload == "text"):
+                    continue
+                for level in concurrency:
+                    scenarios.append(Scenario(client, payload, stream, level))
+    return scenarios
+
+
+def overhead_breakdown(stats: pstats.Stats) -> Dict[str, float]:
+    """
+    Attributes profiled time to the client-side overhead categories.
+
+    The time of a matching function is counted only through its calls from non-matching functions, so nested
+    calls within a category (e.g. `json.dumps` calling the encoder) are not counted twice.
+
+    :param stats: The profile of a run.
+    :return: The cumulative seconds per category.
+    """
+    totals = {category: 0.0 for category in OVERHEAD_CATEGORIES}
+    for (filename, _, function), (_, _, _, cumulative, callers) in stats.stats.items():
+        for category, matches in OVERHEAD_CATEGORIES.items():
+            if not matches(filename, function):
+                continue
+            if not callers:
+                totals[category] += cumulative
+            for (caller_file, _, caller_function), edge in callers.items():
+                if not matches(caller_file, caller_function):
+                    totals[category] += edge[3]
+    return totals
+
+
+class MockServerProcess:
+    """
+    The mock server running in a subprocess, so its CPU time is not charged to the client.
+    """
+
+    def __init__(
+        self, arguments: Optional[List[str]] = None, startup_timeout: float = 15.0
+    ):
+        """
+        Initialize the process; call `start` to launch it.
+
+        :param arguments: Additional command-line arguments of the mock server.
+        :param startup_timeout: How long to wait for the server to accept connections, in seconds.
+        """
+        self.arguments = arguments or []
+        self.startup_timeout = startup_timeout
+        self.port: Optional[int] = None
+        self._process: Optional[subprocess.Popen] = None
+
+    @property
+    def endpoint(self) -> str:
+        """
+        Returns the base URL of the server.
+
+        :return: The endpoint URL.
+        """
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> "MockServerProcess":
+        """
+        Launches the server on a free port and waits until it accepts connections.
+
+        :return: The process itself, for convenience.
+        """
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            self.port = probe.getsockname()[1]
+        environment = dict(os.environ)
+        environment["PYTHONPATH"] = os.pathsep.join(
+            filter(None, [str(REPOSITORY_ROOT), environment.get("PYTHONPATH")])
+        )
+        self._process = subprocess.Popen(  # nosec B603
+            [sys.executable, "-m", "src.aoai.mock_server", "--port", str(self.port)]
+            + self.arguments,
+            cwd=str(REPOSITORY_ROOT),
+            env=environment,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError("The mock server exited during startup")
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.5):
+                    return self
+            except OSError:
+                time.sleep(0.05)
+        self.stop()
+        raise RuntimeError(
+            f"The mock server did not start within {self.startup_timeout}s"
+        )
+
+    def stop(self) -> None:
+        """
+        Terminates the server.
+        """
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait(timeout=10)
+            self._process = None
+
+    def __enter__(self) -> "MockServerProcess":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+
+class Benchmark:
+    """
+    Runs the scenarios against an endpoint and collects the results.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        requests_per_scenario: int = 200,
+        images: int = 4,
+        image_kilobytes: int = 256,
+        query_characters: int = 2000,
+        max_tokens: int = 64,
+        profile: bool = True,
+        image_directory: Optional[str] = None,
+    ):
+        """
+        Initialize the benchmark.
+
+        :param endpoint: The Azure OpenAI endpoint to drive, normally a mock server.
+        :param requests_per_scenario: The number of requests of each run.
+        :param images: The number of images of a "multi_image" payload.
+        :param image_kilobytes: The size of each image.
+        :param query_characters: The length of the query text.
+        :param max_tokens: The `max_tokens` of every request.
+        :param profile: Whether to profile a second run of each scenario to break down the client overhead.
+        :param image_directory: Where to write the images read by the vision client. Defaults to a temporary
+            directory.
+        """
+        self.endpoint = endpoint
+        self.requests_per_scenario = requests_per_scenario
+        self.max_tokens = max_tokens
+        self.profile = profile
+        self.query = ("benchmark " * (query_characters // 10 + 1))[:query_characters]
+
+        rng = np.random.default_rng(0)
+        self.images = [rng.bytes(image_kilobytes * 1024) for _ in range(images)]
+        self.image_directory = image_directory or tempfile.mkdtemp(
+            prefix="aoai-benchmark-"
+        )
+        self.image_paths = []
+        for i, image in enumerate(self.images):
+            path = os.path.join(self.image_directory, f"image-{i}.jpg")
+            with open(path, "wb") as f:
+                f.write(image)
+            self.image_paths.append(path)
+
+        self._manager = None
+        self._vision = threading.local()
+
+    def _openai_manager(self) -> Any:
+        """
+        Returns the manager driven by the benchmark, created on first use.
+
+        :return: The `AzureOpenAIManager`.
+        """
+        if self._manager is None:
+            from src.aoai.azure_openai import AzureOpenAIManager
+
+            self._manager = AzureOpenAIManager(
+                api_key="benchmark",
+                api_version="2024-10-21",
+                azure_endpoint=self.endpoint,
+                chat_model_name="benchmark-chat",
+                completion_model_name="benchmark-completion",
+                embedding_model_name="benchmark-embedding",
+            )
+        return self._manager
+
+    def _vision_manager(self) -> Any:
+        """
+        Returns the vision manager of the calling thread: the manager keeps the messages of the call being built,
+        so it cannot be shared by concurrent calls.
+
+        :return: The `GPT4VisionManager`.
+        """
+        manager = getattr(self._vision, "manager", None)
+        if manager is None:
+            from src.ocr.transformer import GPT4VisionManager
+
+            # The vision manager builds a blob client; the development-storage connection string needs no account
+            os.environ.setdefault(
+                "AZURE_STORAGE_CONNECTION_STRING", "UseDevelopmentStorage=true"
+            )
+            manager = self._vision.manager = GPT4VisionManager(
+                openai_api_base=self.endpoint,
+                deployment_name="benchmark-vision",
+                openai_api_version="2024-10-21",
+                openai_api_key="benchmark",
+            )
+        return manager
+
+    async def _openai_request(self, scenario: Scenario, index: int) -> bool:
+        """
+        Sends one request through `AzureOpenAIManager`.
+
+        :param scenario: The scenario.
+        :param index: The index of the request, making every query unique so that none is coalesced or cached.
+        :return: Whether the request succeeded.
+        """
+        manager = self._openai_manager()
+        query = f"{index}: {self.query}"
+        image_bytes = self.images if scenario.payload == "multi_image" else None
+        if scenario.stream:
+            last = None
+            async for last in manager.async_stream_chat_response(
+                query=query, image_bytes=image_bytes, max_tokens=self.max_tokens
+            ):
+                pass
+            return last is not None and not isinstance(last, str)
+        response, _ = await manager.async_generate_chat_response(
+            query=query, image_bytes=image_bytes, max_tokens=self.max_tokens
+        )
+        return response is not None
+
+    def _vision_request(self, scenario: Scenario, index: int) -> bool:
+        """
+        Sends one request through `GPT4VisionManager`.
+
+        :param scenario: The scenario.
+        :param index: The index of the request, making every query unique.
+        :return: Whether the request succeeded.
+        """
+        content = self._vision_manager().call_gpt4v_image(
+            self.image_paths,
+            system_instruction="You are a benchmark.",
+            user_instruction=f"{index}: {self.query}",
+            max_tokens=self.max_tokens,
+        )
+        return content is not None
+
+    def _run_async(
+        self, scenario: Scenario, requests: int, profiler: Optional[cProfile.Profile]
+    ) -> Tuple[List[float], int]:
+        """
+        Runs the requests of a scenario on one event loop, at most `concurrency` at a time.
+
+        :param scenario: The scenario.
+        :param requests: The number of requests.
+        :param profiler: The profiler to enable during the run, if any.
+        :return: A tuple of (latencies of the requests, number of failed requests).
+        """
+        latencies: List[float] = []
+        failures = 0
+
+        async def run() -> None:
+            nonlocal failures
+            semaphore = asyncio.Semaphore(scenario.concurrency)
+
+            async def one(index: int) -> None:
+                nonlocal failures
+                async with semaphore:
+                    started = time.perf_counter()
+                    ok = await self._openai_request(scenario, index)
+                    latencies.append(time.perf_counter() - started)
+                    failures += not ok
+
+            await asyncio.gather(*(one(i) for i in range(requests)))
+
+        if profiler is not None:
+            profiler.enable()
+        try:
+            asyncio.run(run())
+        finally:
+            if profiler is not None:
+                profiler.disable()
+        return latencies, failures
+
+    def _run_threads(
+        self,
+        scenario: Scenario,
+        requests: int,
+        profilers: Optional[List[cProfile.Profile]],
+    ) -> Tuple[List[float], int]:
+        """
+        Runs the requests of a scenario on `concurrency` threads.
+
+        :param scenario: The scenario.
+        :param requests: The number of requests.
+        :param profilers: A list collecting the profile of every request, if profiling.
+        :return: A tuple of (latencies of the requests, number of failed requests).
+        """
+
+        def one(index: int) -> Tuple[float, bool]:
+            started = time.perf_counter()
+            if profilers is None:
+                ok = self._vision_request(scenario, index)
+            else:
+                profiler = cProfile.Profile()
+                ok = profiler.runcall(self._vision_request, scenario, index)
+                profilers.append(profiler)
+            return time.perf_counter() - started, ok
+
+        with ThreadPoolExecutor(max_workers=scenario.concurrency) as executor:
+            outcomes = list(executor.map(one, range(requests)))
+        return [latency for latency, _ in outcomes], sum(not ok for _, ok in outcomes)
+
+    def _run(
+        self, scenario: Scenario, requests: int, profile: bool = False
+    ) -> Tuple[List[float], int, Optional[pstats.Stats]]:
+        """
+        Runs a scenario once.
+
+        :param scenario: The scenario.
+        :param requests: The number of requests.
+        :param profile: Whether to profile the run.
+        :return: A tuple of (latencies, failures, profile statistics or None).
+        """
+        if scenario.client == "GPT4VisionManager":
+            profilers: Optional[List[cProfile.Profile]] = [] if profile else None
+            latencies, failures = self._run_threads(scenario, requests, profilers)
+            stats = None
+            if profilers:
+                stats = pstats.Stats(profilers[0])
+                for profiler in profilers[1:]:
+                    stats.add(profiler)
+            return latencies, failures, stats
+        profiler = cProfile.Profile() if profile else None
+        latencies, failures = self._run_async(scenario, requests, profiler)
+        return latencies, failures, pstats.Stats(profiler) if profiler else None
+
+    def run_scenario(self, scenario: Scenario) -> Dict[str, Any]:
+        """
+        Measures a scenario: a timed run for throughput and CPU, then a profiled run for the overhead breakdown.
+
+        :param scenario: The scenario.
+        :return: The results of the scenario.
+        """
+        logger.info(f"Benchmarking {scenario.name}")
+        # Warm up connection pools and lazy imports before measuring
+        self._run(scenario, min(scenario.concurrency, self.requests_per_scenario))
+        cpu_started, wall_started = time.process_time(), time.perf_counter()
+        latencies, failures, _ = self._run(scenario, self.requests_per_scenario)
+        wall = time.perf_counter() - wall_started
+        cpu = time.process_time() - cpu_started
+
+        requests = len(latencies)
+        result: Dict[str, Any] = {
+            "name": scenario.name,
+            "client": scenario.client,
+            "payload": scenario.payload,
+            "stream": scenario.stream,
+            "concurrency": scenario.concurrency,
+            "requests": requests,
+            "failures": failures,
+            "wall_seconds": wall,
+            "requests_per_second": requests / wall if wall > 0 else None,
+            "cpu_seconds_per_request": cpu / requests if requests else None,
+            "latency_p50": float(np.percentile(latencies, 50)) if latencies else None,
+            "latency_p95": float(np.percentile(latencies, 95)) if latencies else None,
+        }
+        if self.profile:
+            _, _, stats = self._run(scenario, self.requests_per_scenario, profile=True)
+            breakdown = overhead_breakdown(stats)
+            result["overhead_seconds_per_request"] = {
+                category: seconds / requests for category, seconds in breakdown.items()
+            }
+            result["profiled_seconds_per_request"] = stats.total_tt / requests
+        logger.info(
+            f"{scenario.name}: {result['requests_per_second']:.1f} req/s, "
+            f"{result['cpu_seconds_per_request'] * 1000:.2f} ms CPU/request, {failures} failures"
+        )
+        return result
+
+    def run(self, scenarios: List[Scenario]) -> Dict[str, Any]:
+        """
+        Runs every scenario. Scenarios of a client whose dependencies are not installed are skipped.
+
+        :param scenarios: The scenarios.
+        :return: The report: the environment of the run and the results of every scenario.
+        """
+        results, skipped = [], []
+        for scenario in scenarios:
+            try:
+                results.append(self.run_scenario(scenario))
+            except ImportError as e:
+                logger.warning(f"Skipping {scenario.name}: {e}")
+                skipped.append(scenario.name)
+        return {
+            "created": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "requests_per_scenario": self.requests_per_scenario,
+            "scenarios": results,
+            "skipped": skipped,
+        }
+
+
+def compare_results(
+    baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float = 0.2
+) -> List[str]:
+    """
+    Compares a run with a baseline run, scenario by scenario.
+
+    :param baseline: The report of the baseline run.
+    :param current: The report of the current run.
+    :param tolerance: The relative degradation tolerated, e.g. 0.2 for 20%.
+    :return: A description of every regression; empty if there is none.
+    """
+    previous = {
+        scenario["name"]: scenario for scenario in baseline.get("scenarios", [])
+    }
+    regressions = []
+    for scenario in current.get("scenarios", []):
+        before = previous.get(scenario["name"])
+        if before is None:
+            continue
+        if (
+            before.get("requests_per_second")
+            and scenario.get("requests_per_second") is not None
+            and scenario["requests_per_second"]
+            < before["requests_per_second"] * (1 - tolerance)
+        ):
+            regressions.append(
+                f"{scenario['name']}: throughput fell from {before['requests_per_second']:.1f} "
+                f"to {scenario['requests_per_second']:.1f} req/s"
+            )
+        if (
+            before.get("cpu_seconds_per_request")
+            and scenario.get("cpu_seconds_per_request") is not None
+            and scenario["cpu_seconds_per_request"]
+            > before["cpu_seconds_per_request"] * (1 + tolerance)
+        ):
+            regressions.append(
+                f"{scenario['name']}: CPU per request rose from "
+                f"{before['cpu_seconds_per_request'] * 1000:.2f} to "
+                f"{scenario['cpu_seconds_per_request'] * 1000:.2f} ms"
+            )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Runs the benchmark from the command line.
+
+    :param argv: The command-line arguments; defaults to `sys.argv`.
+    :return: The exit status: 1 if a regression against the baseline was found, else 0.
+    """
+    parser = argparse.ArgumentParser(
+        description="Client-side throughput benchmark of the AOAI layer."
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument(
+        "--payload", choices=PAYLOADS, nargs="+", default=list(PAYLOADS)
+    )
+    parser.add_argument("--stream", choices=("off", "on", "both"), default="both")
+    parser.add_argument("--client", choices=CLIENTS, nargs="+", default=list(CLIENTS))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--image-kb", type=int, default=256)
+    parser.add_argument("--no-profile", action="store_true")
+    parser.add_argument(
+        "--endpoint", help="Drive this endpoint instead of a local mock server."
+    )
+    parser.add_argument(
+        "--mock-args",
+        nargs=argparse.REMAINDER,
+        default=[],
+        help="Arguments passed to the mock server, e.g. --latency-mean 0.05.",
+    )
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="A previous report to compare with.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    stream_modes = {"off": [False], "on": [True], "both": [False, True]}[args.stream]
+    scenarios = build_scenarios(
+        args.concurrency, args.payload, stream_modes, args.client
+    )
+
+    def run(endpoint: str) -> Dict[str, Any]:
+        benchmark = Benchmark(
+            endpoint,
+            requests_per_scenario=args.requests,
+            images=args.images,
+            image_kilobytes=args.image_kb,
+            profile=not args.no_profile,
+        )
+        return benchmark.run(scenarios)
+
+    if args.endpoint:
+        report = run(args.endpoint)
+    else:
+        with MockServerProcess(args.mock_args) as server:
+            report = run(server.endpoint)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    logger.info(
+        f"Saved the results of {len(report['scenarios'])} scenarios to {args.output}"
+    )
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_results(json.load(f), report, args.tolerance)
+        for regression in regressions:
+            logger.error(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
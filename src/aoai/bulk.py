@@ -0,0 +1,478 @@
+"""
+`bulk.py` is a module for running thousands of chat prompts through an `AzureOpenAIManager` in one go.
+
+`BulkRunner` keeps a bounded number of requests in flight, admits them through a run-wide tokens-per-minute budget
+on top of the manager's own rate limiter, and writes the results in input order to a JSONL file or a Parquet
+dataset. Progress is checkpointed next to the output, so a crashed or interrupted run resumes where it stopped
+instead of starting over. Throughput and error rate are logged while the run progresses.
+
+Each request is a dictionary with either "messages" or a "query" (and an optional "system_message_content"),
+an optional "custom_id", and any other chat completion parameters, e.g. "temperature" or "max_tokens".
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import openai
+
+from src.aoai.rate_limiter import AdaptiveRateLimiter
+from src.aoai.scheduler import request_priority
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+# The key of the run-wide budget in its own rate limiter
+_BUDGET_KEY = "bulk"
+
+# Keys of a request that are not chat completion parameters
+_REQUEST_KEYS = ("custom_id", "messages", "query", "system_message_content")
+
+
+class JsonlSink:
+    """
+    Writes result records to a JSONL file, one record per line.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the sink.
+
+        :param path: The path of the JSONL file.
+        """
+        self.path = path
+        self._file = None
+
+    def open(self, state: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Opens the file, truncating it to the last checkpointed offset when resuming.
+
+        :param state: The sink state from the last checkpoint, or None to start a new file.
+        """
+        if state is None or not os.path.exists(self.path):
+            self._file = open(self.path, "w", encoding="utf-8")
+            return
+        # Records written after the last checkpoint are run again, so they are dropped here
+        with open(self.path, "r+b") as f:
+            f.truncate(state["offset"])
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """
+        Appends a record.
+
+        :param record: The result record.
+        """
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def commit(self) -> Dict[str, Any]:
+        """
+        Makes the records written so far durable.
+
+        :return: The sink state to checkpoint.
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return {"offset": self._file.tell()}
+
+    def close(self) -> None:
+        """
+        Closes the file.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ParquetSink:
+    """
+    Writes result records to a directory of Parquet files, one file per commit. Requires `pyarrow`.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the sink.
+
+        :param path: The directory of the Parquet dataset.
+        :raises ImportError: If `pyarrow` is not installed.
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError(
+                "Writing Parquet requires the 'pyarrow' package; install it or use a .jsonl output"
+            ) from e
+        self._pa = pa
+        self._pq = pq
+        self.path = path
+        self.schema = pa.schema(
+            [
+                ("index", pa.int64()),
+                ("custom_id", pa.string()),
+                ("response", pa.string()),
+                ("finish_reason", pa.string()),
+                ("prompt_tokens", pa.int64()),
+                ("completion_tokens", pa.int64()),
+                ("latency", pa.float64()),
+                ("error", pa.string()),
+            ]
+        )
+        self._records: List[Dict[str, Any]] = []
+        self._parts = 0
+
+    def open(self, state: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Creates the directory, removing the files written after the last checkpoint when resuming.
+
+        :param state: The sink state from the last checkpoint, or None to start a new dataset.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        self._parts = state["parts"] if state else 0
+        for name in os.listdir(self.path):
+            if name.startswith("part-") and (
+                name.endswith(".tmp") or int(name[5:10]) >= self._parts
+            ):
+                os.remove(os.path.join(self.path, name))
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """
+        Buffers a record until the next commit.
+
+        :param record: The result record.
+        """
+        self._records.append(record)
+
+    def commit(self) -> Dict[str, Any]:
+        """
+        Writes the buffered records to a new Parquet file.
+
+        :return: The sink state to checkpoint.
+        """
+        if self._records:
+            table = self._pa.Table.from_pylist(self._records, schema=self.schema)
+            final_path = os.path.join(self.path, f"part-{self._parts:05d}.parquet")
+            self._pq.write_table(table, final_path + ".tmp")
+            os.replace(final_path + ".tmp", final_path)
+            self._parts += 1
+            self._records = []
+        return {"parts": self._parts}
+
+    def close(self) -> None:
+        """
+        Drops records that were never committed.
+        """
+        self._records = []
+
+
+class BulkRunner:
+    """
+    Runs many chat completion requests concurrently under a TPM budget, with ordered output and resumable progress.
+    """
+
+    def __init__(
+        self,
+        manager: Any,
+        output: Union[str, JsonlSink, ParquetSink],
+        concurrency: int = 8,
+        tokens_per_minute: Optional[int] = None,
+        checkpoint_path: Optional[str] = None,
+        checkpoint_every: int = 100,
+        report_interval: float = 10.0,
+        priority: str = "background",
+        tenant: str = "bulk",
+    ):
+        """
+        Initialize the runner.
+
+        :param manager: The `AzureOpenAIManager` performing the requests.
+        :param output: A path ending in ".parquet" for a Parquet dataset, any other path for a JSONL file, or a sink.
+        :param concurrency: The maximum number of requests in flight.
+        :param tokens_per_minute: The share of the deployment's TPM this run may use. None leaves admission to the
+            manager's rate limiter alone.
+        :param checkpoint_path: The checkpoint file. Defaults to the output path followed by ".checkpoint.json".
+        :param checkpoint_every: The number of records written between two checkpoints.
+        :param report_interval: The number of seconds between two progress reports.
+        :param priority: The scheduler priority class of the requests, "background" so interactive traffic goes first.
+        :param tenant: The tenant the requests are accounted to by the scheduler.
+        """
+        self.manager = manager
+        if isinstance(output, str):
+            output = (
+                ParquetSink(output)
+                if output.endswith(".parquet")
+                else JsonlSink(output)
+            )
+        self.sink = output
+        self.concurrency = concurrency
+        self.budget = (
+            AdaptiveRateLimiter(tokens_per_minute=tokens_per_minute)
+            if tokens_per_minute
+            else None
+        )
+        self.checkpoint_path = checkpoint_path or f"{self.sink.path}.checkpoint.json"
+        self.checkpoint_every = checkpoint_every
+        self.report_interval = report_interval
+        self.priority = priority
+        self.tenant = tenant
+        self._reset_stats()
+
+    def _reset_stats(self) -> None:
+        """
+        Resets the counters of the run.
+        """
+        self.resumed = 0
+        self.completed = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total: Optional[int] = None
+        self.started_at = time.monotonic()
+        self._reported_at = self.started_at
+
+    def _load_checkpoint(self) -> Dict[str, Any]:
+        """
+        Reads the checkpoint of a previous run.
+
+        :return: The checkpoint, or an empty one if there is none.
+        """
+        if not os.path.exists(self.checkpoint_path):
+            return {"completed": 0, "sink": None}
+        with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _checkpoint(self, completed: int, finished: bool = False) -> None:
+        """
+        Commits the sink and atomically records how many requests are durably written.
+
+        :param completed: The number of requests, counted from the start of the input, written to the sink.
+        :param finished: Whether every request of the input is written.
+        """
+        checkpoint = {
+            "completed": completed,
+            "sink": self.sink.commit(),
+            "finished": finished,
+        }
+        with open(self.checkpoint_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f)
+        os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+
+    def _build_messages(self, request: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Returns the chat messages of a request.
+
+        :param request: The request.
+        :return: The messages, built from "query" and "system_message_content" when "messages" is absent.
+        """
+        if request.get("messages"):
+            return request["messages"]
+        messages = []
+        if request.get("system_message_content"):
+            messages.append(
+                {"role": "system", "content": request["system_message_content"]}
+            )
+        messages.append({"role": "user", "content": request["query"]})
+        return messages
+
+    async def _execute(self, index: int, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Performs a request and returns its result record; failures become records with an error.
+
+        :param index: The position of the request in the input.
+        :param request: The request.
+        :return: The result record.
+        """
+        record = {
+            "index": index,
+            "custom_id": str(request.get("custom_id", index)),
+            "response": None,
+            "finish_reason": None,
+            "prompt_tokens": None,
+            "completion_tokens": None,
+            "latency": None,
+            "error": None,
+        }
+        params = {k: v for k, v in request.items() if k not in _REQUEST_KEYS}
+        admitted = 0
+        try:
+            messages = self._build_messages(request)
+            tokens = self.manager.estimate_request_tokens(
+                messages, max_tokens=params.get("max_tokens")
+            )
+            if self.budget is not None:
+                await self.budget.async_acquire(_BUDGET_KEY, tokens)
+                admitted = tokens
+            started_at = time.monotonic()
+            with request_priority(self.priority, self.tenant):
+                try:
+                    response = await self.manager.async_create_chat_completion(
+                        messages, tokens=tokens, **params
+                    )
+                except openai.APIStatusError:
+                    # The service received the request, so its tokens stay spent
+                    self._settle(admitted)
+                    raise
+                except (Exception, asyncio.CancelledError):
+                    # The request never reached the service: give its tokens back
+                    if admitted:
+                        self.budget.release(_BUDGET_KEY, admitted)
+                    raise
+            self._settle(admitted)
+            record["latency"] = time.monotonic() - started_at
+            record["response"] = response.choices[0].message.content
+            record["finish_reason"] = response.choices[0].finish_reason
+            if response.usage is not None:
+                record["prompt_tokens"] = response.usage.prompt_tokens
+                record["completion_tokens"] = response.usage.completion_tokens
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+        return record
+
+    def _settle(self, tokens: int) -> None:
+        """
+        Completes an admitted request that reached the service. Its tokens stay consumed from the budget, which
+        refills over the minute, so the budget bounds throughput rather than the tokens in flight.
+
+        :param tokens: The token cost that was admitted, 0 if the run has no budget.
+        """
+        if tokens:
+            self.budget.update_from_headers(_BUDGET_KEY, tokens, None)
+
+    def _account(self, record: Dict[str, Any]) -> None:
+        """
+        Adds a written record to the counters of the run.
+
+        :param record: The result record.
+        """
+        self.completed += 1
+        if record["error"]:
+            self.errors += 1
+        self.prompt_tokens += record["prompt_tokens"] or 0
+        self.completion_tokens += record["completion_tokens"] or 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the progress of the run.
+
+        :return: A dictionary with completed and resumed requests, errors, error rate, throughput and tokens.
+        """
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            "completed": self.completed,
+            "resumed": self.resumed,
+            "total": self.total,
+            "errors": self.errors,
+            "error_rate": self.errors / self.completed if self.completed else 0.0,
+            "requests_per_second": self.completed / elapsed,
+            "tokens_per_second": (self.prompt_tokens + self.completion_tokens)
+            / elapsed,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "elapsed": elapsed,
+        }
+
+    def _report(self, force: bool = False) -> None:
+        """
+        Logs the progress of the run, at most once per report interval unless forced.
+
+        :param force: Whether to log regardless of the interval.
+        """
+        now = time.monotonic()
+        if not force and now - self._reported_at < self.report_interval:
+            return
+        self._reported_at = now
+        stats = self.stats()
+        done = self.resumed + self.completed
+        progress = f"{done}/{self.total}" if self.total is not None else str(done)
+        logger.info(
+            f"Bulk run: {progress} requests done, {stats['requests_per_second']:.2f} req/s, "
+            f"{stats['tokens_per_second']:.0f} tokens/s, error rate {stats['error_rate']:.1%}"
+        )
+
+    async def async_run(self, requests: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Runs the requests, resuming from the checkpoint of a previous run when there is one.
+
+        Results are written in input order. At most `concurrency` requests are in flight, and at most
+        `4 * concurrency` finished results wait for a slower earlier one, which bounds memory use.
+
+        A finished run is not run again: its checkpoint is marked finished, and a new call logs a warning and
+        returns until the checkpoint is deleted.
+
+        :param requests: The requests; on resume they must be the same, in the same order.
+        :return: The final statistics of the run, as returned by `stats`.
+        """
+        self._reset_stats()
+        checkpoint = self._load_checkpoint()
+        self.resumed = checkpoint["completed"]
+        if hasattr(requests, "__len__"):
+            self.total = len(requests)
+        if checkpoint.get("finished"):
+            logger.warning(
+                f"Bulk run to {self.sink.path} already finished with {self.resumed} requests; "
+                f"delete {self.checkpoint_path} to run it again"
+            )
+            return self.stats()
+        if self.resumed:
+            logger.info(f"Resuming bulk run after {self.resumed} completed requests")
+
+        self.sink.open(checkpoint["sink"] if self.resumed else None)
+        pending_inputs = itertools.islice(enumerate(requests), self.resumed, None)
+        in_flight = set()
+        finished: Dict[int, Dict[str, Any]] = {}
+        next_index = self.resumed
+        since_checkpoint = 0
+        exhausted = False
+        try:
+            while in_flight or not exhausted:
+                while (
+                    not exhausted
+                    and len(in_flight) < self.concurrency
+                    and len(in_flight) + len(finished) < 4 * self.concurrency
+                ):
+                    item = next(pending_inputs, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    in_flight.add(asyncio.ensure_future(self._execute(*item)))
+                if not in_flight:
+                    break
+
+                done, in_flight = await asyncio.wait(
+                    in_flight, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    record = task.result()
+                    finished[record["index"]] = record
+
+                while next_index in finished:
+                    record = finished.pop(next_index)
+                    self.sink.write(record)
+                    self._account(record)
+                    next_index += 1
+                    since_checkpoint += 1
+                if since_checkpoint >= self.checkpoint_every:
+                    self._checkpoint(next_index)
+                    since_checkpoint = 0
+                self._report()
+
+            self._checkpoint(next_index, finished=True)
+        finally:
+            for task in in_flight:
+                task.cancel()
+            self.sink.close()
+        self._report(force=True)
+        return self.stats()
+
+    def run(self, requests: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Runs the requests from synchronous code; see `async_run`.
+
+        :param requests: The requests.
+        :return: The final statistics of the run.
+        """
+        return asyncio.run(self.async_run(requests))
@@ -0,0 +1,329 @@
+"""
+`calibration.py` is a module providing a token estimator calibrated on the prompt tokens Azure OpenAI bills.
+
+The token estimate of a prompt is linear in a few features: the tokens of its texts, the estimated tokens of its
+images, its number of messages and names, and a constant. The hard-coded formula (`TOKENS_PER_MESSAGE`, ...) is one
+set of coefficients. `TokenCalibrator` records the features of live prompts with their actual `prompt_tokens` and
+fits per-model corrections to these coefficients by least squares, so the estimates used for admission control
+follow new models and format changes without updating the tables by hand. Coefficients and recent samples are
+persisted to a JSON file, so a restarted process starts calibrated. Worker processes may share the file: each save
+merges the samples recorded since the previous one into the samples on disk, under a file lock.
+"""
+
+import atexit
+import collections
+import contextlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Deque, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: saves are not serialized across processes
+    fcntl = None
+
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+# Features of a prompt, in the order of the coefficients
+ESTIMATION_FEATURES = ["text_tokens", "image_tokens", "messages", "names", "constant"]
+
+
+class TokenCalibrator:
+    """
+    Fits per-model coefficients of the token estimator to the prompt tokens reported by responses.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        window: int = 1000,
+        min_samples: int = 20,
+        refit_every: int = 10,
+        sample_rate: float = 0.1,
+        save_interval: float = 60.0,
+    ):
+        """
+        Initialize the calibrator, loading the state saved at `path` if any.
+
+        :param path: The JSON file the coefficients and recent samples are persisted to. None keeps them in memory.
+        :param window: The number of recent samples per model the coefficients are fitted on.
+        :param min_samples: The number of samples of a model needed before its coefficients are corrected.
+        :param refit_every: The number of new samples of a model between fits.
+        :param sample_rate: The fraction of responses recorded once a model has `min_samples` samples, which
+            bounds the cost of re-encoding prompts.
+        :param save_interval: The shortest time between two saves, in seconds.
+        """
+        self.path = path
+        self.window = window
+        self.min_samples = min_samples
+        self.refit_every = refit_every
+        self.sample_rate = sample_rate
+        self.save_interval = save_interval
+        self._samples: Dict[str, Deque[Sequence[float]]] = {}
+        self._priors: Dict[str, np.ndarray] = {}
+        self._coefficients: Dict[str, np.ndarray] = {}
+        self._errors: Dict[str, float] = {}
+        self._pending: Dict[str, int] = collections.defaultdict(int)
+        self._unsaved: Dict[str, List[List[float]]] = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self._saved_at = float("-inf")
+        if path and os.path.exists(path):
+            self._load()
+
+    @classmethod
+    def from_env(cls) -> Optional["TokenCalibrator"]:
+        """
+        Builds a calibrator from the environment variable "AZURE_OPENAI_TOKEN_CALIBRATION_PATH".
+
+        :return: The calibrator persisted to that file, or None if no path is configured.
+        """
+        path = os.getenv("AZURE_OPENAI_TOKEN_CALIBRATION_PATH")
+        if not path:
+            return None
+        return cls(path)
+
+    def coefficients(self, model: str) -> Optional[np.ndarray]:
+        """
+        Returns the calibrated coefficients of a model.
+
+        :param model: The model name.
+        :return: The coefficients of `ESTIMATION_FEATURES`, or None while the model is not calibrated.
+        """
+        return self._coefficients.get(model)
+
+    def should_sample(self, model: str) -> bool:
+        """
+        Decides whether to record the next response of a model.
+
+        :param model: The model name.
+        :return: True for every response until the model has `min_samples` samples, then for `sample_rate` of them.
+        """
+        samples = self._samples.get(model)
+        if samples is None or len(samples) < self.min_samples:
+            return True
+        return random.random() < self.sample_rate
+
+    def record(
+        self,
+        model: str,
+        features: np.ndarray,
+        actual_tokens: int,
+        prior: np.ndarray,
+    ) -> None:
+        """
+        Records the features of a prompt with the prompt tokens billed for it, refitting the model when due.
+
+        :param model: The model name.
+        :param features: The features of the prompt, in the order of `ESTIMATION_FEATURES`.
+        :param actual_tokens: The `prompt_tokens` reported by the response.
+        :param prior: The uncalibrated coefficients of the model, which the fit corrects.
+        """
+        with self._lock:
+            samples = self._samples.setdefault(
+                model, collections.deque(maxlen=self.window)
+            )
+            sample = [float(value) for value in features] + [float(actual_tokens)]
+            samples.append(sample)
+            if self.path:
+                self._unsaved[model].append(sample)
+            self._priors[model] = np.asarray(prior, dtype=np.float64)
+            self._pending[model] += 1
+            if (
+                len(samples) < self.min_samples
+                or self._pending[model] < self.refit_every
+            ):
+                return
+            self._pending[model] = 0
+            self._fit(model)
+        self._maybe_save()
+
+    def _fit(self, model: str) -> None:
+        """
+        Fits the coefficients of a model by least squares on its recent samples. Must be called with the lock held.
+
+        The fit corrects the prior coefficients to explain the residual of the prior estimates. Features that are
+        zero in every sample (e.g. images, for a text-only workload) keep their prior coefficient.
+
+        :param model: The model name.
+        """
+        data = np.asarray(self._samples[model], dtype=np.float64)
+        features, actual = data[:, :-1], data[:, -1]
+        prior = self._priors[model]
+        active = np.any(features != 0, axis=0)
+        correction, *_ = np.linalg.lstsq(
+            features[:, active], actual - features @ prior, rcond=None
+        )
+        coefficients = prior.copy()
+        coefficients[active] += correction
+        self._coefficients[model] = coefficients
+
+        estimated = features @ coefficients
+        self._errors[model] = float(
+            np.mean(np.abs(estimated - actual) / np.maximum(actual, 1.0))
+        )
+        logger.debug(
+            f"Calibrated token estimates of {model} on {len(actual)} samples: "
+            f"mean absolute error {self._errors[model]:.2%}"
+        )
+
+    def _maybe_save(self) -> None:
+        """
+        Saves the state if a path is configured and the last save is older than `save_interval`.
+        """
+        if self.path and time.monotonic() - self._saved_at >= self.save_interval:
+            self.save()
+
+    @contextlib.contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        """
+        Holds an exclusive lock on a file next to `path`, so processes sharing the calibration save one at a time.
+        """
+        with open(f"{self.path}.lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_models(self) -> Dict[str, Any]:
+        """
+        Reads the models saved at `path`.
+
+        :return: The saved state by model, empty if there is no file or it was saved with other features.
+        """
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("features") != ESTIMATION_FEATURES:
+            return {}
+        return state.get("models", {})
+
+    def save(self) -> None:
+        """
+        Merges the samples recorded since the last save into the file at `path`, with the current coefficients.
+
+        Samples saved by other processes are kept, up to `window` per model. Samples recorded since the last
+        automatic save are lost unless `save` is called before the process exits; the process-wide calibrator
+        of `get_token_calibrator` is saved at exit.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            unsaved, self._unsaved = self._unsaved, collections.defaultdict(list)
+            priors = {model: prior.tolist() for model, prior in self._priors.items()}
+            coefficients = {
+                model: values.tolist() for model, values in self._coefficients.items()
+            }
+            self._saved_at = time.monotonic()
+        if not unsaved:
+            return
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            with self._file_lock():
+                models = self._read_models()
+                for model, samples in unsaved.items():
+                    saved = models.setdefault(model, {"samples": []})
+                    saved["samples"] = (saved["samples"] + samples)[-self.window :]
+                    saved["prior"] = priors[model]
+                    saved["coefficients"] = coefficients.get(
+                        model, saved.get("coefficients")
+                    )
+                # One temporary file per process, as worker processes share the calibration file
+                temporary_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(temporary_path, "w", encoding="utf-8") as f:
+                    json.dump({"features": ESTIMATION_FEATURES, "models": models}, f)
+                os.replace(temporary_path, self.path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not save token calibration to {self.path}: {e}")
+            with self._lock:
+                for model, samples in unsaved.items():
+                    self._unsaved[model][:0] = samples
+
+    def _load(self) -> None:
+        """
+        Loads the state saved at `path`. A file saved with other features is ignored.
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load token calibration from {self.path}: {e}")
+            return
+        if state.get("features") != ESTIMATION_FEATURES:
+            logger.warning(
+                f"Ignoring token calibration with other features: {self.path}"
+            )
+            return
+        for model, saved in state.get("models", {}).items():
+            self._samples[model] = collections.deque(
+                saved["samples"], maxlen=self.window
+            )
+            self._priors[model] = np.asarray(saved["prior"], dtype=np.float64)
+            if saved.get("coefficients") is not None:
+                self._coefficients[model] = np.asarray(
+                    saved["coefficients"], dtype=np.float64
+                )
+        logger.info(
+            f"Loaded token calibration of {len(self._coefficients)} models from {self.path}"
+        )
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the calibration of every model, for logging and dashboards.
+
+        :return: A dictionary by model with the number of samples, the coefficients by feature (None while not
+            calibrated) and the mean absolute relative error of the last fit.
+        """
+        with self._lock:
+            return {
+                model: {
+                    "samples": len(samples),
+                    "coefficients": (
+                        dict(
+                            zip(
+                                ESTIMATION_FEATURES,
+                                self._coefficients[model].round(4).tolist(),
+                            )
+                        )
+                        if model in self._coefficients
+                        else None
+                    ),
+                    "mean_absolute_error": self._errors.get(model),
+                }
+                for model, samples in self._samples.items()
+            }
+
+
+_shared_calibrator: Optional[TokenCalibrator] = None
+_shared_calibrator_loaded = False
+_shared_calibrator_lock = threading.Lock()
+
+
+def get_token_calibrator() -> Optional[TokenCalibrator]:
+    """
+    Returns the process-wide calibrator, built from the environment on first use, so every manager of the process
+    feeds and reads the same calibration file.
+
+    :return: The shared calibrator, or None if calibration is not configured.
+    """
+    global _shared_calibrator, _shared_calibrator_loaded
+    with _shared_calibrator_lock:
+        if not _shared_calibrator_loaded:
+            _shared_calibrator = TokenCalibrator.from_env()
+            _shared_calibrator_loaded = True
+            if _shared_calibrator is not None:
+                # Keep the samples recorded since the last periodic save
+                atexit.register(_shared_calibrator.save)
+        return _shared_calibrator
@@ -0,0 +1,214 @@
+"""
+`conversation.py` is a module providing a token-budgeted conversation history for chat completions.
+
+`ConversationHistory` keeps the token count of every message and a sliding window of the most recent turns.
+When the history exceeds its token budget, the oldest turns are evicted and folded into a rolling summary, so
+the prompt of a long conversation stays bounded in latency and cost instead of growing with every turn.
+Images are not kept in the history: the model has already answered about them, and a message larger than its share
+of the budget (e.g. a whole uploaded document) is truncated when it enters the history.
+"""
+
+from typing import Any, Dict, List, Optional
+
+from src.aoai.tokenizer import get_encoding_registry
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+# Tokens added by the chat format around every message
+TOKENS_PER_MESSAGE = 4
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+TRUNCATION_MARKER = "\n[... truncated {tokens} tokens]"
+
+
+class ConversationHistory:
+    """
+    A conversation history bounded by a token budget, with a sliding window and a rolling summary.
+
+    The manager's chat methods accept it wherever they accept a list of messages. After each turn they evict
+    the turns that no longer fit the budget and ask the model to merge them into the summary.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 4000,
+        min_recent_messages: int = 2,
+        system_message: Optional[str] = None,
+        deployment: Optional[str] = None,
+        max_message_tokens: Optional[int] = None,
+    ):
+        """
+        Initialize an empty history.
+
+        :param max_tokens: The token budget of the history: system message, summary and recent messages.
+        :param min_recent_messages: The number of most recent messages never evicted, whatever their size.
+        :param system_message: The content of the system message, if any.
+        :param deployment: The chat deployment the history is sent to, which determines the encoding tokens are
+            counted with. Defaults to the encoding of the current chat models.
+        :param max_message_tokens: The largest number of tokens a message keeps in the history; longer messages
+            are truncated, so the recent messages never evicted and the summary requests stay within budget.
+            Defaults to half of `max_tokens`.
+        """
+        self.max_tokens = max_tokens
+        self.min_recent_messages = min_recent_messages
+        self.max_message_tokens = (
+            max_message_tokens if max_message_tokens is not None else max_tokens // 2
+        )
+        self.system_message = system_message
+        self.summary: Optional[str] = None
+        self.messages: List[Dict[str, Any]] = []
+        self.message_tokens: List[int] = []
+        try:
+            self._encoding = get_encoding_registry().for_deployment(deployment)
+        except Exception as e:
+            logger.debug(f"Tokenizer unavailable, using heuristic token counts: {e}")
+            self._encoding = None
+
+    def count_tokens(self, text: Optional[str]) -> int:
+        """
+        Counts the tokens of a text.
+
+        :param text: The text to count.
+        :return: The number of tokens, estimated as characters/4 if the tokenizer is unavailable.
+        """
+        if not text:
+            return 0
+        if self._encoding is None:
+            return len(text) // 4 + 1
+        return len(self._encoding.encode_ordinary(text))
+
+    def _truncate(self, text: str) -> str:
+        """
+        Truncates a text to `max_message_tokens`, keeping its beginning and marking the cut.
+
+        :param text: The text of a message.
+        :return: The text, truncated if it is longer than `max_message_tokens`.
+        """
+        tokens = self.count_tokens(text)
+        if tokens <= self.max_message_tokens:
+            return text
+        if self._encoding is None:
+            kept = text[: self.max_message_tokens * 4]
+        else:
+            kept = self._encoding.decode(
+                self._encoding.encode_ordinary(text)[: self.max_message_tokens]
+            )
+        logger.info(
+            f"Truncated a message of {tokens} tokens to {self.max_message_tokens} tokens "
+            f"in the conversation history"
+        )
+        return kept + TRUNCATION_MARKER.format(tokens=tokens - self.max_message_tokens)
+
+    @staticmethod
+    def _text_content(content: Any) -> str:
+        """
+        Returns the text of a message, replacing images with a placeholder.
+
+        :param content: The message content: a string or a list of content parts.
+        :return: The text content.
+        """
+        if isinstance(content, str):
+            return content
+        parts = []
+        for part in content or []:
+            if part.get("type") == "text":
+                parts.append(part.get("text", ""))
+            else:
+                parts.append("[image]")
+        return "\n".join(parts)
+
+    @property
+    def tokens(self) -> int:
+        """
+        Returns the token count of the messages sent to the model.
+
+        :return: The total tokens of the system message, summary and window.
+        """
+        total = sum(self.message_tokens)
+        for text in (self.system_message, self._summary_text()):
+            if text:
+                total += self.count_tokens(text) + TOKENS_PER_MESSAGE
+        return total
+
+    def _summary_text(self) -> Optional[str]:
+        """
+        Returns the content of the summary message, if there is a summary.
+
+        :return: The summary message content or None.
+        """
+        return SUMMARY_PREFIX + self.summary if self.summary else None
+
+    def add_message(self, role: str, content: Any) -> None:
+        """
+        Appends a message, keeping only its text, truncated to `max_message_tokens`.
+
+        :param role: The role of the message ("user" or "assistant").
+        :param content: The content of the message.
+        """
+        text = self._truncate(self._text_content(content))
+        self.messages.append({"role": role, "content": text})
+        self.message_tokens.append(self.count_tokens(text) + TOKENS_PER_MESSAGE)
+
+    def add_turn(self, user_message: Dict[str, Any], response: str) -> None:
+        """
+        Appends a user message and the assistant's response.
+
+        :param user_message: The user message sent to the model.
+        :param response: The content of the assistant's response.
+        """
+        self.add_message(user_message["role"], user_message["content"])
+        self.add_message("assistant", response)
+
+    def to_messages(self) -> List[Dict[str, Any]]:
+        """
+        Returns the messages to send to the model: system message, summary and recent messages.
+
+        :return: The list of message dictionaries.
+        """
+        messages = []
+        if self.system_message:
+            messages.append({"role": "system", "content": self.system_message})
+        if self.summary:
+            messages.append({"role": "system", "content": self._summary_text()})
+        return messages + list(self.messages)
+
+    def evict_over_budget(self) -> List[Dict[str, Any]]:
+        """
+        Removes the oldest messages until the history fits its budget, keeping the most recent ones.
+
+        The caller should fold the returned messages into the summary with `set_summary`.
+
+        :return: The evicted messages, oldest first.
+        """
+        evicted = []
+        while (
+            self.tokens > self.max_tokens
+            and len(self.messages) > self.min_recent_messages
+        ):
+            evicted.append(self.messages.pop(0))
+            self.message_tokens.pop(0)
+        if evicted:
+            logger.info(
+                f"Evicted {len(evicted)} messages from the conversation history; "
+                f"{self.tokens} of {self.max_tokens} tokens in use"
+            )
+        return evicted
+
+    def set_summary(self, summary: Optional[str]) -> None:
+        """
+        Replaces the rolling summary.
+
+        :param summary: The new summary of the evicted conversation.
+        """
+        self.summary = summary
+
+    def clear(self) -> None:
+        """
+        Forgets all messages and the summary, keeping the system message.
+        """
+        self.summary = None
+        self.messages = []
+        self.message_tokens = []
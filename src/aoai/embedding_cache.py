@@ -0,0 +1,317 @@
+"""
+`embedding_cache.py` is a module providing a persistent, content-addressed cache for embeddings.
+
+Vectors are keyed by (model, dimensions, sha256(text)) and stored as float32 rows in memory-mapped files, one
+preallocated (sparse) file per vector length. An SQLite index in WAL mode maps keys to rows and tracks recency,
+so the cache is bounded by an LRU policy and can be shared by several Streamlit worker processes at once.
+
+Writers reserve a row in a transaction, write the vector, then mark the row ready. Readers re-check the index
+after copying a vector, so a row recycled by a concurrent eviction is reported as a miss, never as a wrong vector.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+# SQLite allows at most 999 bound parameters per statement in older builds
+_QUERY_CHUNK = 400
+
+# Rows reserved but never marked ready for this long are considered abandoned
+_STALE_RESERVATION_SECONDS = 300.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    dimensions INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    slot INTEGER NOT NULL,
+    ready INTEGER NOT NULL DEFAULT 0,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (model, dimensions, digest),
+    UNIQUE (length, slot)
+);
+CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (length, last_used);
+"""
+
+
+class EmbeddingCache:
+    """
+    A size-bounded, process-safe embedding cache backed by memory-mapped float32 files and an SQLite index.
+    """
+
+    def __init__(self, directory: str, max_entries: int = 100_000):
+        """
+        Initialize the cache, creating its directory and index if needed.
+
+        :param directory: The directory holding the index and the vector files.
+        :param max_entries: The maximum number of vectors kept per vector length; older ones are evicted (LRU).
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            os.path.join(directory, "index.sqlite"),
+            timeout=30.0,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        self._vectors: Dict[int, np.memmap] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writes = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["EmbeddingCache"]:
+        """
+        Builds a cache from the environment variables "AZURE_OPENAI_EMBEDDING_CACHE_DIR" and
+        "AZURE_OPENAI_EMBEDDING_CACHE_MAX_ENTRIES".
+
+        :return: The cache, or None if no directory is configured.
+        """
+        directory = os.getenv("AZURE_OPENAI_EMBEDDING_CACHE_DIR")
+        if not directory:
+            return None
+        max_entries = os.getenv("AZURE_OPENAI_EMBEDDING_CACHE_MAX_ENTRIES")
+        return cls(directory, int(max_entries) if max_entries else 100_000)
+
+    @staticmethod
+    def digest(text: str) -> str:
+        """
+        Returns the content address of a text.
+
+        :param text: The embedded text.
+        :return: The hexadecimal sha256 digest of the UTF-8 text.
+        """
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _get_vectors(self, length: int) -> np.memmap:
+        """
+        Returns the memory-mapped rows for vectors of a given length, creating the sparse file on first use.
+
+        :param length: The vector length.
+        :return: A writable (max_entries, length) float32 memmap.
+        """
+        vectors = self._vectors.get(length)
+        if vectors is None:
+            path = os.path.join(self.directory, f"vectors-{length}.f32")
+            size = self.max_entries * length * 4
+            with open(path, "ab") as f:
+                if f.tell() < size:
+                    f.truncate(size)
+            vectors = np.memmap(
+                path, dtype=np.float32, mode="r+", shape=(self.max_entries, length)
+            )
+            self._vectors[length] = vectors
+        return vectors
+
+    def _execute_many(self, sql: str, parameters: List[Tuple[Any, ...]]) -> None:
+        """
+        Runs a statement for each parameter tuple in a single write transaction. Caller holds the lock.
+
+        :param sql: The statement.
+        :param parameters: The parameters of each execution.
+        """
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._connection.executemany(sql, parameters)
+            self._connection.execute("COMMIT")
+        except Exception:
+            self._connection.execute("ROLLBACK")
+            raise
+
+    def _lookup(
+        self, model: str, dimensions: int, digests: List[str]
+    ) -> Dict[str, Tuple[int, int]]:
+        """
+        Returns the ready rows of the given keys. Caller holds the lock.
+
+        :param model: The embedding model or deployment name.
+        :param dimensions: The requested dimensions, 0 for the model default.
+        :param digests: The content digests to look up.
+        :return: A mapping from digest to (length, slot).
+        """
+        rows = {}
+        for i in range(0, len(digests), _QUERY_CHUNK):
+            chunk = digests[i : i + _QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            cursor = self._connection.execute(
+                f"SELECT digest, length, slot FROM embeddings WHERE model = ? AND dimensions = ? "  # nosec B608
+                f"AND ready = 1 AND digest IN ({placeholders})",
+                (model, dimensions, *chunk),
+            )
+            for digest, length, slot in cursor:
+                rows[digest] = (length, slot)
+        return rows
+
+    def get_many(
+        self, model: str, dimensions: Optional[int], texts: List[str]
+    ) -> List[Optional[np.ndarray]]:
+        """
+        Looks up the embeddings of several texts.
+
+        :param model: The embedding model or deployment name.
+        :param dimensions: The requested dimensions, None for the model default.
+        :param texts: The texts to look up.
+        :return: The cached vector of each text, or None for misses, in input order.
+        """
+        dimensions = dimensions or 0
+        digests = [self.digest(text) for text in texts]
+        with self._lock:
+            rows = self._lookup(model, dimensions, list(set(digests)))
+            vectors = {
+                digest: np.array(self._get_vectors(length)[slot])
+                for digest, (length, slot) in rows.items()
+            }
+            # A row may have been evicted and recycled while it was being copied
+            current = self._lookup(model, dimensions, list(rows))
+            vectors = {
+                digest: vector
+                for digest, vector in vectors.items()
+                if current.get(digest) == rows[digest]
+            }
+            if vectors:
+                self._execute_many(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND dimensions = ? AND digest = ?",
+                    [(time.time(), model, dimensions, digest) for digest in vectors],
+                )
+            results = [vectors.get(digest) for digest in digests]
+            hits = sum(vector is not None for vector in results)
+            self.hits += hits
+            self.misses += len(results) - hits
+        return results
+
+    def _reserve(
+        self, model: str, dimensions: int, length: int, digests: List[str]
+    ) -> Dict[str, int]:
+        """
+        Reserves a row for each new key, evicting the least recently used rows when full. Caller holds the lock.
+
+        :param model: The embedding model or deployment name.
+        :param dimensions: The requested dimensions, 0 for the model default.
+        :param length: The vector length.
+        :param digests: The content digests to store.
+        :return: A mapping from digest to the reserved slot; keys already present are skipped.
+        """
+        now = time.time()
+        connection = self._connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            existing = {
+                digest
+                for (digest,) in connection.execute(
+                    "SELECT digest FROM embeddings WHERE model = ? AND dimensions = ?"
+                    f" AND digest IN ({','.join('?' * len(digests))})",  # nosec B608
+                    (model, dimensions, *digests),
+                )
+            }
+            new = [
+                digest for digest in dict.fromkeys(digests) if digest not in existing
+            ]
+            # Slots are only ever recycled by eviction, so the allocated ones are contiguous
+            (next_slot,) = connection.execute(
+                "SELECT COALESCE(MAX(slot) + 1, 0) FROM embeddings WHERE length = ?",
+                (length,),
+            ).fetchone()
+            reserved = {}
+            for digest in new:
+                if next_slot < self.max_entries:
+                    slot = next_slot
+                    next_slot += 1
+                else:
+                    # Reservations abandoned by a crashed writer become evictable after a while
+                    victim = connection.execute(
+                        "SELECT rowid, slot FROM embeddings WHERE length = ? AND (ready = 1 OR last_used < ?) "
+                        "ORDER BY last_used LIMIT 1",
+                        (length, now - _STALE_RESERVATION_SECONDS),
+                    ).fetchone()
+                    if victim is None:
+                        break
+                    connection.execute(
+                        "DELETE FROM embeddings WHERE rowid = ?", (victim[0],)
+                    )
+                    slot = victim[1]
+                    self.evictions += 1
+                connection.execute(
+                    "INSERT INTO embeddings (model, dimensions, digest, length, slot, ready, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, 0, ?)",
+                    (model, dimensions, digest, length, slot, now),
+                )
+                reserved[digest] = slot
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return reserved
+
+    def put_many(
+        self,
+        model: str,
+        dimensions: Optional[int],
+        texts: List[str],
+        vectors: np.ndarray,
+    ) -> None:
+        """
+        Stores the embeddings of several texts.
+
+        :param model: The embedding model or deployment name.
+        :param dimensions: The requested dimensions, None for the model default.
+        :param texts: The embedded texts.
+        :param vectors: A (len(texts), length) array of their embeddings.
+        """
+        if not texts:
+            return
+        dimensions = dimensions or 0
+        vectors = np.asarray(vectors, dtype=np.float32)
+        length = vectors.shape[1]
+        digests = [self.digest(text) for text in texts]
+        rows = dict(zip(digests, vectors))
+        with self._lock:
+            for i in range(0, len(digests), _QUERY_CHUNK):
+                reserved = self._reserve(
+                    model, dimensions, length, digests[i : i + _QUERY_CHUNK]
+                )
+                if not reserved:
+                    continue
+                storage = self._get_vectors(length)
+                for digest, slot in reserved.items():
+                    storage[slot] = rows[digest]
+                storage.flush()
+                self._execute_many(
+                    "UPDATE embeddings SET ready = 1 WHERE length = ? AND slot = ? AND digest = ?",
+                    [(length, slot, digest) for digest, slot in reserved.items()],
+                )
+                self.writes += len(reserved)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns the cache counters of this process, for logging and dashboards.
+
+        :return: A dictionary with hits, misses, hit rate, writes and evictions.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,325 @@
+"""
+`hedging.py` is a module providing hedged requests, to cut the tail latency caused by occasional slow replicas.
+
+`HedgingPolicy` learns the distribution of recent attempt latencies. When an attempt has not answered within a
+percentile of that distribution (p95 by default), a duplicate is sent, to the next deployment of the pool when
+there is one; whichever answers first is returned and the other is cancelled. For a streamed request, the attempt
+answers when its response starts, with the first token.
+
+Every request earns `max_hedge_rate` of a hedge and every hedge spends one, so at most that fraction of requests
+is duplicated and the extra cost stays bounded. An asynchronous loser is cancelled; a synchronous loser cannot be
+interrupted, so its response is discarded (and closed, for a stream) when it arrives.
+"""
+
+import asyncio
+import collections
+import contextvars
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from src.aoai.telemetry import get_metrics
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+T = TypeVar("T")
+
+
+class HedgingPolicy:
+    """
+    Decides when to hedge a request, within a budget, and races the original attempt against the hedge.
+    """
+
+    def __init__(
+        self,
+        quantile: float = 0.95,
+        max_hedge_rate: float = 0.05,
+        min_delay: float = 0.05,
+        window: int = 500,
+        min_samples: int = 20,
+        max_burst: float = 5.0,
+        max_workers: int = 64,
+    ):
+        """
+        Initialize the policy.
+
+        :param quantile: The percentile of recent latencies after which a request is hedged.
+        :param max_hedge_rate: The largest fraction of requests that may be hedged.
+        :param min_delay: The shortest delay before hedging, in seconds, so a tight latency distribution does
+            not spend the budget on requests that are not slow.
+        :param window: The number of recent latencies the percentile is computed from.
+        :param min_samples: The number of latencies to learn before hedging at all.
+        :param max_burst: The largest number of hedges that can be saved up during quiet periods.
+        :param max_workers: The threads running synchronous attempts.
+        """
+        if not 0 < quantile < 1:
+            raise ValueError("quantile must be between 0 and 1")
+        self.quantile = quantile
+        self.max_hedge_rate = max_hedge_rate
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.max_burst = max_burst
+        self._latencies: Deque[float] = collections.deque(maxlen=window)
+        self._credit = 0.0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hedge"
+        )
+
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["HedgingPolicy"]:
+        """
+        Builds a policy from the environment variables "AZURE_OPENAI_HEDGING_QUANTILE" and
+        "AZURE_OPENAI_HEDGING_MAX_RATE".
+
+        :return: The policy, or None if no quantile is configured.
+        """
+        quantile = os.getenv("AZURE_OPENAI_HEDGING_QUANTILE")
+        if not quantile:
+            return None
+        max_rate = os.getenv("AZURE_OPENAI_HEDGING_MAX_RATE")
+        return cls(
+            quantile=float(quantile),
+            max_hedge_rate=float(max_rate) if max_rate else 0.05,
+        )
+
+    def record_latency(self, latency: float) -> None:
+        """
+        Records the latency of a completed attempt.
+
+        :param latency: The latency in seconds.
+        """
+        with self._lock:
+            self._latencies.append(latency)
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        Returns how long to wait for an attempt before hedging it.
+
+        :return: The learned percentile of recent latencies (at least `min_delay`), or None while too few
+            latencies were recorded.
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(self.quantile * len(ordered)))
+        return max(self.min_delay, ordered[index])
+
+    def _begin(self) -> Optional[float]:
+        """
+        Counts a request and earns its share of the hedge budget.
+
+        :return: The hedge delay of the request, or None if it must not be hedged.
+        """
+        with self._lock:
+            self.requests += 1
+            self._credit = min(self.max_burst, self._credit + self.max_hedge_rate)
+        return self.hedge_delay()
+
+    def _spend(self) -> bool:
+        """
+        Spends one hedge from the budget.
+
+        :return: Whether the budget allowed the hedge.
+        """
+        with self._lock:
+            if self._credit < 1.0:
+                return False
+            self._credit -= 1.0
+            self.hedges += 1
+        get_metrics().increment(
+            "azure_hedged_requests_total", help="Requests duplicated by hedging."
+        )
+        return True
+
+    def _won(self, hedge_won: bool, delay: float) -> None:
+        """
+        Records which attempt of a hedged request answered first.
+
+        :param hedge_won: Whether the hedge answered first.
+        :param delay: The hedge delay of the request.
+        """
+        if hedge_won:
+            with self._lock:
+                self.hedge_wins += 1
+            get_metrics().increment(
+                "azure_hedge_wins_total", help="Hedged requests answered by the hedge."
+            )
+        logger.info(
+            f"Hedged a request after {delay:.2f}s; the {'hedge' if hedge_won else 'original attempt'} answered first"
+        )
+
+    def _timed(self, function: Callable[[], T]) -> Callable[[], T]:
+        """
+        Wraps an attempt so that its latency is recorded when it succeeds.
+
+        :param function: The attempt.
+        :return: The wrapped attempt.
+        """
+
+        def timed() -> T:
+            started_at = time.monotonic()
+            result = function()
+            self.record_latency(time.monotonic() - started_at)
+            return result
+
+        return timed
+
+    @staticmethod
+    def _discard(future: Future) -> None:
+        """
+        Closes the response of a losing attempt when it arrives, so a stream does not hold its connection.
+
+        :param future: The future of the losing attempt.
+        """
+        if future.cancelled() or future.exception() is not None:
+            return
+        close = getattr(future.result(), "close", None)
+        if callable(close):
+            close()
+
+    def run(
+        self, primary: Callable[[], T], hedge: Callable[[], T], timed: bool = True
+    ) -> T:
+        """
+        Calls `primary`, and `hedge` as well if `primary` is slower than the hedge delay and the budget allows.
+
+        :param primary: The original attempt.
+        :param hedge: The duplicate attempt, e.g. to another deployment.
+        :param timed: Whether to record the latency of each attempt. False when the attempts report their own
+            latency with `record_latency`, e.g. to leave out the time spent waiting for admission.
+        :return: The result of the attempt that succeeded first.
+        :raises Exception: The error of the original attempt if every attempt failed.
+        """
+        if timed:
+            primary, hedge = self._timed(primary), self._timed(hedge)
+        delay = self._begin()
+        if delay is None:
+            return primary()
+
+        # Attempts run on worker threads with the caller's context, e.g. its request priority
+        original = self._executor.submit(contextvars.copy_context().run, primary)
+        done, _ = wait([original], timeout=delay)
+        if done or not self._spend():
+            return original.result()
+
+        duplicate = self._executor.submit(contextvars.copy_context().run, hedge)
+        pending = {original, duplicate}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in (original, duplicate):
+                if future in done and future.exception() is None:
+                    self._won(future is duplicate, delay)
+                    for loser in pending:
+                        loser.add_done_callback(self._discard)
+                    return future.result()
+        return original.result()
+
+    async def async_run(
+        self,
+        primary: Callable[[], Awaitable[T]],
+        hedge: Callable[[], Awaitable[T]],
+        timed: bool = True,
+    ) -> T:
+        """
+        Awaitable counterpart of `run`. The losing attempt is cancelled, and its elapsed time is recorded as a
+        lower bound of its latency.
+
+        :param primary: The coroutine function of the original attempt.
+        :param hedge: The coroutine function of the duplicate attempt.
+        :param timed: Whether to record the latency of each attempt. False when the attempts report their own
+            latency with `record_latency`.
+        :return: The result of the attempt that succeeded first.
+        :raises Exception: The error of the original attempt if every attempt failed.
+        """
+
+        async def timed_attempt(function: Callable[[], Awaitable[T]]) -> T:
+            started_at = time.monotonic()
+            try:
+                result = await function()
+            except asyncio.CancelledError:
+                # A cancelled loser would have taken at least this long; leaving it out would bias the
+                # percentile towards the fast attempts
+                self.record_latency(time.monotonic() - started_at)
+                raise
+            self.record_latency(time.monotonic() - started_at)
+            return result
+
+        def start(function: Callable[[], Awaitable[T]]) -> Awaitable[T]:
+            return timed_attempt(function) if timed else function()
+
+        delay = self._begin()
+        if delay is None:
+            return await start(primary)
+
+        original = asyncio.ensure_future(start(primary))
+        try:
+            done, _ = await asyncio.wait({original}, timeout=delay)
+        except asyncio.CancelledError:
+            original.cancel()
+            raise
+        if done or not self._spend():
+            return await original
+
+        duplicate = asyncio.ensure_future(start(hedge))
+        pending = {original, duplicate}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in (original, duplicate):
+                    if task in done and task.exception() is None:
+                        self._won(task is duplicate, delay)
+                        for loser in (original, duplicate):
+                            if loser is not task:
+                                await self._async_discard(loser)
+                        return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+        return await original
+
+    @staticmethod
+    async def _async_discard(task: "asyncio.Future") -> None:
+        """
+        Cancels a losing attempt, or closes its response if it already completed.
+
+        :param task: The task of the losing attempt.
+        """
+        if not task.done():
+            task.cancel()
+            return
+        if task.cancelled() or task.exception() is not None:
+            return
+        close = getattr(task.result(), "close", None)
+        if callable(close):
+            closing = close()
+            if inspect.isawaitable(closing):
+                await closing
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns the hedging counters, for logging and dashboards.
+
+        :return: A dictionary with the requests, hedges, hedge wins, hedge rate and current hedge delay.
+        """
+        delay = self.hedge_delay()
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "hedge_rate": self.hedges / self.requests if self.requests else 0.0,
+                "hedge_delay": delay,
+            }
@@ -0,0 +1,698 @@
+"""
+`mock_server.py` is a module providing a local stand-in for Azure OpenAI, for offline load and regression tests.
+
+`MockAzureOpenAIServer` serves the routes used by `AzureOpenAIManager` and the REST calls of `GPT4VisionManager`:
+chat completions (with SSE streaming), completions, embeddings, image generations, audio transcriptions and the
+`extensions/chat/completions` route of the vision enhancements. Responses are deterministic for a given seed:
+
+- latency follows a configurable `LatencyModel` (constant, uniform or lognormal), and streamed chunks are spaced
+  by a fixed delay, so time-to-first-token and throughput can be measured;
+- 429 and 5xx responses can be injected by a script (e.g. `[429, 503]` for the first two requests) or at random
+  rates, with `retry-after`, `retry-after-ms` and `x-ratelimit-remaining-*` headers like the service;
+- an optional tokens-per-minute and requests-per-minute quota throttles over-eager clients as a deployment would.
+
+Run it from the command line with `python -m src.aoai.mock_server --port 8080` and point
+"AZURE_OPENAI_API_ENDPOINT" at `http://127.0.0.1:8080`; any api-key is accepted.
+"""
+
+import argparse
+import base64
+import collections
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+LATENCY_DISTRIBUTIONS = ("constant", "uniform", "lognormal")
+
+ROUTES = (
+    "chat/completions",
+    "extensions/chat/completions",
+    "completions",
+    "embeddings",
+    "images/generations",
+    "audio/transcriptions",
+)
+
+DEPLOYMENT_PATH = re.compile(
+    r"^/openai/deployments/(?P<deployment>[^/]+)/(?P<route>.+)$"
+)
+
+# A 1x1 transparent PNG, served for generated image URLs
+PIXEL_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+QUOTA_WINDOW = 60.0
+
+
+class LatencyModel:
+    """
+    A distribution of response latencies, in seconds.
+    """
+
+    def __init__(
+        self,
+        distribution: str = "constant",
+        mean: float = 0.0,
+        spread: float = 0.0,
+    ):
+        """
+        Initialize the latency model.
+
+        :param distribution: One of "constant", "uniform" or "lognormal".
+        :param mean: The latency of "constant", the centre of "uniform" or the median of "lognormal".
+        :param spread: The half-width of "uniform" or the sigma of the underlying normal of "lognormal".
+        """
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(
+                f"Unknown latency distribution '{distribution}'; expected one of {LATENCY_DISTRIBUTIONS}"
+            )
+        self.distribution = distribution
+        self.mean = mean
+        self.spread = spread
+
+    def sample(self, rng: random.Random) -> float:
+        """
+        Draws a latency.
+
+        :param rng: The random generator of the server.
+        :return: The latency in seconds, never negative.
+        """
+        if self.distribution == "uniform":
+            value = rng.uniform(self.mean - self.spread, self.mean + self.spread)
+        elif self.distribution == "lognormal" and self.mean > 0:
+            value = rng.lognormvariate(math.log(self.mean), self.spread)
+        else:
+            value = self.mean
+        return max(0.0, value)
+
+
+class MockAzureOpenAIServer:
+    """
+    A local HTTP server imitating the Azure OpenAI data-plane API.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: Optional[LatencyModel] = None,
+        stream_chunk_delay: float = 0.0,
+        completion_tokens: int = 16,
+        embedding_dimensions: int = 1536,
+        faults: Optional[List[int]] = None,
+        throttle_rate: float = 0.0,
+        error_rate: float = 0.0,
+        retry_after: float = 1.0,
+        tokens_per_minute: Optional[int] = None,
+        requests_per_minute: Optional[int] = None,
+        seed: Optional[int] = None,
+    ):
+        """
+        Initialize the server; call `start` to serve.
+
+        :param host: The address to bind.
+        :param port: The port to listen on; 0 picks a free port, see `endpoint`.
+        :param latency: The latency before a response (or the first streamed chunk). Defaults to no latency.
+        :param stream_chunk_delay: The delay between streamed chunks, in seconds.
+        :param completion_tokens: The number of tokens generated per completion, capped by `max_tokens`.
+        :param embedding_dimensions: The dimensions of the returned embeddings.
+        :param faults: The status codes returned by the first requests, in order (e.g. `[429, 503]`); 200 lets
+            a request through.
+        :param throttle_rate: The probability of answering 429 once the script is exhausted.
+        :param error_rate: The probability of answering 500 or 503 once the script is exhausted.
+        :param retry_after: The retry-after advertised with injected 429 responses, in seconds.
+        :param tokens_per_minute: The token quota of every deployment; unlimited when None.
+        :param requests_per_minute: The request quota of every deployment; unlimited when None.
+        :param seed: The seed of the latency and fault draws, for reproducible runs.
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency or LatencyModel()
+        self.stream_chunk_delay = stream_chunk_delay
+        self.completion_tokens = completion_tokens
+        self.embedding_dimensions = embedding_dimensions
+        self.faults: Deque[int] = collections.deque(faults or [])
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+
+        self._rng = random.Random(seed)  # nosec B311
+        self._lock = threading.Lock()
+        self._usage: Dict[str, Deque[Tuple[float, int]]] = {}
+        self._server: Optional[ThreadingHTTPServer] = None
+        self.requests: Dict[str, int] = collections.Counter()
+        self.statuses: Dict[int, int] = collections.Counter()
+
+    @property
+    def endpoint(self) -> str:
+        """
+        Returns the base URL of the server, to use as the Azure OpenAI endpoint.
+
+        :return: The endpoint URL.
+        """
+        if self._server is None:
+            raise RuntimeError("The mock server is not started")
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockAzureOpenAIServer":
+        """
+        Starts serving from a daemon thread.
+
+        :return: The server itself, for convenience.
+        """
+        self._server = ThreadingHTTPServer((self.host, self.port), _MockHandler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logger.info(f"Mock Azure OpenAI server listening on {self.endpoint}")
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops serving and closes the socket.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "MockAzureOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the requests served, for assertions and reports.
+
+        :return: A dictionary with the requests per route and the responses per status code.
+        """
+        with self._lock:
+            return {"requests": dict(self.requests), "statuses": dict(self.statuses)}
+
+    def _sample_latency(self) -> float:
+        """
+        Draws the latency of a response.
+
+        :return: The latency in seconds.
+        """
+        with self._lock:
+            return self.latency.sample(self._rng)
+
+    def _quota_delay(self, deployment: str, tokens: int) -> Optional[float]:
+        """
+        Charges a request against the quota of a deployment.
+
+        :param deployment: The deployment called.
+        :param tokens: The tokens charged: the prompt plus the requested completion.
+        :return: None if the request is admitted, else the seconds until the quota allows it.
+        """
+        now = time.monotonic()
+        usage = self._usage.setdefault(deployment, collections.deque())
+        while usage and usage[0][0] <= now - QUOTA_WINDOW:
+            usage.popleft()
+        used_tokens = sum(charged for _, charged in usage)
+        over_tokens = (
+            self.tokens_per_minute is not None
+            and used_tokens + tokens > self.tokens_per_minute
+        )
+        over_requests = (
+            self.requests_per_minute is not None
+            and len(usage) + 1 > self.requests_per_minute
+        )
+        if over_tokens or over_requests:
+            return usage[0][0] + QUOTA_WINDOW - now if usage else QUOTA_WINDOW
+        usage.append((now, tokens))
+        return None
+
+    def _remaining_headers(self, deployment: str) -> Dict[str, str]:
+        """
+        Returns the quota headers of a deployment, like the service sends with every response.
+
+        :param deployment: The deployment called.
+        :return: The `x-ratelimit-remaining-*` headers of the configured quotas.
+        """
+        usage = self._usage.get(deployment, ())
+        headers = {}
+        if self.tokens_per_minute is not None:
+            used = sum(charged for _, charged in usage)
+            headers["x-ratelimit-remaining-tokens"] = str(
+                max(0, self.tokens_per_minute - used)
+            )
+        if self.requests_per_minute is not None:
+            headers["x-ratelimit-remaining-requests"] = str(
+                max(0, self.requests_per_minute - len(usage))
+            )
+        return headers
+
+    def _admit(
+        self, deployment: str, tokens: int
+    ) -> Tuple[int, Optional[float], Dict[str, str]]:
+        """
+        Decides the status of a request: scripted faults first, then the quota, then random faults.
+
+        :param deployment: The deployment called.
+        :param tokens: The tokens charged for the request.
+        :return: A tuple of (status code, retry-after in seconds for 429 responses, quota headers).
+        """
+        with self._lock:
+            status, retry_after = 200, None
+            if self.faults:
+                status = self.faults.popleft()
+            else:
+                draw = self._rng.random()
+                if draw < self.throttle_rate:
+                    status = 429
+                elif draw < self.throttle_rate + self.error_rate:
+                    status = self._rng.choice((500, 503))
+            if status == 429:
+                retry_after = self.retry_after
+            elif status == 200:
+                retry_after = self._quota_delay(deployment, tokens)
+                if retry_after is not None:
+                    status = 429
+            return status, retry_after, self._remaining_headers(deployment)
+
+    def _record(self, route: str, status: int) -> None:
+        """
+        Counts a served request.
+
+        :param route: The route of the request.
+        :param status: The status code of the response.
+        """
+        with self._lock:
+            self.requests[route] += 1
+            self.statuses[status] += 1
+
+    @staticmethod
+    def count_tokens(value: Any) -> int:
+        """
+        Estimates the tokens of a request field at about four characters per token.
+
+        :param value: A prompt, a list of messages or a list of inputs.
+        :return: The estimated tokens.
+        """
+        if value is None:
+            return 0
+        text = value if isinstance(value, str) else json.dumps(value)
+        return len(text) // 4 + 1
+
+    def embedding(self, text: str) -> np.ndarray:
+        """
+        Returns a deterministic unit vector for a text, so equal texts get equal embeddings.
+
+        :param text: The input text.
+        :return: The embedding as float32.
+        """
+        seed = int.from_bytes(
+            hashlib.sha256(text.encode("utf-8")).digest()[:8], "little"
+        )
+        vector = np.random.default_rng(seed).standard_normal(self.embedding_dimensions)
+        return (vector / np.linalg.norm(vector)).astype("<f4")
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    """
+    Serves the requests of a `MockAzureOpenAIServer`.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without TCP_NODELAY, delayed ACKs add ~40ms per response
+    disable_nagle_algorithm = True
+
+    @property
+    def mock(self) -> MockAzureOpenAIServer:
+        return self.server.mock
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(f"Mock server: {format % args}")
+
+    def handle_one_request(self) -> None:
+        try:
+            super().handle_one_request()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on the request, e.g. the cancelled loser of a hedged request
+            self.close_connection = True
+
+    def _send_json(
+        self, status: int, body: Any, headers: Optional[Dict[str, str]] = None
+    ) -> None:
+        """
+        Sends a complete JSON (or plain text) response.
+
+        :param status: The status code.
+        :param body: The body, serialized as JSON unless it is a string.
+        :param headers: Additional headers.
+        """
+        is_text = isinstance(body, str)
+        payload = (body if is_text else json.dumps(body)).encode("utf-8")
+        self.send_response(status)
+        self.send_header(
+            "Content-Type", "text/plain" if is_text else "application/json"
+        )
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(
+        self, status: int, message: str, headers: Optional[Dict[str, str]] = None
+    ) -> None:
+        """
+        Sends an error in the format of the service.
+
+        :param status: The status code.
+        :param message: The error message.
+        :param headers: Additional headers.
+        """
+        self._send_json(
+            status, {"error": {"code": str(status), "message": message}}, headers
+        )
+
+    def _read_body(self) -> bytes:
+        """
+        Reads the request body.
+
+        :return: The raw body.
+        """
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def do_GET(self) -> None:
+        if self.path.startswith("/images/") and self.path.endswith(".png"):
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(PIXEL_PNG)))
+            self.end_headers()
+            self.wfile.write(PIXEL_PNG)
+            return
+        self._send_error(404, f"Resource not found: {self.path}")
+
+    def do_POST(self) -> None:
+        raw_body = self._read_body()
+        match = DEPLOYMENT_PATH.match(self.path.split("?")[0])
+        route = match.group("route") if match else None
+        if route not in ROUTES:
+            self._send_error(404, f"Resource not found: {self.path}")
+            return
+        if not (self.headers.get("api-key") or self.headers.get("Authorization")):
+            self._send_error(401, "Access denied due to missing subscription key.")
+            return
+        deployment = match.group("deployment")
+
+        if route == "audio/transcriptions":
+            request: Dict[str, Any] = {}
+            response_format = re.search(
+                rb'name="response_format"\r\n\r\n(\w+)', raw_body
+            )
+            if response_format:
+                request["response_format"] = response_format.group(1).decode()
+        else:
+            try:
+                request = json.loads(raw_body or b"{}")
+            except ValueError:
+                self._send_error(400, "The request body is not valid JSON.")
+                return
+
+        prompt_tokens = self.mock.count_tokens(
+            request.get("messages") or request.get("prompt") or request.get("input")
+        )
+        completion_tokens = min(
+            self.mock.completion_tokens,
+            request.get("max_tokens") or self.mock.completion_tokens,
+        )
+        if route in ("embeddings", "images/generations", "audio/transcriptions"):
+            completion_tokens = 0
+
+        status, retry_after, headers = self.mock._admit(
+            deployment, prompt_tokens + completion_tokens
+        )
+        time.sleep(self.mock._sample_latency())
+        self.mock._record(route, status)
+        if status == 429:
+            headers["retry-after"] = str(math.ceil(retry_after))
+            headers["retry-after-ms"] = str(int(retry_after * 1000))
+            self._send_error(
+                429,
+                f"Requests to the deployment '{deployment}' have exceeded the rate limit. "
+                f"Please retry after {math.ceil(retry_after)} seconds.",
+                headers,
+            )
+            return
+        if status != 200:
+            self._send_error(status, "The server had an error processing your request.")
+            return
+
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        text = " ".join(["mock"] * completion_tokens)
+        if route in ("chat/completions", "extensions/chat/completions"):
+            if request.get("stream"):
+                self._stream_chat(deployment, request, text, usage, headers)
+            else:
+                self._send_json(
+                    200, self._chat_completion(deployment, text, usage), headers
+                )
+        elif route == "completions":
+            self._send_json(
+                200,
+                {
+                    "id": f"cmpl-{uuid.uuid4().hex}",
+                    "object": "text_completion",
+                    "created": int(time.time()),
+                    "model": deployment,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "text": text,
+                            "finish_reason": "length",
+                            "logprobs": None,
+                        }
+                    ],
+                    "usage": usage,
+                },
+                headers,
+            )
+        elif route == "embeddings":
+            self._send_json(200, self._embeddings(deployment, request, usage), headers)
+        elif route == "images/generations":
+            self._send_json(200, self._images(request), headers)
+        else:
+            transcription = "This is a mock transcription."
+            if request.get("response_format", "json") in ("json", "verbose_json"):
+                self._send_json(200, {"text": transcription}, headers)
+            else:
+                self._send_json(200, transcription, headers)
+
+    @staticmethod
+    def _chat_completion(
+        deployment: str, text: str, usage: Dict[str, int]
+    ) -> Dict[str, Any]:
+        """
+        Builds a chat completion.
+
+        :param deployment: The deployment called, reported as the model.
+        :param text: The generated content.
+        :param usage: The token usage.
+        :return: The chat completion body.
+        """
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": deployment,
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": text},
+                }
+            ],
+            "usage": usage,
+        }
+
+    def _stream_chat(
+        self,
+        deployment: str,
+        request: Dict[str, Any],
+        text: str,
+        usage: Dict[str, int],
+        headers: Dict[str, str],
+    ) -> None:
+        """
+        Streams a chat completion as server-sent events over a chunked response, one token per event.
+
+        :param deployment: The deployment called, reported as the model.
+        :param request: The request body; usage is sent last when `stream_options.include_usage` is set.
+        :param text: The generated content.
+        :param usage: The token usage.
+        :param headers: Additional headers.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        def chunk(choices: List[Dict[str, Any]], **extra: Any) -> Dict[str, Any]:
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": deployment,
+                "choices": choices,
+                **extra,
+            }
+
+        events = []
+        for i, token in enumerate(text.split(" ") if text else []):
+            delta = {"content": token if i == 0 else " " + token}
+            if i == 0:
+                delta["role"] = "assistant"
+            events.append(chunk([{"index": 0, "delta": delta, "finish_reason": None}]))
+        events.append(chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            events.append(chunk([], usage=usage))
+
+        for i, event in enumerate(events):
+            if i and self.mock.stream_chunk_delay:
+                time.sleep(self.mock.stream_chunk_delay)
+            self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data: bytes) -> None:
+        """
+        Writes one chunk of a chunked response and flushes it.
+
+        :param data: The chunk data.
+        """
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _embeddings(
+        self, deployment: str, request: Dict[str, Any], usage: Dict[str, int]
+    ) -> Dict[str, Any]:
+        """
+        Builds an embeddings response, encoding the vectors as base64 when requested.
+
+        :param deployment: The deployment called, reported as the model.
+        :param request: The request body.
+        :param usage: The token usage.
+        :return: The embeddings body.
+        """
+        inputs = request.get("input")
+        if not isinstance(inputs, list) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        data = []
+        for index, text in enumerate(inputs):
+            vector = self.mock.embedding(
+                text if isinstance(text, str) else json.dumps(text)
+            )
+            if request.get("encoding_format") == "base64":
+                embedding: Any = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        return {
+            "object": "list",
+            "model": deployment,
+            "data": data,
+            "usage": {
+                "prompt_tokens": usage["prompt_tokens"],
+                "total_tokens": usage["prompt_tokens"],
+            },
+        }
+
+    def _images(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Builds an image generations response pointing at a placeholder image served by the mock.
+
+        :param request: The request body.
+        :return: The image generations body.
+        """
+        data = []
+        for _ in range(request.get("n") or 1):
+            if request.get("response_format") == "b64_json":
+                image = {"b64_json": base64.b64encode(PIXEL_PNG).decode("ascii")}
+            else:
+                image = {"url": f"{self.mock.endpoint}/images/{uuid.uuid4().hex}.png"}
+            image["revised_prompt"] = request.get("prompt")
+            data.append(image)
+        return {"created": int(time.time()), "data": data}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Runs the mock server until interrupted.
+
+    :param argv: The command-line arguments; defaults to `sys.argv`.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip("`\n "))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", choices=LATENCY_DISTRIBUTIONS, default="constant")
+    parser.add_argument("--latency-mean", type=float, default=0.0)
+    parser.add_argument("--latency-spread", type=float, default=0.0)
+    parser.add_argument("--stream-chunk-delay", type=float, default=0.0)
+    parser.add_argument("--completion-tokens", type=int, default=16)
+    parser.add_argument("--faults", type=int, nargs="*", default=[])
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--tokens-per-minute", type=int, default=None)
+    parser.add_argument("--requests-per-minute", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    server = MockAzureOpenAIServer(
+        host=args.host,
+        port=args.port,
+        latency=LatencyModel(args.latency, args.latency_mean, args.latency_spread),
+        stream_chunk_delay=args.stream_chunk_delay,
+        completion_tokens=args.completion_tokens,
+        faults=args.faults,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        tokens_per_minute=args.tokens_per_minute,
+        requests_per_minute=args.requests_per_minute,
+        seed=args.seed,
+    ).start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        logger.info(f"Stopping the mock server: {server.stats()}")
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""
+`rate_limiter.py` is a module providing client-side, header-driven rate limiting for Azure OpenAI deployments.
+
+Each deployment gets a token bucket (TPM) and a request bucket (RPM). Requests are admitted only when their
+estimated token cost fits the budget, and both buckets are re-synchronised from the
+`x-ratelimit-remaining-tokens` / `x-ratelimit-remaining-requests` headers returned by the service, so the
+client stays just under the quota instead of discovering it through 429s.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, Mapping, Optional, Tuple
+
+from src.aoai.utils import extract_rate_limit_headers, parse_retry_after
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+
+class TokenBucket:
+    """
+    A continuously refilled token bucket.
+
+    The bucket is not thread-safe on its own; `AdaptiveRateLimiter` guards every access with its lock.
+    A bucket without a capacity admits everything until a capacity is configured or learned from headers.
+    """
+
+    def __init__(self, capacity: Optional[float] = None, refill_period: float = 60.0):
+        """
+        Initialize the bucket.
+
+        :param capacity: The maximum number of units per refill period (e.g. TPM or RPM). None means unknown.
+        :param refill_period: The period, in seconds, over which a full capacity is refilled.
+        """
+        self.capacity = capacity
+        self.refill_period = refill_period
+        self.level = capacity
+        self.in_flight = 0.0
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        """
+        Adds the units accrued since the last update, capped at capacity.
+
+        :param now: The current monotonic time.
+        """
+        if self.capacity is not None and self.level is not None:
+            rate = self.capacity / self.refill_period
+            self.level = min(self.capacity, self.level + (now - self.updated_at) * rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Returns how long to wait before `amount` units are available.
+
+        Amounts larger than the capacity are admitted once the bucket is full, otherwise they would never run.
+
+        :param amount: The number of units requested.
+        :param now: The current monotonic time.
+        :return: The number of seconds to wait, 0 if the amount can be consumed right away.
+        """
+        self._refill(now)
+        if self.capacity is None or self.level is None or self.capacity <= 0:
+            return 0.0
+        needed = min(amount, self.capacity)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) * self.refill_period / self.capacity
+
+    def consume(self, amount: float) -> None:
+        """
+        Consumes units and tracks them as in flight until the server acknowledges them.
+
+        :param amount: The number of units to consume.
+        """
+        if self.level is not None:
+            self.level -= amount
+        self.in_flight += amount
+
+    def release(self, amount: float, refund: bool = False) -> None:
+        """
+        Marks previously consumed units as no longer in flight.
+
+        :param amount: The number of units to release.
+        :param refund: Whether to give the units back, e.g. when the request never reached the service.
+        """
+        self.in_flight = max(0.0, self.in_flight - amount)
+        if refund and self.level is not None and self.capacity is not None:
+            self.level = min(self.capacity, self.level + amount)
+
+    def sync(
+        self, remaining: int, completed: float, headroom: float, now: float
+    ) -> None:
+        """
+        Re-synchronises the bucket from the remaining quota reported by the service.
+
+        The service has not seen requests still in flight, so they are subtracted from its figure.
+        Until a capacity is configured, it is learned as the largest quota observed.
+
+        :param remaining: The remaining units reported by the service.
+        :param completed: The units of the request that carried the headers, already counted by the service.
+        :param headroom: The fraction of capacity kept in reserve.
+        :param now: The current monotonic time.
+        """
+        observed_capacity = remaining + completed + self.in_flight
+        if observed_capacity <= 0:
+            return
+        if self.capacity is None or observed_capacity > self.capacity:
+            self.capacity = float(observed_capacity)
+        self.level = remaining - self.in_flight - headroom * self.capacity
+        self.updated_at = now
+
+    def drain(self, now: float) -> None:
+        """
+        Empties the bucket, e.g. after a 429 response.
+
+        :param now: The current monotonic time.
+        """
+        if self.capacity is not None:
+            self.level = 0.0
+        self.updated_at = now
+
+
+class AdaptiveRateLimiter:
+    """
+    A per-deployment rate limiter combining a TPM token bucket and an RPM request bucket.
+
+    Limits can be configured up-front (per deployment or as defaults) or learned from the rate limit headers
+    of the responses. The limiter is thread-safe and offers both blocking and awaitable admission.
+    """
+
+    def __init__(
+        self,
+        tokens_per_minute: Optional[int] = None,
+        requests_per_minute: Optional[int] = None,
+        headroom: float = 0.05,
+    ):
+        """
+        Initialize the limiter.
+
+        :param tokens_per_minute: Default TPM limit for deployments that are not configured explicitly.
+        :param requests_per_minute: Default RPM limit for deployments that are not configured explicitly.
+        :param headroom: Fraction of the quota kept in reserve when syncing from headers. Defaults to 5%.
+        """
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.headroom = headroom
+        self._buckets: Dict[str, Tuple[TokenBucket, TokenBucket]] = {}
+        self._blocked_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def configure(
+        self,
+        deployment: str,
+        tokens_per_minute: Optional[int] = None,
+        requests_per_minute: Optional[int] = None,
+    ) -> None:
+        """
+        Sets explicit limits for a deployment, replacing any learned state.
+
+        :param deployment: The deployment key.
+        :param tokens_per_minute: The TPM limit of the deployment.
+        :param requests_per_minute: The RPM limit of the deployment.
+        """
+        with self._lock:
+            self._buckets[deployment] = (
+                TokenBucket(tokens_per_minute),
+                TokenBucket(requests_per_minute),
+            )
+
+    def _get_buckets(self, deployment: str) -> Tuple[TokenBucket, TokenBucket]:
+        """
+        Returns the token and request buckets for a deployment, creating them with the defaults. Caller holds the lock.
+
+        :param deployment: The deployment key.
+        :return: A tuple of (token bucket, request bucket).
+        """
+        if deployment not in self._buckets:
+            self._buckets[deployment] = (
+                TokenBucket(self.tokens_per_minute),
+                TokenBucket(self.requests_per_minute),
+            )
+        return self._buckets[deployment]
+
+    def _try_acquire(self, deployment: str, tokens: int) -> float:
+        """
+        Admits the request if both buckets allow it, otherwise returns how long to wait.
+
+        :param deployment: The deployment key.
+        :param tokens: The estimated token cost of the request.
+        :return: 0 if the request was admitted, otherwise the number of seconds to wait before retrying.
+        """
+        with self._lock:
+            now = time.monotonic()
+            blocked_for = self._blocked_until.get(deployment, 0.0) - now
+            if blocked_for > 0:
+                return blocked_for
+            token_bucket, request_bucket = self._get_buckets(deployment)
+            wait = max(
+                token_bucket.wait_time(tokens, now), request_bucket.wait_time(1, now)
+            )
+            if wait <= 0:
+                token_bucket.consume(tokens)
+                request_bucket.consume(1)
+            return wait
+
+    def acquire(self, deployment: str, tokens: int) -> float:
+        """
+        Blocks until the request fits the deployment budget.
+
+        :param deployment: The deployment key.
+        :param tokens: The estimated token cost of the request.
+        :return: The total time spent waiting, in seconds.
+        """
+        waited = 0.0
+        while True:
+            wait = self._try_acquire(deployment, tokens)
+            if wait <= 0:
+                if waited > 0:
+                    logger.info(
+                        f"Rate limiter admitted {tokens} tokens on '{deployment}' after {waited:.2f}s"
+                    )
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    async def async_acquire(self, deployment: str, tokens: int) -> float:
+        """
+        Waits, without blocking the event loop, until the request fits the deployment budget.
+
+        :param deployment: The deployment key.
+        :param tokens: The estimated token cost of the request.
+        :return: The total time spent waiting, in seconds.
+        """
+        waited = 0.0
+        while True:
+            wait = self._try_acquire(deployment, tokens)
+            if wait <= 0:
+                if waited > 0:
+                    logger.info(
+                        f"Rate limiter admitted {tokens} tokens on '{deployment}' after {waited:.2f}s"
+                    )
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def release(self, deployment: str, tokens: int) -> None:
+        """
+        Refunds an admitted request that never reached the service (e.g. a connection error).
+
+        :param deployment: The deployment key.
+        :param tokens: The token cost that was admitted.
+        """
+        with self._lock:
+            token_bucket, request_bucket = self._get_buckets(deployment)
+            token_bucket.release(tokens, refund=True)
+            request_bucket.release(1, refund=True)
+
+    def update_from_headers(
+        self, deployment: str, tokens: int, headers: Optional[Mapping[str, str]]
+    ) -> None:
+        """
+        Completes an admitted request and re-synchronises the buckets from the response headers.
+
+        :param deployment: The deployment key.
+        :param tokens: The token cost that was admitted for the request.
+        :param headers: The response headers, or None if unavailable.
+        """
+        rate_limit = extract_rate_limit_headers(headers or {})
+        with self._lock:
+            now = time.monotonic()
+            token_bucket, request_bucket = self._get_buckets(deployment)
+            token_bucket.release(tokens)
+            request_bucket.release(1)
+            if rate_limit["remaining-tokens"] is not None:
+                token_bucket.sync(
+                    rate_limit["remaining-tokens"], tokens, self.headroom, now
+                )
+            if rate_limit["remaining-requests"] is not None:
+                request_bucket.sync(
+                    rate_limit["remaining-requests"], 1, self.headroom, now
+                )
+
+    def penalize(
+        self, deployment: str, tokens: int, headers: Optional[Mapping[str, str]] = None
+    ) -> None:
+        """
+        Handles a 429 response: drains the buckets and blocks the deployment for the advertised retry-after.
+
+        :param deployment: The deployment key.
+        :param tokens: The token cost that was admitted for the throttled request.
+        :param headers: The headers of the 429 response, or None if unavailable.
+        """
+        retry_after = parse_retry_after(headers or {})
+        with self._lock:
+            now = time.monotonic()
+            token_bucket, request_bucket = self._get_buckets(deployment)
+            token_bucket.release(tokens)
+            request_bucket.release(1)
+            token_bucket.drain(now)
+            request_bucket.drain(now)
+            if retry_after:
+                self._blocked_until[deployment] = now + retry_after
+        logger.warning(
+            f"Deployment '{deployment}' throttled; pausing admissions for {retry_after or 0:.2f}s"
+        )
+
+    def snapshot(self, deployment: str) -> Dict[str, Optional[float]]:
+        """
+        Returns the current state of a deployment's buckets, for logging and dashboards.
+
+        :param deployment: The deployment key.
+        :return: A dictionary with the capacity, level and in-flight units of both buckets.
+        """
+        with self._lock:
+            now = time.monotonic()
+            token_bucket, request_bucket = self._get_buckets(deployment)
+            token_bucket._refill(now)
+            request_bucket._refill(now)
+            return {
+                "tokens-capacity": token_bucket.capacity,
+                "tokens-available": token_bucket.level,
+                "tokens-in-flight": token_bucket.in_flight,
+                "requests-capacity": request_bucket.capacity,
+                "requests-available": request_bucket.level,
+                "requests-in-flight": request_bucket.in_flight,
+            }
+
+
+_shared_rate_limiter: Optional[AdaptiveRateLimiter] = None
+_shared_rate_limiter_lock = threading.Lock()
+
+
+def get_shared_rate_limiter() -> AdaptiveRateLimiter:
+    """
+    Returns the process-wide rate limiter, so every manager instance (e.g. one per Streamlit session)
+    draws from the same per-deployment budget.
+
+    Default limits are read from the environment variables "AZURE_OPENAI_TPM_LIMIT" and
+    "AZURE_OPENAI_RPM_LIMIT"; when unset they are learned from the response headers.
+
+    :return: The shared AdaptiveRateLimiter.
+    """
+    global _shared_rate_limiter
+    with _shared_rate_limiter_lock:
+        if _shared_rate_limiter is None:
+            tpm = os.getenv("AZURE_OPENAI_TPM_LIMIT")
+            rpm = os.getenv("AZURE_OPENAI_RPM_LIMIT")
+            _shared_rate_limiter = AdaptiveRateLimiter(
+                tokens_per_minute=int(tpm) if tpm else None,
+                requests_per_minute=int(rpm) if rpm else None,
+            )
+        return _shared_rate_limiter
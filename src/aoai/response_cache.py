@@ -0,0 +1,207 @@
+"""
+`response_cache.py` is a module providing an exact-match cache for deterministic chat completion calls.
+
+Entries are keyed by a canonical hash of the request (deployment, messages and sampling parameters) and live in
+two tiers: a bounded in-memory LRU for microsecond hits within a process, and an optional SQLite file shared by
+all worker processes. Both tiers expire entries after a TTL and are bounded in size.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+# The disk tier is pruned of expired and excess entries once every this many writes
+_PRUNE_EVERY = 64
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_used);
+"""
+
+
+class ResponseCache:
+    """
+    A two-tier (memory and disk) response cache with TTL and size limits.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600.0,
+        max_entries: int = 1024,
+        directory: Optional[str] = None,
+        max_disk_entries: int = 100_000,
+    ):
+        """
+        Initialize the cache.
+
+        :param ttl: How long an entry stays valid, in seconds.
+        :param max_entries: The maximum number of entries kept in memory.
+        :param directory: The directory of the disk tier. None keeps the cache in memory only.
+        :param max_disk_entries: The maximum number of entries kept on disk.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._connection = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(
+                os.path.join(directory, "responses.sqlite"),
+                timeout=30.0,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(_SCHEMA)
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._writes = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        """
+        Builds a cache from the environment variables "AZURE_OPENAI_RESPONSE_CACHE_TTL" and
+        "AZURE_OPENAI_RESPONSE_CACHE_DIR".
+
+        :return: The cache, or None if no TTL is configured.
+        """
+        ttl = os.getenv("AZURE_OPENAI_RESPONSE_CACHE_TTL")
+        if not ttl:
+            return None
+        return cls(
+            ttl=float(ttl), directory=os.getenv("AZURE_OPENAI_RESPONSE_CACHE_DIR")
+        )
+
+    @staticmethod
+    def make_key(deployment: str, request: Dict[str, Any]) -> str:
+        """
+        Returns the canonical hash of a request.
+
+        :param deployment: The deployment the request targets.
+        :param request: The request parameters (messages, temperature, top_p, max_tokens, seed, ...).
+        :return: The hexadecimal sha256 of the canonical JSON serialization.
+        """
+        canonical = json.dumps(
+            {"deployment": deployment, **request},
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, expires_at: float, value: str) -> None:
+        """
+        Stores an entry in the memory tier, evicting the least recently used one when full. Caller holds the lock.
+
+        :param key: The request key.
+        :param expires_at: The wall-clock expiry time.
+        :param value: The cached response.
+        """
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the cached response of a request, if present and not expired.
+
+        :param key: The request key from `make_key`.
+        :return: The cached response, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[1]
+                del self._memory[key]
+            if self._connection is not None:
+                row = self._connection.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?",
+                    (key, now),
+                ).fetchone()
+                if row is not None:
+                    self._connection.execute(
+                        "UPDATE responses SET last_used = ? WHERE key = ?", (now, key)
+                    )
+                    self._remember(key, row[1], row[0])
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str) -> None:
+        """
+        Stores the response of a request in both tiers.
+
+        :param key: The request key from `make_key`.
+        :param value: The response to cache.
+        """
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, value)
+            if self._connection is None:
+                return
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                    (key, value, expires_at, now),
+                )
+                self._writes += 1
+                if self._writes % _PRUNE_EVERY == 0:
+                    self._connection.execute(
+                        "DELETE FROM responses WHERE expires_at <= ?", (now,)
+                    )
+                    self._connection.execute(
+                        "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                        "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                        (self.max_disk_entries,),
+                    )
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns the cache counters of this process, for logging and dashboards.
+
+        :return: A dictionary with memory hits, disk hits, misses and hit rate.
+        """
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+            }
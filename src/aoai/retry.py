@@ -0,0 +1,315 @@
+"""
+`retry.py` is a module providing the retry policy shared by the Azure OpenAI and GPT-4 Vision managers.
+
+Transient failures (429, 408, 5xx and connection errors) are retried with decorrelated-jitter exponential
+backoff. A `retry-after-ms` / `retry-after` header sent by the service takes precedence over the computed delay.
+Every call is bounded by a maximum number of attempts and an overall deadline, and the policy records
+counters so retry-induced latency can be told apart from service latency.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Tuple, TypeVar
+
+import httpx
+import openai
+import requests
+
+from src.aoai.telemetry import get_metrics
+from src.aoai.utils import parse_retry_after
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class RetryStats:
+    """
+    Thread-safe counters describing the retries performed by one or more retry policies.
+    """
+
+    def __init__(self):
+        """
+        Initialize all counters to zero.
+        """
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Resets all counters to zero.
+        """
+        with self._lock:
+            self.calls = 0
+            self.attempts = 0
+            self.retries = 0
+            self.exhausted = 0
+            self.deadline_exceeded = 0
+            self.retry_sleep_seconds = 0.0
+            self.failed_attempt_seconds = 0.0
+            self.retries_by_reason: Dict[str, int] = {}
+
+    def _record_call(self) -> None:
+        """
+        Records the start of a call.
+        """
+        with self._lock:
+            self.calls += 1
+
+    def _record_attempt(self) -> None:
+        """
+        Records an attempt, including the first one.
+        """
+        with self._lock:
+            self.attempts += 1
+
+    def _record_retry(
+        self, reason: str, failed_seconds: float, sleep_seconds: float
+    ) -> None:
+        """
+        Records a retry and the latency it added.
+
+        :param reason: A short description of the failure, e.g. "429" or "APIConnectionError".
+        :param failed_seconds: The time spent in the failed attempt.
+        :param sleep_seconds: The backoff delay before the next attempt.
+        """
+        with self._lock:
+            self.retries += 1
+            self.failed_attempt_seconds += failed_seconds
+            self.retry_sleep_seconds += sleep_seconds
+            self.retries_by_reason[reason] = self.retries_by_reason.get(reason, 0) + 1
+
+    def _record_give_up(self, deadline: bool) -> None:
+        """
+        Records a call that failed after exhausting its budget.
+
+        :param deadline: Whether the deadline, rather than the attempt budget, was exhausted.
+        """
+        with self._lock:
+            if deadline:
+                self.deadline_exceeded += 1
+            else:
+                self.exhausted += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns a copy of the counters.
+
+        :return: A dictionary of counters, including the total retry-induced latency in seconds.
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "attempts": self.attempts,
+                "retries": self.retries,
+                "exhausted": self.exhausted,
+                "deadline_exceeded": self.deadline_exceeded,
+                "retry_sleep_seconds": self.retry_sleep_seconds,
+                "failed_attempt_seconds": self.failed_attempt_seconds,
+                "retry_induced_seconds": self.retry_sleep_seconds
+                + self.failed_attempt_seconds,
+                "retries_by_reason": dict(self.retries_by_reason),
+            }
+
+
+# Counters shared by every policy that is not given its own
+DEFAULT_RETRY_STATS = RetryStats()
+
+
+def _status_and_headers(exc: BaseException) -> Tuple[Optional[int], Mapping[str, str]]:
+    """
+    Extracts the HTTP status code and headers carried by an OpenAI, httpx or requests exception.
+
+    :param exc: The exception raised by the call.
+    :return: A tuple of (status code or None, headers).
+    """
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None, {}
+    status_code = getattr(response, "status_code", None)
+    headers = getattr(response, "headers", None) or {}
+    return status_code, headers
+
+
+class RetryPolicy:
+    """
+    A retry policy with decorrelated-jitter exponential backoff, retry-after support, an attempt budget
+    and a per-call deadline. Usable for blocking calls (`call`) and coroutines (`async_call`).
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        deadline: Optional[float] = 120.0,
+        stats: Optional[RetryStats] = None,
+    ):
+        """
+        Initialize the retry policy.
+
+        :param max_attempts: The maximum number of attempts per call, including the first one.
+        :param base_delay: The minimum backoff delay, in seconds.
+        :param max_delay: The maximum computed backoff delay, in seconds.
+        :param deadline: The maximum wall-clock time of a call including retries, in seconds. None disables it.
+        :param stats: The counters to update. Defaults to `DEFAULT_RETRY_STATS`.
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.stats = stats or DEFAULT_RETRY_STATS
+
+    @staticmethod
+    def is_retryable(exc: BaseException) -> bool:
+        """
+        Decides whether a failure is transient.
+
+        :param exc: The exception raised by the call.
+        :return: True if the call should be retried.
+        """
+        if isinstance(
+            exc,
+            (
+                openai.APIConnectionError,
+                requests.ConnectionError,
+                requests.Timeout,
+                httpx.TransportError,
+            ),
+        ):
+            return True
+        status_code, _ = _status_and_headers(exc)
+        return status_code in RETRYABLE_STATUS_CODES
+
+    @staticmethod
+    def _reason(exc: BaseException) -> str:
+        """
+        Returns a short label for a failure, used in the retry counters.
+
+        :param exc: The exception raised by the call.
+        :return: The status code if any, otherwise the exception class name.
+        """
+        status_code, _ = _status_and_headers(exc)
+        return str(status_code) if status_code is not None else type(exc).__name__
+
+    def next_delay(self, previous_delay: float, exc: BaseException) -> float:
+        """
+        Computes the delay before the next attempt.
+
+        A retry-after advertised by the service is honoured, with a little jitter to avoid synchronised retries.
+        Otherwise the delay follows decorrelated jitter: uniform(base, 3 * previous), capped at `max_delay`.
+
+        :param previous_delay: The previous delay (or `base_delay` before the first retry).
+        :param exc: The exception raised by the failed attempt.
+        :return: The delay in seconds.
+        """
+        _, headers = _status_and_headers(exc)
+        retry_after = parse_retry_after(headers)
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.base_delay)  # nosec B311
+        upper = max(self.base_delay, previous_delay * 3)
+        return min(self.max_delay, random.uniform(self.base_delay, upper))  # nosec B311
+
+    def _plan_retry(
+        self,
+        exc: BaseException,
+        attempt: int,
+        started_at: float,
+        attempt_started_at: float,
+        previous_delay: float,
+    ) -> Optional[float]:
+        """
+        Decides whether and when to retry after a failed attempt, recording the outcome.
+
+        :param exc: The exception raised by the failed attempt.
+        :param attempt: The 1-based number of the failed attempt.
+        :param started_at: The monotonic time the call started.
+        :param attempt_started_at: The monotonic time the failed attempt started.
+        :param previous_delay: The previous backoff delay.
+        :return: The delay before the next attempt, or None to give up.
+        """
+        if not self.is_retryable(exc):
+            return None
+        if attempt >= self.max_attempts:
+            self.stats._record_give_up(deadline=False)
+            logger.error(f"Giving up after {attempt} attempts: {exc}")
+            return None
+        now = time.monotonic()
+        delay = self.next_delay(previous_delay, exc)
+        if self.deadline is not None and now + delay - started_at > self.deadline:
+            self.stats._record_give_up(deadline=True)
+            logger.error(
+                f"Giving up after {attempt} attempts: retrying in {delay:.2f}s would exceed the {self.deadline}s deadline"
+            )
+            return None
+        reason = self._reason(exc)
+        self.stats._record_retry(reason, now - attempt_started_at, delay)
+        get_metrics().record_retry(reason)
+        logger.warning(
+            f"Transient failure ({reason}) on attempt {attempt}/{self.max_attempts}; retrying in {delay:.2f}s"
+        )
+        return delay
+
+    def call(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Calls `func`, retrying transient failures according to the policy.
+
+        :param func: The function to call.
+        :param args: Positional arguments for `func`.
+        :param kwargs: Keyword arguments for `func`.
+        :return: The result of `func`.
+        :raises Exception: The last exception raised by `func` once retries are exhausted or not applicable.
+        """
+        self.stats._record_call()
+        started_at = time.monotonic()
+        delay = self.base_delay
+        attempt = 0
+        while True:
+            attempt += 1
+            attempt_started_at = time.monotonic()
+            self.stats._record_attempt()
+            try:
+                return func(*args, **kwargs)
+            except Exception as exc:
+                next_delay = self._plan_retry(
+                    exc, attempt, started_at, attempt_started_at, delay
+                )
+                if next_delay is None:
+                    raise
+                delay = next_delay
+            time.sleep(delay)
+
+    async def async_call(self, func: Callable[..., Awaitable[T]], *args, **kwargs) -> T:
+        """
+        Awaits `func`, retrying transient failures according to the policy without blocking the event loop.
+
+        :param func: The coroutine function to await.
+        :param args: Positional arguments for `func`.
+        :param kwargs: Keyword arguments for `func`.
+        :return: The result of `func`.
+        :raises Exception: The last exception raised by `func` once retries are exhausted or not applicable.
+        """
+        self.stats._record_call()
+        started_at = time.monotonic()
+        delay = self.base_delay
+        attempt = 0
+        while True:
+            attempt += 1
+            attempt_started_at = time.monotonic()
+            self.stats._record_attempt()
+            try:
+                return await func(*args, **kwargs)
+            except Exception as exc:
+                next_delay = self._plan_retry(
+                    exc, attempt, started_at, attempt_started_at, delay
+                )
+                if next_delay is None:
+                    raise
+                delay = next_delay
+            await asyncio.sleep(delay)
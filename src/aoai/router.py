@@ -0,0 +1,286 @@
+"""
+`router.py` is a module for spreading chat completion traffic over a pool of Azure OpenAI deployments.
+
+The router ranks deployments per request using the remaining quota tracked by the rate limiter (synced from the
+`x-ratelimit-remaining-*` headers), an exponentially weighted moving average (EWMA) of latency, and health state.
+Throttled or failing deployments are cooled down, so a 429 or 5xx fails the request over to the next deployment
+and the usable TPM grows with the size of the pool.
+"""
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import weakref
+from typing import Any, Dict, List, Optional
+
+import openai
+from openai import AsyncAzureOpenAI, AzureOpenAI
+
+from src.aoai.rate_limiter import AdaptiveRateLimiter
+from src.aoai.transport import get_shared_http_client
+from src.aoai.utils import parse_retry_after
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+# Failures that make the router try the next deployment instead of surfacing the error
+FAILOVER_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+)
+
+
+class DeploymentEndpoint:
+    """
+    A single member of the deployment pool: an endpoint, its key, a deployment name and its live statistics.
+    """
+
+    def __init__(
+        self,
+        azure_endpoint: str,
+        api_key: str,
+        deployment_name: str,
+        api_version: Optional[str] = None,
+        weight: float = 1.0,
+    ):
+        """
+        Initialize the deployment.
+
+        :param azure_endpoint: The Azure OpenAI endpoint hosting the deployment.
+        :param api_key: The API key of the endpoint.
+        :param deployment_name: The name of the deployment.
+        :param api_version: The API version. Defaults to "AZURE_OPENAI_API_VERSION" or "2023-05-15".
+        :param weight: A relative preference, e.g. proportional to the deployment's provisioned TPM.
+        """
+        self.azure_endpoint = azure_endpoint
+        self.api_key = api_key
+        self.deployment_name = deployment_name
+        self.api_version = (
+            api_version or os.getenv("AZURE_OPENAI_API_VERSION") or "2023-05-15"
+        )
+        self.weight = weight
+
+        self.ewma_latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.failures = 0
+
+        self._client: Optional[AzureOpenAI] = None
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def key(self) -> str:
+        """
+        Returns the key identifying this deployment's quota, shared with the rate limiter.
+
+        :return: The deployment key.
+        """
+        return f"{self.azure_endpoint}|{self.deployment_name}"
+
+    def get_client(self) -> AzureOpenAI:
+        """
+        Returns the synchronous client of this deployment, creating it on first use.
+
+        :return: The AzureOpenAI client.
+        """
+        if self._client is None:
+            self._client = AzureOpenAI(
+                api_key=self.api_key,
+                api_version=self.api_version,
+                azure_endpoint=self.azure_endpoint,
+                max_retries=0,
+                http_client=get_shared_http_client(),
+            )
+        return self._client
+
+    def get_async_client(self) -> AsyncAzureOpenAI:
+        """
+        Returns the asynchronous client of this deployment bound to the running event loop.
+
+        :return: The AsyncAzureOpenAI client.
+        """
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = AsyncAzureOpenAI(
+                api_key=self.api_key,
+                api_version=self.api_version,
+                azure_endpoint=self.azure_endpoint,
+                max_retries=0,
+            )
+            self._async_clients[loop] = client
+        return client
+
+
+class DeploymentRouter:
+    """
+    Chooses, per request, the order in which the deployments of a pool are tried, and tracks their health.
+    """
+
+    def __init__(
+        self,
+        deployments: List[DeploymentEndpoint],
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        ewma_alpha: float = 0.3,
+        failure_threshold: int = 3,
+        failure_cooldown: float = 30.0,
+        throttle_cooldown: float = 1.0,
+    ):
+        """
+        Initialize the router.
+
+        :param deployments: The pool of deployments. Must not be empty.
+        :param rate_limiter: The limiter whose per-deployment budget reflects the remaining-quota headers.
+        :param ewma_alpha: The smoothing factor of the latency EWMA.
+        :param failure_threshold: Consecutive 5xx or connection failures after which a deployment is marked unhealthy.
+        :param failure_cooldown: How long an unhealthy deployment is avoided, in seconds.
+        :param throttle_cooldown: How long a throttled deployment is avoided when no retry-after is advertised.
+        """
+        if not deployments:
+            raise ValueError("DeploymentRouter requires at least one deployment.")
+        self.deployments = deployments
+        self.rate_limiter = rate_limiter
+        self.ewma_alpha = ewma_alpha
+        self.failure_threshold = failure_threshold
+        self.failure_cooldown = failure_cooldown
+        self.throttle_cooldown = throttle_cooldown
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(
+        cls, rate_limiter: Optional[AdaptiveRateLimiter] = None
+    ) -> Optional["DeploymentRouter"]:
+        """
+        Builds a router from the "AZURE_OPENAI_DEPLOYMENTS" environment variable.
+
+        The variable holds a JSON list of objects with the keys `azure_endpoint`, `api_key`, `deployment_name`
+        and optionally `api_version` and `weight`.
+
+        :param rate_limiter: The limiter tracking the deployments' remaining quota.
+        :return: The router, or None if the variable is not set.
+        """
+        pool = os.getenv("AZURE_OPENAI_DEPLOYMENTS")
+        if not pool:
+            return None
+        try:
+            deployments = [DeploymentEndpoint(**entry) for entry in json.loads(pool)]
+        except (TypeError, ValueError) as e:
+            raise ValueError(
+                f"AZURE_OPENAI_DEPLOYMENTS must be a JSON list of deployments: {e}"
+            ) from e
+        return cls(deployments, rate_limiter=rate_limiter)
+
+    def _quota_fraction(self, deployment: DeploymentEndpoint) -> float:
+        """
+        Returns the fraction of the deployment's token budget currently available, 1.0 if unknown.
+
+        :param deployment: The deployment to inspect.
+        :return: A value between 0 and 1.
+        """
+        if self.rate_limiter is None:
+            return 1.0
+        snapshot = self.rate_limiter.snapshot(deployment.key)
+        capacity = snapshot["tokens-capacity"]
+        available = snapshot["tokens-available"]
+        if not capacity or available is None:
+            return 1.0
+        return min(1.0, max(0.0, available / capacity))
+
+    def candidates(self) -> List[DeploymentEndpoint]:
+        """
+        Returns the deployments in the order they should be tried for the next request.
+
+        Deployments that are not cooling down come first, ranked by weight * quota / latency with a little
+        jitter to spread load. Deployments without latency samples are assumed as fast as the fastest one, so
+        new pool members get traffic. Cooling-down deployments follow as a last resort, soonest available first.
+
+        :return: The ordered list of deployments.
+        """
+        now = time.monotonic()
+        with self._lock:
+            latencies = [d.ewma_latency for d in self.deployments if d.ewma_latency]
+            default_latency = min(latencies) if latencies else 1.0
+            ready, cooling = [], []
+            for deployment in self.deployments:
+                if deployment.cooldown_until > now:
+                    cooling.append(deployment)
+                    continue
+                latency = deployment.ewma_latency or default_latency
+                score = (
+                    deployment.weight
+                    * (self._quota_fraction(deployment) + 0.05)
+                    / max(latency, 1e-3)
+                    * random.uniform(0.9, 1.1)  # nosec B311
+                )
+                ready.append((score, deployment))
+        ready.sort(key=lambda item: item[0], reverse=True)
+        cooling.sort(key=lambda deployment: deployment.cooldown_until)
+        return [deployment for _, deployment in ready] + cooling
+
+    def record_success(self, deployment: DeploymentEndpoint, latency: float) -> None:
+        """
+        Records a successful request, updating the latency EWMA and clearing failures.
+
+        :param deployment: The deployment that served the request.
+        :param latency: The request latency, in seconds.
+        """
+        with self._lock:
+            deployment.requests += 1
+            deployment.consecutive_failures = 0
+            if deployment.ewma_latency is None:
+                deployment.ewma_latency = latency
+            else:
+                deployment.ewma_latency = (
+                    self.ewma_alpha * latency
+                    + (1 - self.ewma_alpha) * deployment.ewma_latency
+                )
+
+    def record_failure(self, deployment: DeploymentEndpoint, error: Exception) -> None:
+        """
+        Records a failed request, cooling the deployment down when throttled or unhealthy.
+
+        :param deployment: The deployment that failed.
+        :param error: The error raised by the request.
+        """
+        now = time.monotonic()
+        with self._lock:
+            deployment.requests += 1
+            deployment.failures += 1
+            if isinstance(error, openai.RateLimitError):
+                retry_after = parse_retry_after(error.response.headers)
+                deployment.cooldown_until = now + (
+                    retry_after if retry_after is not None else self.throttle_cooldown
+                )
+                return
+            deployment.consecutive_failures += 1
+            if deployment.consecutive_failures >= self.failure_threshold:
+                deployment.cooldown_until = now + self.failure_cooldown
+                logger.warning(
+                    f"Deployment '{deployment.key}' marked unhealthy for {self.failure_cooldown}s "
+                    f"after {deployment.consecutive_failures} consecutive failures"
+                )
+
+    def status(self) -> List[Dict[str, Any]]:
+        """
+        Returns the state of every deployment in the pool, for logging and dashboards.
+
+        :return: A list of dictionaries, one per deployment.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "deployment": deployment.key,
+                    "healthy": deployment.cooldown_until <= now,
+                    "ewma_latency": deployment.ewma_latency,
+                    "requests": deployment.requests,
+                    "failures": deployment.failures,
+                }
+                for deployment in self.deployments
+            ]
@@ -0,0 +1,395 @@
+"""
+`scheduler.py` is a module providing priority-aware admission of requests to Azure OpenAI deployments.
+
+Interactive chats, agent loops and background jobs draw on the same deployment quota. `PriorityScheduler` sits in
+front of the rate limiter and decides which waiting request is admitted next:
+
+- Priority classes are served strictly in order, so an interactive request overtakes queued background work.
+- Within a class, tenants share the quota by weighted fair queuing (WFQ): each request gets a virtual finish time
+  of its token cost divided by its tenant's weight, and the earliest finish time goes first.
+- Lower classes are only admitted while the deployment's remaining token budget stays above a reserve, so
+  background work soaks up spare capacity without starving user-facing requests.
+
+The priority and tenant of a request are taken from the caller's context, set with `request_priority`.
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from src.aoai.rate_limiter import AdaptiveRateLimiter
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+# Priority classes, served in this order
+PRIORITY_CLASSES = ("interactive", "standard", "background")
+
+# Fraction of a deployment's token capacity that must remain available after admitting a request of each class
+DEFAULT_RESERVES = {"interactive": 0.0, "standard": 0.1, "background": 0.3}
+
+_request_priority: "ContextVar[Tuple[str, str]]" = ContextVar(
+    "aoai_request_priority", default=("interactive", "default")
+)
+
+
+@contextmanager
+def request_priority(
+    priority: str = "interactive", tenant: str = "default"
+) -> Iterator[None]:
+    """
+    Sets the priority class and tenant of the requests made within the block, including in the asyncio tasks
+    created within it.
+
+    :param priority: One of "interactive", "standard" or "background".
+    :param tenant: The tenant the requests are accounted to, e.g. a page, a job or a customer.
+    :raises ValueError: If the priority class is unknown.
+    """
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(
+            f"Unknown priority class '{priority}'; expected one of {PRIORITY_CLASSES}"
+        )
+    token = _request_priority.set((priority, tenant))
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+def current_priority() -> Tuple[str, str]:
+    """
+    Returns the priority class and tenant of the current context.
+
+    :return: A tuple of (priority class, tenant).
+    """
+    return _request_priority.get()
+
+
+class _Ticket:
+    """
+    A request waiting for admission.
+    """
+
+    __slots__ = ("order", "priority", "tenant", "tokens", "start", "abandoned")
+
+    def __init__(
+        self,
+        order: Tuple[int, float, int],
+        priority: str,
+        tenant: str,
+        tokens: int,
+        start: float,
+    ):
+        """
+        Initialize the ticket.
+
+        :param order: The sort key: (class rank, virtual finish time, arrival sequence).
+        :param priority: The priority class.
+        :param tenant: The tenant.
+        :param tokens: The estimated token cost of the request.
+        :param start: The virtual start time of the request within its class.
+        """
+        self.order = order
+        self.priority = priority
+        self.tenant = tenant
+        self.tokens = tokens
+        self.start = start
+        self.abandoned = False
+
+    def __lt__(self, other: "_Ticket") -> bool:
+        """
+        Orders tickets by class, then virtual finish time, then arrival.
+        """
+        return self.order < other.order
+
+
+class _DeploymentQueue:
+    """
+    The waiting requests of one deployment and the WFQ clocks of its priority classes.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty queue.
+        """
+        self.heap: List[_Ticket] = []
+        self.virtual_time: Dict[str, float] = {}
+        self.last_finish: Dict[Tuple[str, str], float] = {}
+
+    def head(self) -> Optional[_Ticket]:
+        """
+        Returns the next request to admit, discarding abandoned ones.
+
+        :return: The head ticket or None if the queue is empty.
+        """
+        while self.heap and self.heap[0].abandoned:
+            heapq.heappop(self.heap)
+        return self.heap[0] if self.heap else None
+
+
+class PriorityScheduler:
+    """
+    Admits requests to the rate limiter by priority class, then by weighted fair queuing across tenants.
+    """
+
+    def __init__(
+        self,
+        rate_limiter: AdaptiveRateLimiter,
+        tenant_weights: Optional[Dict[str, float]] = None,
+        reserves: Optional[Dict[str, float]] = None,
+        poll_interval: float = 0.02,
+    ):
+        """
+        Initialize the scheduler.
+
+        :param rate_limiter: The rate limiter holding the deployments' budgets.
+        :param tenant_weights: The relative share of each tenant within its class. Unlisted tenants weigh 1.
+        :param reserves: The fraction of token capacity each class must leave available. Defaults to
+            `DEFAULT_RESERVES`. Reserves apply once the deployment's capacity is known.
+        :param poll_interval: How often, in seconds, requests that are not at the head of the queue check again.
+        """
+        self.rate_limiter = rate_limiter
+        self.tenant_weights = tenant_weights or {}
+        self.reserves = {**DEFAULT_RESERVES, **(reserves or {})}
+        self.poll_interval = poll_interval
+        self._queues: Dict[str, _DeploymentQueue] = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+        self.admitted: Dict[str, int] = {priority: 0 for priority in PRIORITY_CLASSES}
+        self.waited: Dict[str, float] = {priority: 0.0 for priority in PRIORITY_CLASSES}
+
+    @classmethod
+    def from_env(cls, rate_limiter: AdaptiveRateLimiter) -> "PriorityScheduler":
+        """
+        Builds a scheduler with the tenant weights from the environment variable "AZURE_OPENAI_TENANT_WEIGHTS",
+        a JSON object such as {"documentogpt": 3, "nightly": 1}.
+
+        :param rate_limiter: The rate limiter holding the deployments' budgets.
+        :return: The scheduler.
+        """
+        weights = os.getenv("AZURE_OPENAI_TENANT_WEIGHTS")
+        try:
+            tenant_weights = json.loads(weights) if weights else None
+        except ValueError:
+            logger.warning("Ignoring malformed AZURE_OPENAI_TENANT_WEIGHTS")
+            tenant_weights = None
+        return cls(rate_limiter, tenant_weights=tenant_weights)
+
+    def _enqueue(
+        self, deployment: str, tokens: int, priority: str, tenant: str
+    ) -> _Ticket:
+        """
+        Queues a request, computing its WFQ virtual finish time within its class.
+
+        :param deployment: The deployment key.
+        :param tokens: The estimated token cost of the request.
+        :param priority: The priority class.
+        :param tenant: The tenant.
+        :return: The ticket of the request.
+        """
+        with self._lock:
+            queue = self._queues.setdefault(deployment, _DeploymentQueue())
+            start = max(
+                queue.virtual_time.get(priority, 0.0),
+                queue.last_finish.get((priority, tenant), 0.0),
+            )
+            finish = start + max(tokens, 1) / self.tenant_weights.get(tenant, 1.0)
+            queue.last_finish[(priority, tenant)] = finish
+            ticket = _Ticket(
+                (PRIORITY_CLASSES.index(priority), finish, next(self._sequence)),
+                priority,
+                tenant,
+                tokens,
+                start,
+            )
+            heapq.heappush(queue.heap, ticket)
+            return ticket
+
+    def _reserve_wait(self, deployment: str, ticket: _Ticket) -> float:
+        """
+        Returns how long a request must wait for its class's reserve to be respected.
+
+        :param deployment: The deployment key.
+        :param ticket: The ticket of the request.
+        :return: 0 if admitting the request leaves the reserve available, otherwise the seconds to wait.
+        """
+        reserve = self.reserves.get(ticket.priority, 0.0)
+        if reserve <= 0:
+            return 0.0
+        state = self.rate_limiter.snapshot(deployment)
+        capacity, available = state["tokens-capacity"], state["tokens-available"]
+        if not capacity or available is None:
+            return 0.0
+        shortfall = reserve * capacity + ticket.tokens - available
+        if shortfall <= 0:
+            return 0.0
+        # Requests larger than the unreserved capacity would never fit; admit them once the bucket is full
+        if available >= capacity:
+            return 0.0
+        return min(shortfall, capacity - available) * 60.0 / capacity
+
+    def _try_admit(self, deployment: str, ticket: _Ticket) -> float:
+        """
+        Admits the request if it is at the head of its deployment's queue and fits the budget.
+
+        :param deployment: The deployment key.
+        :param ticket: The ticket of the request.
+        :return: 0 if the request was admitted, otherwise the number of seconds to wait before trying again.
+        """
+        with self._lock:
+            queue = self._queues[deployment]
+            if queue.head() is not ticket:
+                return self.poll_interval
+            wait = self._reserve_wait(deployment, ticket)
+            if wait <= 0:
+                wait = self.rate_limiter._try_acquire(deployment, ticket.tokens)
+            if wait > 0:
+                return wait
+            heapq.heappop(queue.heap)
+            queue.virtual_time[ticket.priority] = max(
+                queue.virtual_time.get(ticket.priority, 0.0), ticket.start
+            )
+            return 0.0
+
+    def _admitted(self, deployment: str, ticket: _Ticket, waited: float) -> float:
+        """
+        Records an admission.
+
+        :param deployment: The deployment key.
+        :param ticket: The ticket of the admitted request.
+        :param waited: The time the request waited, in seconds.
+        :return: The time waited.
+        """
+        with self._lock:
+            self.admitted[ticket.priority] += 1
+            self.waited[ticket.priority] += waited
+        if waited > 1.0:
+            logger.info(
+                f"Scheduler admitted a {ticket.priority} request of {ticket.tokens} tokens for tenant "
+                f"'{ticket.tenant}' on '{deployment}' after {waited:.2f}s"
+            )
+        return waited
+
+    def acquire(
+        self,
+        deployment: str,
+        tokens: int,
+        priority: Optional[str] = None,
+        tenant: Optional[str] = None,
+    ) -> float:
+        """
+        Blocks until the request is admitted.
+
+        :param deployment: The deployment key.
+        :param tokens: The estimated token cost of the request.
+        :param priority: The priority class. Defaults to the one set with `request_priority`.
+        :param tenant: The tenant. Defaults to the one set with `request_priority`.
+        :return: The time spent waiting, in seconds.
+        """
+        context_priority, context_tenant = current_priority()
+        ticket = self._enqueue(
+            deployment, tokens, priority or context_priority, tenant or context_tenant
+        )
+        started_at = time.monotonic()
+        try:
+            while True:
+                wait = self._try_admit(deployment, ticket)
+                if wait <= 0:
+                    return self._admitted(
+                        deployment, ticket, time.monotonic() - started_at
+                    )
+                time.sleep(min(wait, self.poll_interval))
+        except BaseException:
+            ticket.abandoned = True
+            raise
+
+    async def async_acquire(
+        self,
+        deployment: str,
+        tokens: int,
+        priority: Optional[str] = None,
+        tenant: Optional[str] = None,
+    ) -> float:
+        """
+        Waits, without blocking the event loop, until the request is admitted.
+
+        :param deployment: The deployment key.
+        :param tokens: The estimated token cost of the request.
+        :param priority: The priority class. Defaults to the one set with `request_priority`.
+        :param tenant: The tenant. Defaults to the one set with `request_priority`.
+        :return: The time spent waiting, in seconds.
+        """
+        context_priority, context_tenant = current_priority()
+        ticket = self._enqueue(
+            deployment, tokens, priority or context_priority, tenant or context_tenant
+        )
+        started_at = time.monotonic()
+        try:
+            while True:
+                wait = self._try_admit(deployment, ticket)
+                if wait <= 0:
+                    return self._admitted(
+                        deployment, ticket, time.monotonic() - started_at
+                    )
+                await asyncio.sleep(min(wait, self.poll_interval))
+        except BaseException:
+            ticket.abandoned = True
+            raise
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns the queue lengths and admission statistics per priority class, for logging and dashboards.
+
+        :return: A dictionary with the queued requests, admitted requests and mean wait of each class.
+        """
+        with self._lock:
+            queued = {priority: 0 for priority in PRIORITY_CLASSES}
+            for queue in self._queues.values():
+                for ticket in queue.heap:
+                    if not ticket.abandoned:
+                        queued[ticket.priority] += 1
+            return {
+                priority: {
+                    "queued": queued[priority],
+                    "admitted": self.admitted[priority],
+                    "mean_wait": (
+                        self.waited[priority] / self.admitted[priority]
+                        if self.admitted[priority]
+                        else 0.0
+                    ),
+                }
+                for priority in PRIORITY_CLASSES
+            }
+
+
+_shared_schedulers: (
+    "weakref.WeakKeyDictionary[AdaptiveRateLimiter, PriorityScheduler]"
+) = weakref.WeakKeyDictionary()
+_shared_schedulers_lock = threading.Lock()
+
+
+def get_shared_scheduler(rate_limiter: AdaptiveRateLimiter) -> PriorityScheduler:
+    """
+    Returns the process-wide scheduler of a rate limiter, so every manager drawing on the same budget
+    (e.g. one per Streamlit session) queues in the same order.
+
+    :param rate_limiter: The rate limiter.
+    :return: The shared scheduler, built with `PriorityScheduler.from_env` on first use.
+    """
+    with _shared_schedulers_lock:
+        scheduler = _shared_schedulers.get(rate_limiter)
+        if scheduler is None:
+            scheduler = _shared_schedulers[rate_limiter] = PriorityScheduler.from_env(
+                rate_limiter
+            )
+        return scheduler
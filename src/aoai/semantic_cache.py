@@ -0,0 +1,234 @@
+"""
+`semantic_cache.py` is a module providing a semantic response cache for chat queries.
+
+Paraphrased questions ("summarize this", "give me a summary") miss the exact-match response cache. This cache
+embeds the normalized query and searches a local, in-memory vector index for a previously answered query whose
+cosine similarity exceeds a threshold. The index is partitioned by a fingerprint of everything else the answer
+depends on (deployment, system message, conversation history, attachments and sampling parameters), so a cached
+answer is only reused for the same context.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a query before embedding it: case, surrounding punctuation and whitespace are not meaningful.
+
+    :param query: The user query.
+    :return: The normalized query.
+    """
+    return re.sub(r"\s+", " ", query).strip().strip("?!.").strip().lower()
+
+
+def context_fingerprint(**context: Any) -> str:
+    """
+    Returns a stable fingerprint of the context an answer depends on.
+
+    :param context: The context parts, e.g. deployment, conversation history, attachments and sampling parameters.
+    :return: The hexadecimal sha256 of the canonical JSON serialization.
+    """
+    canonical = json.dumps(
+        context, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _Partition:
+    """
+    The vectors and answers cached for one context, stored as a growable matrix of unit vectors.
+    """
+
+    def __init__(self, dimensions: int):
+        """
+        Initialize an empty partition.
+
+        :param dimensions: The dimensions of the query embeddings.
+        """
+        self.vectors = np.empty((16, dimensions), dtype=np.float32)
+        self.answers: List[str] = []
+        self.tokens: List[int] = []
+        self.created: List[float] = []
+
+    def __len__(self) -> int:
+        """
+        Returns the number of cached answers.
+        """
+        return len(self.answers)
+
+    def add(
+        self, vector: np.ndarray, answer: str, tokens: int, max_entries: int
+    ) -> None:
+        """
+        Appends an entry, dropping the oldest one when the partition is full.
+
+        :param vector: The unit query embedding.
+        :param answer: The cached answer.
+        :param tokens: The tokens the original request consumed.
+        :param max_entries: The maximum number of entries in the partition.
+        """
+        if len(self) >= max_entries:
+            self.vectors[: len(self) - 1] = self.vectors[1 : len(self)]
+            del self.answers[0], self.tokens[0], self.created[0]
+        if len(self) == len(self.vectors):
+            grown = np.empty(
+                (len(self.vectors) * 2, self.vectors.shape[1]), dtype=np.float32
+            )
+            grown[: len(self)] = self.vectors
+            self.vectors = grown
+        self.vectors[len(self)] = vector
+        self.answers.append(answer)
+        self.tokens.append(tokens)
+        self.created.append(time.time())
+
+
+class SemanticResponseCache:
+    """
+    An in-memory, context-partitioned semantic cache of chat answers with hit-rate and saved-token metrics.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        max_entries: int = 512,
+        max_contexts: int = 256,
+        ttl: Optional[float] = 3600.0,
+    ):
+        """
+        Initialize the cache.
+
+        :param threshold: The minimum cosine similarity for a cached answer to be reused.
+        :param max_entries: The maximum number of answers kept per context.
+        :param max_contexts: The maximum number of contexts kept; the least recently used one is dropped.
+        :param ttl: How long an answer stays valid, in seconds. None keeps answers until evicted.
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_contexts = max_contexts
+        self.ttl = ttl
+        self._partitions: "OrderedDict[str, _Partition]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.hits = 0
+        self.saved_tokens = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["SemanticResponseCache"]:
+        """
+        Builds a cache from the environment variable "AZURE_OPENAI_SEMANTIC_CACHE_THRESHOLD".
+
+        :return: The cache, or None if no threshold is configured.
+        """
+        threshold = os.getenv("AZURE_OPENAI_SEMANTIC_CACHE_THRESHOLD")
+        if not threshold:
+            return None
+        return cls(threshold=float(threshold))
+
+    @staticmethod
+    def _unit(vector: np.ndarray) -> np.ndarray:
+        """
+        Scales a vector to unit length, so dot products are cosine similarities.
+
+        :param vector: The embedding.
+        :return: The normalized float32 embedding.
+        """
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(
+        self, fingerprint: str, vector: np.ndarray
+    ) -> Optional[Tuple[str, float]]:
+        """
+        Searches the context's partition for the most similar cached query.
+
+        :param fingerprint: The context fingerprint from `context_fingerprint`.
+        :param vector: The embedding of the normalized query.
+        :return: A tuple of (cached answer, similarity) above the threshold, or None on a miss.
+        """
+        query = self._unit(vector)
+        with self._lock:
+            self.lookups += 1
+            partition = self._partitions.get(fingerprint)
+            if partition is None or not len(partition):
+                return self._miss()
+            self._partitions.move_to_end(fingerprint)
+            similarities = partition.vectors[: len(partition)] @ query
+            if self.ttl is not None:
+                expired = np.asarray(partition.created) < time.time() - self.ttl
+                similarities[expired] = -1.0
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                return self._miss(similarity)
+            self.hits += 1
+            self.saved_tokens += partition.tokens[best]
+            logger.info(
+                f"Semantic cache hit (similarity {similarity:.3f}); hit rate "
+                f"{self.hits / self.lookups:.1%}, {self.saved_tokens} tokens saved"
+            )
+            return partition.answers[best], similarity
+
+    def _miss(self, similarity: Optional[float] = None) -> None:
+        """
+        Logs a miss with the best similarity found and the running hit rate. Caller holds the lock.
+
+        :param similarity: The similarity of the closest cached query, if any.
+        """
+        closest = f" (closest {similarity:.3f})" if similarity is not None else ""
+        logger.info(
+            f"Semantic cache miss{closest}; hit rate {self.hits / self.lookups:.1%}, "
+            f"{self.saved_tokens} tokens saved"
+        )
+        return None
+
+    def store(
+        self, fingerprint: str, vector: np.ndarray, answer: str, tokens: int = 0
+    ) -> None:
+        """
+        Caches the answer to a query.
+
+        :param fingerprint: The context fingerprint from `context_fingerprint`.
+        :param vector: The embedding of the normalized query.
+        :param answer: The answer to cache.
+        :param tokens: The tokens the request consumed, credited as saved on every hit.
+        """
+        vector = self._unit(vector)
+        with self._lock:
+            partition = self._partitions.get(fingerprint)
+            if partition is None:
+                partition = self._partitions[fingerprint] = _Partition(len(vector))
+                while len(self._partitions) > self.max_contexts:
+                    self._partitions.popitem(last=False)
+            self._partitions.move_to_end(fingerprint)
+            partition.add(vector, answer, tokens, self.max_entries)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns the cache counters, for tuning the threshold.
+
+        :return: A dictionary with lookups, hits, hit rate, saved tokens and the number of cached answers.
+        """
+        with self._lock:
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "saved_tokens": self.saved_tokens,
+                "entries": sum(len(p) for p in self._partitions.values()),
+            }
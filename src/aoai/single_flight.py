@@ -0,0 +1,217 @@
+"""
+`single_flight.py` is a module providing request coalescing for identical in-flight calls.
+
+When several Streamlit sessions submit the same prompt or the same file at the same time, each would issue its own
+upstream call. `SingleFlight` keys every call by a canonical hash of the request: the first caller (the leader)
+performs the call, and every caller arriving with the same key while it is in flight waits for the leader's result
+instead of calling again. Nothing is kept once the call completes; reuse of finished results is the job of the
+response caches.
+
+Waiters share a `concurrent.futures.Future`, so synchronous callers in any thread and asynchronous callers on any
+event loop can wait for the same call.
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+
+class _LeaderAbandoned(Exception):
+    """
+    Tells the waiters that the leader stopped without an outcome (e.g. it was cancelled), so one of them must call.
+    """
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into a single call.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty group of in-flight calls.
+        """
+        self._calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(*parts: Any, **request: Any) -> str:
+        """
+        Returns the canonical hash of a request.
+
+        :param parts: The target of the request, e.g. the endpoint and deployment.
+        :param request: The request parameters.
+        :return: The hexadecimal sha256 of the canonical JSON serialization.
+        """
+        canonical = json.dumps(
+            {"target": parts, "request": request},
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        """
+        Returns the future of the call in flight for a key, registering a new one if there is none.
+
+        :param key: The request key.
+        :return: A tuple of (future, whether the caller is the leader and must perform the call).
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                logger.info(
+                    f"Coalesced a request with an identical one in flight "
+                    f"({self.coalesced} of {self.calls + self.coalesced} requests coalesced)"
+                )
+                return future, False
+            future = self._calls[key] = Future()
+            self.calls += 1
+            return future, True
+
+    def _settle(
+        self,
+        key: str,
+        future: Future,
+        result: Any = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        """
+        Publishes the leader's outcome to the waiters and forgets the call.
+
+        :param key: The request key.
+        :param future: The future of the call.
+        :param result: The result of the call.
+        :param error: The exception raised by the call, if any.
+        """
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _abandon(self, key: str, future: Future) -> None:
+        """
+        Forgets a call whose leader stopped without an outcome and wakes its waiters to call again.
+
+        The leader's `BaseException` (e.g. a cancellation or a KeyboardInterrupt) concerns the leader only and is
+        not shared.
+
+        :param key: The request key.
+        :param future: The future of the call.
+        """
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        logger.info("Leader of a coalesced request stopped; its waiters call again")
+        future.set_exception(_LeaderAbandoned())
+
+    def do(self, key: str, function: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Calls a function, or waits for the identical call already in flight.
+
+        :param key: The request key from `make_key`.
+        :param function: The function performing the request.
+        :param args: The positional arguments of the function.
+        :param kwargs: The keyword arguments of the function.
+        :return: The result of the call; its exception is raised to the leader and every waiter.
+        """
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                return future.result()
+            except _LeaderAbandoned:
+                continue
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            self._settle(key, future, error=e)
+            raise
+        except BaseException:
+            self._abandon(key, future)
+            raise
+        self._settle(key, future, result)
+        return result
+
+    async def async_do(
+        self, key: str, function: Callable[..., Awaitable[Any]], *args, **kwargs
+    ) -> Any:
+        """
+        Awaitable counterpart of `do`.
+
+        A waiter that is cancelled stops waiting without cancelling the call the other waiters depend on. A leader
+        that is cancelled is replaced by one of its waiters, which calls again.
+
+        :param key: The request key from `make_key`.
+        :param function: The coroutine function performing the request.
+        :param args: The positional arguments of the function.
+        :param kwargs: The keyword arguments of the function.
+        :return: The result of the call; its exception is raised to the leader and every waiter.
+        """
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except _LeaderAbandoned:
+                continue
+        try:
+            result = await function(*args, **kwargs)
+        except Exception as e:
+            self._settle(key, future, error=e)
+            raise
+        except BaseException:
+            self._abandon(key, future)
+            raise
+        self._settle(key, future, result)
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns the coalescing counters, for logging and dashboards.
+
+        :return: A dictionary with upstream calls, coalesced requests and calls in flight.
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls),
+            }
+
+
+_shared_single_flight: Optional[SingleFlight] = None
+_shared_single_flight_lock = threading.Lock()
+
+
+def get_shared_single_flight() -> SingleFlight:
+    """
+    Returns the process-wide single-flight group, so identical requests from every manager instance
+    (e.g. one per Streamlit session) are coalesced.
+
+    :return: The shared group.
+    """
+    global _shared_single_flight
+    with _shared_single_flight_lock:
+        if _shared_single_flight is None:
+            _shared_single_flight = SingleFlight()
+        return _shared_single_flight
@@ -0,0 +1,113 @@
+"""
+`streaming.py` is a module providing the metrics recorded while streaming a chat completion.
+
+`StreamMetrics` is yielded as the last item of `AzureOpenAIManager.stream_chat_response`, after the text deltas.
+It carries the full response, the usage reported by the service and the latency figures users perceive:
+time-to-first-token (TTFT) and generation throughput in tokens per second.
+"""
+
+import time
+from typing import Any, Dict, Optional
+
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+
+class StreamMetrics:
+    """
+    Timing and usage of a streamed chat completion.
+    """
+
+    def __init__(self):
+        """
+        Starts the clock; create the instance right before sending the request.
+        """
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.content = ""
+        self.chunks = 0
+        self.usage: Optional[Any] = None
+        self.completion_tokens: Optional[int] = None
+
+    def on_delta(self, text: str) -> None:
+        """
+        Records a text delta.
+
+        :param text: The content of the delta.
+        """
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.content += text
+        self.chunks += 1
+
+    def finish(self, completion_tokens: Optional[int] = None) -> "StreamMetrics":
+        """
+        Stops the clock and logs the stream's latency figures.
+
+        :param completion_tokens: The number of generated tokens when the service did not report usage.
+        :return: The metrics themselves, for convenience.
+        """
+        self.finished_at = time.perf_counter()
+        if self.usage is not None:
+            self.completion_tokens = self.usage.completion_tokens
+        else:
+            self.completion_tokens = completion_tokens
+        ttft = self.time_to_first_token
+        ttft_text = f"{ttft:.3f}s" if ttft is not None else "n/a"
+        logger.info(
+            f"Streamed {self.completion_tokens} tokens in {self.duration:.2f}s "
+            f"(TTFT {ttft_text}, {self.tokens_per_second or 0:.1f} tokens/s)"
+        )
+        return self
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        """
+        Returns the time from sending the request to receiving the first content, in seconds.
+
+        :return: The TTFT, or None if no content was received.
+        """
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    @property
+    def duration(self) -> float:
+        """
+        Returns the total time of the stream so far, in seconds.
+
+        :return: The duration.
+        """
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        """
+        Returns the generation throughput, measured from the first token to the end of the stream.
+
+        :return: The tokens per second, or None if unknown.
+        """
+        if not self.completion_tokens or self.first_token_at is None:
+            return None
+        generation_time = (
+            self.finished_at or time.perf_counter()
+        ) - self.first_token_at
+        return self.completion_tokens / generation_time if generation_time > 0 else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the metrics as a dictionary, for logging and dashboards.
+
+        :return: A dictionary of the latency and usage figures.
+        """
+        return {
+            "time_to_first_token": self.time_to_first_token,
+            "duration": self.duration,
+            "tokens_per_second": self.tokens_per_second,
+            "completion_tokens": self.completion_tokens,
+            "prompt_tokens": self.usage.prompt_tokens if self.usage else None,
+            "chunks": self.chunks,
+        }
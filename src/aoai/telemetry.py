@@ -0,0 +1,563 @@
+"""
+`telemetry.py` is a module providing structured metrics for the calls to Azure services.
+
+Every call made by `AzureOpenAIManager`, `GPT4VisionManager`, `AzureDocumentIntelligenceManager` and
+`CosmosDBIndexer` is recorded in a `MetricsRegistry`: latency histograms (from which p50/p95/p99 are derived),
+time-to-first-token of streams, prompt and completion tokens, payload bytes, retries and an estimated cost per
+deployment. The registry renders the Prometheus text exposition format, served on `/metrics` by
+`start_http_server`; OpenTelemetry collectors scrape the same endpoint with their Prometheus receiver.
+
+Costs are estimated from a table of list prices in USD per 1K tokens, matched by the longest model-name prefix.
+Set the environment variable "AZURE_OPENAI_PRICES" to a JSON object such as `{"gpt-4o": [0.0025, 0.01]}` to use
+the prices of your agreement; set "AZURE_OPENAI_METRICS_PORT" to serve the metrics of the process.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+# Upper bounds of the latency buckets, in seconds
+DEFAULT_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# List prices in USD per 1K tokens: (prompt, completion)
+DEFAULT_PRICES = {
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-4": (0.03, 0.06),
+    "gpt-35-turbo": (0.0005, 0.0015),
+    "text-embedding-3-small": (0.00002, 0.0),
+    "text-embedding-3-large": (0.00013, 0.0),
+    "text-embedding-ada-002": (0.0001, 0.0),
+}
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    A cumulative histogram with fixed buckets, as in Prometheus.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        """
+        Initialize an empty histogram.
+
+        :param buckets: The increasing upper bounds of the buckets; an implicit +Inf bucket follows.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """
+        Records a value.
+
+        :param value: The observed value.
+        """
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimates a quantile by linear interpolation within its bucket, like Prometheus' `histogram_quantile`.
+
+        :param q: The quantile, between 0 and 1.
+        :return: The estimated value, or None if nothing was observed. Values in the +Inf bucket are reported
+            as the highest finite bound.
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count > 0:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class CallRecord:
+    """
+    The outcome of a tracked call, filled in by the caller while the call runs.
+    """
+
+    def __init__(self, operation: str):
+        """
+        Initialize a record of a successful call with no usage.
+
+        :param operation: The name of the operation, e.g. "chat.completions".
+        """
+        self.operation = operation
+        self.status = "ok"
+        self.model: Optional[str] = None
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.request_bytes: Optional[int] = None
+        self.response_bytes: Optional[int] = None
+        self.request_units: Optional[float] = None
+
+    def set_usage(self, usage: Any, model: Optional[str] = None) -> None:
+        """
+        Records the token usage reported by the service.
+
+        :param usage: The usage, as an object or a dictionary with `prompt_tokens` and `completion_tokens`.
+        :param model: The model that served the call, used to price it.
+        """
+        if usage is None:
+            return
+        if isinstance(usage, dict):
+            prompt_tokens = usage.get("prompt_tokens")
+            completion_tokens = usage.get("completion_tokens")
+        else:
+            prompt_tokens = getattr(usage, "prompt_tokens", None)
+            completion_tokens = getattr(usage, "completion_tokens", None)
+        if isinstance(prompt_tokens, int):
+            self.prompt_tokens = prompt_tokens
+        if isinstance(completion_tokens, int):
+            self.completion_tokens = completion_tokens
+        if isinstance(model, str):
+            self.model = model
+
+
+class MetricsRegistry:
+    """
+    A thread-safe registry of counters and histograms labelled by service, operation and target.
+    """
+
+    def __init__(
+        self,
+        prices: Optional[Dict[str, Sequence[float]]] = None,
+        latency_buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ):
+        """
+        Initialize an empty registry.
+
+        :param prices: Prices in USD per 1K tokens as (prompt, completion) by model-name prefix. Defaults to
+            `DEFAULT_PRICES`.
+        :param latency_buckets: The upper bounds of the latency buckets, in seconds.
+        """
+        self.prices = dict(DEFAULT_PRICES if prices is None else prices)
+        self.latency_buckets = tuple(latency_buckets)
+        self._counters: Dict[str, Dict[LabelSet, float]] = {}
+        self._histograms: Dict[str, Dict[LabelSet, Histogram]] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @classmethod
+    def from_env(cls) -> "MetricsRegistry":
+        """
+        Builds a registry using the prices of the environment variable "AZURE_OPENAI_PRICES", when set, over
+        the default prices.
+
+        :return: The registry.
+        """
+        prices = dict(DEFAULT_PRICES)
+        raw = os.getenv("AZURE_OPENAI_PRICES")
+        if raw:
+            try:
+                prices.update(
+                    {model: tuple(price) for model, price in json.loads(raw).items()}
+                )
+            except (ValueError, TypeError, AttributeError) as e:
+                logger.error(f"Ignoring invalid AZURE_OPENAI_PRICES: {e}")
+        return cls(prices=prices)
+
+    @staticmethod
+    def _labels(labels: Dict[str, Any]) -> LabelSet:
+        """
+        Returns the canonical, hashable form of a label set.
+
+        :param labels: The labels.
+        :return: The sorted label pairs, with None values dropped.
+        """
+        return tuple(
+            sorted(
+                (name, str(value))
+                for name, value in labels.items()
+                if value is not None
+            )
+        )
+
+    def increment(
+        self, name: str, value: float = 1.0, help: str = "", **labels: Any
+    ) -> None:
+        """
+        Adds to a counter.
+
+        :param name: The metric name.
+        :param value: The amount to add.
+        :param help: The description of the metric.
+        :param labels: The labels of the series.
+        """
+        key = self._labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+            if help:
+                self._help.setdefault(name, help)
+
+    def observe(self, name: str, value: float, help: str = "", **labels: Any) -> None:
+        """
+        Records a value in a histogram.
+
+        :param name: The metric name.
+        :param value: The observed value.
+        :param help: The description of the metric.
+        :param labels: The labels of the series.
+        """
+        key = self._labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self.latency_buckets)
+            histogram.observe(value)
+            if help:
+                self._help.setdefault(name, help)
+
+    def estimate_cost(
+        self,
+        model: Optional[str],
+        prompt_tokens: Optional[int],
+        completion_tokens: Optional[int],
+    ) -> Optional[float]:
+        """
+        Estimates the cost of a call from its token usage.
+
+        :param model: The model (or deployment) name, matched against the longest price prefix.
+        :param prompt_tokens: The prompt tokens.
+        :param completion_tokens: The completion tokens.
+        :return: The cost in USD, or None if the model has no known price.
+        """
+        if not model:
+            return None
+        matches = [prefix for prefix in self.prices if model.startswith(prefix)]
+        if not matches:
+            return None
+        prompt_price, completion_price = self.prices[max(matches, key=len)]
+        return (
+            (prompt_tokens or 0) * prompt_price
+            + (completion_tokens or 0) * completion_price
+        ) / 1000
+
+    def _record_tokens(
+        self,
+        service: str,
+        target: str,
+        model: Optional[str],
+        prompt_tokens: Optional[int],
+        completion_tokens: Optional[int],
+    ) -> None:
+        """
+        Records the tokens and estimated cost of a call.
+
+        :param service: The service called.
+        :param target: The deployment called.
+        :param model: The model that served the call; defaults to the deployment name for pricing.
+        :param prompt_tokens: The prompt tokens.
+        :param completion_tokens: The completion tokens.
+        """
+        for kind, tokens in (
+            ("prompt", prompt_tokens),
+            ("completion", completion_tokens),
+        ):
+            if tokens:
+                self.increment(
+                    "azure_tokens_total",
+                    tokens,
+                    help="Tokens processed, by kind.",
+                    service=service,
+                    target=target,
+                    kind=kind,
+                )
+        cost = self.estimate_cost(model or target, prompt_tokens, completion_tokens)
+        if cost is not None:
+            self.increment(
+                "azure_estimated_cost_usd_total",
+                cost,
+                help="Estimated cost at list prices, in USD.",
+                service=service,
+                target=target,
+                model=model or target,
+            )
+
+    def record_call(
+        self, service: str, target: str, duration: float, call: CallRecord
+    ) -> None:
+        """
+        Records a completed call.
+
+        :param service: The service called, e.g. "openai" or "cosmosdb".
+        :param target: The deployment, model or container called.
+        :param duration: The latency of the call, in seconds.
+        :param call: The outcome of the call.
+        """
+        self.observe(
+            "azure_request_duration_seconds",
+            duration,
+            help="Latency of calls to Azure services, in seconds.",
+            service=service,
+            operation=call.operation,
+            target=target,
+            status=call.status,
+        )
+        for name, value, help in (
+            ("azure_request_bytes_total", call.request_bytes, "Request payload bytes."),
+            (
+                "azure_response_bytes_total",
+                call.response_bytes,
+                "Response payload bytes.",
+            ),
+            (
+                "azure_request_units_total",
+                call.request_units,
+                "Cosmos DB request units.",
+            ),
+        ):
+            if value:
+                self.increment(
+                    name,
+                    value,
+                    help=help,
+                    service=service,
+                    operation=call.operation,
+                    target=target,
+                )
+        self._record_tokens(
+            service, target, call.model, call.prompt_tokens, call.completion_tokens
+        )
+
+    @contextmanager
+    def track(
+        self, service: str, operation: str, target: Optional[str]
+    ) -> Iterator[CallRecord]:
+        """
+        Times the enclosed call and records it on exit. An exception is recorded as the status of the call,
+        named after its type, and re-raised.
+
+        :param service: The service called.
+        :param operation: The name of the operation.
+        :param target: The deployment, model or container called.
+        :return: The record of the call, to fill in with usage and payload sizes.
+        """
+        call = CallRecord(operation)
+        started_at = time.perf_counter()
+        try:
+            yield call
+        except BaseException as e:
+            call.status = type(e).__name__
+            raise
+        finally:
+            self.record_call(
+                service, target or "unknown", time.perf_counter() - started_at, call
+            )
+
+    def record_stream(
+        self, service: str, target: str, metrics: Any, model: Optional[str] = None
+    ) -> None:
+        """
+        Records the latency figures and usage of a completed stream.
+
+        :param service: The service called.
+        :param target: The deployment called.
+        :param metrics: The `StreamMetrics` of the stream.
+        :param model: The model that served the stream, used to price it.
+        """
+        ttft = metrics.time_to_first_token
+        if ttft is not None:
+            self.observe(
+                "azure_time_to_first_token_seconds",
+                ttft,
+                help="Time from sending a streamed request to its first content, in seconds.",
+                service=service,
+                target=target,
+            )
+        self.observe(
+            "azure_stream_duration_seconds",
+            metrics.duration,
+            help="Total duration of streamed responses, in seconds.",
+            service=service,
+            target=target,
+        )
+        prompt_tokens = metrics.usage.prompt_tokens if metrics.usage else None
+        self._record_tokens(
+            service, target, model, prompt_tokens, metrics.completion_tokens
+        )
+
+    def record_retry(self, reason: str) -> None:
+        """
+        Counts a retried attempt.
+
+        :param reason: The reason of the retry, e.g. "429" or "timeout".
+        """
+        self.increment(
+            "azure_retries_total", help="Retried attempts, by reason.", reason=reason
+        )
+
+    def summary(
+        self, name: str = "azure_request_duration_seconds"
+    ) -> List[Dict[str, Any]]:
+        """
+        Summarizes a histogram per series, for logging and dashboards.
+
+        :param name: The histogram name.
+        :return: One dictionary per series with its labels, count, mean and p50/p95/p99.
+        """
+        with self._lock:
+            series = list(self._histograms.get(name, {}).items())
+            rows = []
+            for labels, histogram in series:
+                row: Dict[str, Any] = dict(labels)
+                row["count"] = histogram.count
+                row["mean"] = (
+                    histogram.sum / histogram.count if histogram.count else None
+                )
+                for q in QUANTILES:
+                    row[f"p{int(q * 100)}"] = histogram.quantile(q)
+                rows.append(row)
+        return rows
+
+    def snapshot(self) -> Dict[str, Dict[LabelSet, float]]:
+        """
+        Returns a copy of the counters.
+
+        :return: The counter values by metric name and label set.
+        """
+        with self._lock:
+            return {name: dict(series) for name, series in self._counters.items()}
+
+    @staticmethod
+    def _format_labels(
+        labels: LabelSet, extra: Optional[Tuple[str, str]] = None
+    ) -> str:
+        """
+        Renders a label set in the Prometheus text format.
+
+        :param labels: The label pairs.
+        :param extra: An additional label pair, e.g. the `le` bound of a bucket.
+        :return: The rendered labels, including braces, or an empty string.
+        """
+        pairs = list(labels) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        escaped = (
+            (name, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+            for name, value in pairs
+        )
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    def to_prometheus(self) -> str:
+        """
+        Renders every metric in the Prometheus text exposition format (version 0.0.4).
+
+        :return: The exposition text.
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in series.items():
+                    lines.append(f"{name}{self._format_labels(labels)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    bounds = [f"{bound:g}" for bound in histogram.buckets] + ["+Inf"]
+                    for bound, count in zip(bounds, histogram.counts):
+                        cumulative += count
+                        lines.append(
+                            f"{name}_bucket{self._format_labels(labels, ('le', bound))} {cumulative}"
+                        )
+                    lines.append(
+                        f"{name}_sum{self._format_labels(labels)} {histogram.sum:g}"
+                    )
+                    lines.append(
+                        f"{name}_count{self._format_labels(labels)} {histogram.count}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(
+        self, port: int, address: str = "0.0.0.0"  # nosec B104
+    ) -> None:
+        """
+        Serves the metrics on `/metrics` from a daemon thread. Calling it again has no effect.
+
+        :param port: The port to listen on.
+        :param address: The address to bind.
+        """
+        with self._lock:
+            if self._server is not None:
+                return
+            registry = self
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self) -> None:
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+                    body = registry.to_prometheus().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format: str, *args: Any) -> None:
+                    pass
+
+            self._server = ThreadingHTTPServer((address, port), MetricsHandler)
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logger.info(f"Serving metrics on http://{address}:{port}/metrics")
+
+
+_shared_metrics: Optional[MetricsRegistry] = None
+_shared_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> MetricsRegistry:
+    """
+    Returns the process-wide metrics registry, so the calls of every manager instance (e.g. one per Streamlit
+    session) are aggregated. The registry is served on the port of the environment variable
+    "AZURE_OPENAI_METRICS_PORT" when it is set.
+
+    :return: The shared registry.
+    """
+    global _shared_metrics
+    with _shared_metrics_lock:
+        if _shared_metrics is None:
+            _shared_metrics = MetricsRegistry.from_env()
+            port = os.getenv("AZURE_OPENAI_METRICS_PORT")
+            if port:
+                try:
+                    _shared_metrics.start_http_server(int(port))
+                except (ValueError, OSError) as e:
+                    logger.error(f"Could not serve metrics on port {port}: {e}")
+        return _shared_metrics
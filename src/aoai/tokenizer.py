@@ -1,14 +1,47 @@
 """
 `tokenizer.py` is a module that extends the AzureOpenAIManager to include tokenization capabilities for Azure OpenAI.
+
+`EncodingRegistry` maps deployments to their tiktoken encodings. Azure OpenAI addresses models by deployment
+name, so the model behind each deployment is configured (environment variable "AZURE_OPENAI_DEPLOYMENT_MODELS")
+or learned from the `model` field of its responses. Encodings are loaded lazily, once per process, and can be
+warmed up in the background at startup so the first request does not pay for loading them.
 """
 
-from typing import Dict, List, Optional, Union
+import base64
+import binascii
+import codecs
+import collections
+import io
+import json
+import math
+import os
+import re
+import threading
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
+import numpy as np
 import tiktoken
 
 # Load environment variables from .env file
 from dotenv import load_dotenv
+from PIL import Image
 
+from src.aoai.calibration import (
+    ESTIMATION_FEATURES,
+    TokenCalibrator,
+    get_token_calibrator,
+)
 from utils.ml_logging import get_logger
 
 # Set up logger
@@ -16,6 +49,344 @@ logger = get_logger()
 
 load_dotenv()
 
+# The encoding of models unknown to the registry: the current chat models (GPT-4o and later) use o200k_base
+DEFAULT_ENCODING = "o200k_base"
+
+# Encoding of the embedding models (text-embedding-ada-002, text-embedding-3-*)
+EMBEDDING_ENCODING = "cl100k_base"
+
+# Texts encoded per `encode_ordinary_batch` call, which bounds the token lists held in memory at once
+COUNT_BATCH_SIZE = 1024
+
+# Boundaries a chunk may end on, from the coarsest: line breaks, then sentence ends
+CHUNK_SPLIT_PATTERNS = [
+    re.compile(r"(?<=\n)"),
+    re.compile(r"(?<=[.!?])(?=\s)"),
+]
+
+# Characters per max token after which a block is cut at a line break, which bounds the text encoded at once
+CHUNK_BLOCK_CHARACTERS_PER_TOKEN = 16
+
+# Image tokens as (base, per 512px tile) by model prefix; other vision models cost (85, 170)
+IMAGE_TOKEN_COSTS: Dict[str, Tuple[int, int]] = {
+    "gpt-4o-mini": (2833, 5667),
+}
+DEFAULT_IMAGE_TOKEN_COSTS = (85, 170)
+
+# Bytes of a base64 image decoded to read its dimensions; enough for the header of PNG, GIF, WebP and most JPEGs
+IMAGE_HEADER_BYTES = 64 * 1024
+
+# Azure OpenAI model names, matched by longest prefix before asking tiktoken
+MODEL_PREFIX_TO_ENCODING: Dict[str, str] = {
+    "gpt-4o": "o200k_base",
+    "gpt-4.1": "o200k_base",
+    "gpt-4.5": "o200k_base",
+    "gpt-5": "o200k_base",
+    "o1": "o200k_base",
+    "o3": "o200k_base",
+    "o4": "o200k_base",
+    "gpt-4": "cl100k_base",
+    "gpt-35-turbo": "cl100k_base",
+    "gpt-3.5-turbo": "cl100k_base",
+    "text-embedding-": "cl100k_base",
+}
+
+
+class EncodingRegistry:
+    """
+    A process-wide registry of tiktoken encodings, resolved per deployment and loaded once.
+    """
+
+    def __init__(
+        self,
+        deployment_models: Optional[Dict[str, str]] = None,
+        default_encoding: str = DEFAULT_ENCODING,
+    ):
+        """
+        Initialize the registry.
+
+        :param deployment_models: The model behind each deployment, e.g. {"chat": "gpt-4o"}. A deployment that
+            is not listed is assumed to be named after its model until one of its responses tells otherwise.
+        :param default_encoding: The encoding of deployments whose model is unknown.
+        """
+        self.default_encoding = default_encoding
+        self._deployment_models: Dict[str, str] = dict(deployment_models or {})
+        self._encodings: Dict[str, tiktoken.Encoding] = {}
+        self._lock = threading.Lock()
+        self._warm_up_thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> "EncodingRegistry":
+        """
+        Builds a registry from the environment variable "AZURE_OPENAI_DEPLOYMENT_MODELS", a JSON object mapping
+        deployment names to model names.
+
+        :return: The registry, without deployment models if the variable is unset or invalid.
+        """
+        deployment_models = {}
+        raw = os.getenv("AZURE_OPENAI_DEPLOYMENT_MODELS")
+        if raw:
+            try:
+                deployment_models = {
+                    str(deployment): str(model)
+                    for deployment, model in json.loads(raw).items()
+                }
+            except (ValueError, AttributeError) as e:
+                logger.warning(f"Ignoring invalid AZURE_OPENAI_DEPLOYMENT_MODELS: {e}")
+        return cls(deployment_models)
+
+    @staticmethod
+    def encoding_name_for_model(model: Optional[str]) -> Optional[str]:
+        """
+        Returns the name of the encoding of a model.
+
+        :param model: The model name, e.g. "gpt-4o-2024-08-06".
+        :return: The encoding name, or None if the model is unknown.
+        """
+        if not model:
+            return None
+        prefixes = [
+            prefix for prefix in MODEL_PREFIX_TO_ENCODING if model.startswith(prefix)
+        ]
+        if prefixes:
+            return MODEL_PREFIX_TO_ENCODING[max(prefixes, key=len)]
+        try:
+            return tiktoken.encoding_name_for_model(model)
+        except KeyError:
+            return None
+
+    def encoding(self, name: str) -> tiktoken.Encoding:
+        """
+        Returns an encoding by name, loading it on first use.
+
+        :param name: The encoding name, e.g. "o200k_base".
+        :return: The encoding.
+        """
+        encoding = self._encodings.get(name)
+        if encoding is None:
+            with self._lock:
+                encoding = self._encodings.get(name)
+                if encoding is None:
+                    encoding = tiktoken.get_encoding(name)
+                    self._encodings[name] = encoding
+        return encoding
+
+    def register_deployment(self, deployment: str, model: str) -> None:
+        """
+        Records the model behind a deployment.
+
+        :param deployment: The deployment name.
+        :param model: The model name.
+        """
+        if self._deployment_models.get(deployment) != model:
+            self._deployment_models[deployment] = model
+            logger.debug(f"Deployment {deployment} serves model {model}")
+
+    def model_for(self, deployment: Optional[str]) -> Optional[str]:
+        """
+        Returns the model behind a deployment.
+
+        :param deployment: The deployment name.
+        :return: The registered model, or the deployment name itself if none is registered.
+        """
+        if not deployment:
+            return None
+        return self._deployment_models.get(deployment, deployment)
+
+    def encoding_name_for_deployment(
+        self, deployment: Optional[str], fallback_encoding: Optional[str] = None
+    ) -> str:
+        """
+        Returns the name of the encoding of a deployment.
+
+        :param deployment: The deployment name.
+        :param fallback_encoding: The encoding to use if the model of the deployment is unknown. Defaults to
+            the registry's default encoding.
+        :return: The encoding name.
+        """
+        return (
+            self.encoding_name_for_model(self.model_for(deployment))
+            or fallback_encoding
+            or self.default_encoding
+        )
+
+    def for_deployment(
+        self, deployment: Optional[str], fallback_encoding: Optional[str] = None
+    ) -> tiktoken.Encoding:
+        """
+        Returns the encoding of a deployment.
+
+        :param deployment: The deployment name.
+        :param fallback_encoding: The encoding to use if the model of the deployment is unknown.
+        :return: The encoding.
+        """
+        return self.encoding(
+            self.encoding_name_for_deployment(deployment, fallback_encoding)
+        )
+
+    def for_model(self, model: Optional[str]) -> tiktoken.Encoding:
+        """
+        Returns the encoding of a model.
+
+        :param model: The model name.
+        :return: The encoding, or the default encoding if the model is unknown.
+        """
+        return self.encoding(
+            self.encoding_name_for_model(model) or self.default_encoding
+        )
+
+    def learn_from_response(self, deployment: str, response: object) -> None:
+        """
+        Records the model reported by a response, so later requests to its deployment use the right encoding.
+
+        :param deployment: The deployment that answered.
+        :param response: The parsed response.
+        """
+        model = getattr(response, "model", None)
+        if isinstance(model, str) and model:
+            self.register_deployment(deployment, model)
+
+    def warm_up(self, encodings: Optional[Iterable[str]] = None) -> threading.Thread:
+        """
+        Loads encodings on a background thread, once per registry.
+
+        :param encodings: The encodings to load. Defaults to the encodings of the registered deployments, the
+            default encoding and the embedding encoding.
+        :return: The warm-up thread.
+        """
+        with self._lock:
+            if self._warm_up_thread is not None:
+                return self._warm_up_thread
+            if encodings is None:
+                encodings = {self.default_encoding, EMBEDDING_ENCODING} | {
+                    self.encoding_name_for_deployment(deployment)
+                    for deployment in self._deployment_models
+                }
+            names = sorted(encodings)
+
+            def load() -> None:
+                for name in names:
+                    try:
+                        self.encoding(name)
+                    except Exception as e:
+                        logger.warning(f"Could not load encoding {name}: {e}")
+
+            self._warm_up_thread = threading.Thread(
+                target=load, name="encoding-warm-up", daemon=True
+            )
+            self._warm_up_thread.start()
+            return self._warm_up_thread
+
+
+_shared_registry: Optional[EncodingRegistry] = None
+_shared_registry_lock = threading.Lock()
+
+
+def get_encoding_registry() -> EncodingRegistry:
+    """
+    Returns the process-wide encoding registry, built from the environment on first use.
+
+    :return: The shared registry.
+    """
+    global _shared_registry
+    with _shared_registry_lock:
+        if _shared_registry is None:
+            _shared_registry = EncodingRegistry.from_env()
+        return _shared_registry
+
+
+def get_encoding_for_model(model: str) -> tiktoken.Encoding:
+    """
+    Returns the tiktoken encoding of a model, loading it once per process.
+
+    :param model: The model name.
+    :return: The model's encoding, or the default encoding if the model is unknown.
+    """
+    return get_encoding_registry().for_model(model)
+
+
+def image_dimensions(url: Optional[str]) -> Optional[Tuple[int, int]]:
+    """
+    Returns the dimensions of an image sent as a base64 data URL, decoding only its header.
+
+    :param url: The image URL, e.g. "data:image/jpeg;base64,...".
+    :return: The (width, height) of the image, or None for remote URLs and unreadable images.
+    """
+    if not url or not url.startswith("data:") or "," not in url:
+        return None
+    header, data = url.split(",", 1)
+    if not header.endswith(";base64"):
+        return None
+    # Decode the header first; a JPEG with large metadata before its frame header needs the whole image
+    prefix_length = IMAGE_HEADER_BYTES // 3 * 4
+    for encoded in (data[:prefix_length], data):
+        try:
+            with Image.open(io.BytesIO(base64.b64decode(encoded))) as image:
+                return image.size
+        except (binascii.Error, OSError, ValueError):
+            if len(encoded) == len(data):
+                break
+    logger.debug("Could not read the dimensions of an image, assuming the largest")
+    return None
+
+
+def image_tokens(
+    width: Optional[int],
+    height: Optional[int],
+    detail: str = "auto",
+    model: Optional[str] = None,
+) -> int:
+    """
+    Estimates the prompt tokens of an image with the tile-based formula of the vision models.
+
+    In high detail the image is scaled to fit 2048x2048, then so that its shortest side is at most 768px, and each
+    512px tile costs a fixed number of tokens on top of a base cost. In low detail only the base cost is paid.
+    "auto" is estimated as high detail, which bounds what the service may choose.
+
+    :param width: The width of the image in pixels, or None if unknown.
+    :param height: The height of the image in pixels, or None if unknown.
+    :param detail: The detail level of the image part: "low", "high" or "auto".
+    :param model: The model name, which determines the token costs.
+    :return: The estimated number of tokens; the largest possible cost if the dimensions are unknown.
+    """
+    prefixes = [
+        prefix for prefix in IMAGE_TOKEN_COSTS if (model or "").startswith(prefix)
+    ]
+    base_tokens, tile_tokens = (
+        IMAGE_TOKEN_COSTS[max(prefixes, key=len)]
+        if prefixes
+        else DEFAULT_IMAGE_TOKEN_COSTS
+    )
+    if detail == "low":
+        return base_tokens
+    if not width or not height:
+        # 2048x768 after scaling, the most tiles an image can take
+        return base_tokens + tile_tokens * 8
+
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return base_tokens + tile_tokens * tiles
+
+
+def estimate_image_tokens(
+    url: Optional[str], detail: str = "auto", model: Optional[str] = None
+) -> int:
+    """
+    Estimates the prompt tokens of an image content part.
+
+    :param url: The image URL of the part.
+    :param detail: The detail level of the part.
+    :param model: The model name, which determines the token costs.
+    :return: The estimated number of tokens.
+    """
+    if detail == "low":
+        return image_tokens(None, None, detail, model)
+    width, height = image_dimensions(url) or (None, None)
+    return image_tokens(width, height, detail, model)
+
 
 class AzureOpenAITokenizer:
     """
@@ -23,7 +394,7 @@ class AzureOpenAITokenizer:
     and extract rate limit and usage information from the response. It does not extend any other class.
     """
 
-    DEFAULT_MODEL = "gpt-4-32k-0314"
+    DEFAULT_MODEL = "gpt-4o"
     TOKENS_PER_MESSAGE = {
         "gpt-3.5-turbo-0613": 3,
         "gpt-3.5-turbo-16k-0613": 3,
@@ -37,13 +408,141 @@ class AzureOpenAITokenizer:
         "gpt-3.5-turbo-0301": -1,
     }
 
-    def __init__(self, model: Optional[str] = None):
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        calibrator: Optional[TokenCalibrator] = None,
+    ):
         """
         Initialize the AzureOpenAITokenizer class with an optional model.
 
         :param model: The name of the model to use for token estimation. If not provided, defaults to DEFAULT_MODEL.
+        :param calibrator: The calibrator correcting the estimates of each model from the prompt tokens of live
+            responses (see `record_usage`). Defaults to the process-wide calibrator, if configured; otherwise the
+            `TOKENS_PER_MESSAGE` and `TOKENS_PER_NAME` tables are used as is.
         """
         self.model = model if model is not None else self.DEFAULT_MODEL
+        self.calibrator = calibrator or get_token_calibrator()
+
+    def default_coefficients(self, model: Optional[str] = None) -> np.ndarray:
+        """
+        Returns the uncalibrated coefficients of the token estimate of a model, from the hard-coded tables.
+
+        :param model: The model name. Defaults to the tokenizer's model.
+        :return: The coefficients of `ESTIMATION_FEATURES`.
+        """
+        model = model or self.model
+        return np.array(
+            [
+                1.0,
+                1.0,
+                self.TOKENS_PER_MESSAGE.get(model, 3),
+                self.TOKENS_PER_NAME.get(model, 1),
+                3.0,
+            ]
+        )
+
+    def coefficients(self, model: Optional[str] = None) -> np.ndarray:
+        """
+        Returns the coefficients of the token estimate of a model: calibrated when available, else the defaults.
+
+        :param model: The model name. Defaults to the tokenizer's model.
+        :return: The coefficients of `ESTIMATION_FEATURES`.
+        """
+        model = model or self.model
+        calibrated = (
+            self.calibrator.coefficients(model) if self.calibrator is not None else None
+        )
+        return (
+            calibrated if calibrated is not None else self.default_coefficients(model)
+        )
+
+    def _structure_features(
+        self, messages: List[Dict[str, Any]], model: str
+    ) -> Tuple[np.ndarray, List[str]]:
+        """
+        Returns the features of a conversation except its text tokens, and the texts to encode.
+
+        :param messages: The messages of the conversation.
+        :param model: The model name, which determines the image token costs.
+        :return: A tuple of (the features, with zero text tokens, the texts of the conversation).
+        """
+        features = np.zeros(len(ESTIMATION_FEATURES))
+        features[4] = 1.0
+        texts: List[str] = []
+        for message in messages:
+            features[2] += 1
+            for key, value in message.items():
+                if key not in ["role", "content", "name"]:
+                    continue
+                value_texts, content_image_tokens = self._split_content(value, model)
+                features[1] += content_image_tokens
+                texts.extend(value_texts)
+                if key == "name" and isinstance(value, str):
+                    features[3] += 1
+        return features, texts
+
+    def message_features(
+        self, messages: List[Dict[str, Any]], model: Optional[str] = None
+    ) -> np.ndarray:
+        """
+        Returns the features of a conversation the token estimate is linear in.
+
+        :param messages: The messages of the conversation.
+        :param model: The model name, which determines the encoding. Defaults to the tokenizer's model.
+        :return: The values of `ESTIMATION_FEATURES`.
+        """
+        model = model or self.model
+        encoding = get_encoding_for_model(model)
+        features, texts = self._structure_features(messages, model)
+        features[0] = sum(len(encoding.encode_ordinary(text)) for text in texts)
+        return features
+
+    def _apply(
+        self, features: np.ndarray, model: str, has_function_call: bool
+    ) -> np.ndarray:
+        """
+        Turns features into token estimates with the coefficients of a model.
+
+        :param features: The features, one row per conversation.
+        :param model: The model name.
+        :param has_function_call: Whether the conversations include a function call.
+        :return: An int64 array of estimates, never negative.
+        """
+        estimates = np.rint(features @ self.coefficients(model))
+        if has_function_call:
+            estimates += 9
+        return np.maximum(estimates, 0).astype(np.int64)
+
+    def record_usage(
+        self,
+        messages: List[Dict[str, Any]],
+        prompt_tokens: Optional[int],
+        model: Optional[str] = None,
+    ) -> None:
+        """
+        Feeds the prompt tokens billed for a conversation to the calibrator, if any.
+
+        Only a sample of responses is recorded once a model is calibrated, as the prompt is encoded again.
+
+        :param messages: The messages of the request.
+        :param prompt_tokens: The `prompt_tokens` reported by the response.
+        :param model: The model that served the request. Defaults to the tokenizer's model.
+        """
+        model = model or self.model
+        if (
+            self.calibrator is None
+            or not isinstance(messages, list)
+            or not isinstance(prompt_tokens, int)
+            or not self.calibrator.should_sample(model)
+        ):
+            return
+        self.calibrator.record(
+            model,
+            self.message_features(messages, model),
+            prompt_tokens,
+            self.default_coefficients(model),
+        )
 
     def estimate_tokens_azure_openai(
         self,
@@ -56,36 +555,46 @@ class AzureOpenAITokenizer:
 
         This function estimates the token count for a given set of messages based on the model's specific encoding and formatting rules.
 
+        Content given as a list of parts counts its text parts and estimates its image parts with `image_tokens`.
+        The estimate is linear in `message_features`, with the calibrated coefficients of the model when available.
+
         :param messages (List[Dict[str, Union[str, int]]]): A list of messages, each represented as a dictionary.
         :param model (str): The model name, which determines the encoding and token counting rules. Default is "gpt-3.5-turbo-0613".
         :param has_function_call (bool): Flag to indicate if there is a function call in the messages, which affects token count.
 
         :return (int): The estimated number of tokens for the provided messages.
         """
-        try:
-            encoding = tiktoken.encoding_for_model(model)
-        except KeyError:
-            logger.warning(f"Model {model} not found. Using cl100k_base encoding.")
-            encoding = tiktoken.get_encoding("cl100k_base")
-
-        tokens_per_message = self.TOKENS_PER_MESSAGE.get(model, 3)
-        tokens_per_name = self.TOKENS_PER_NAME.get(model, 1)
-
-        num_tokens = 0
-        for message in messages:
-            num_tokens += tokens_per_message
-            for key, value in message.items():
-                if key in ["role", "content", "name"] and isinstance(value, str):
-                    num_tokens += len(encoding.encode(value))
-                    if key == "name":
-                        num_tokens += tokens_per_name
-
-        if has_function_call:
-            num_tokens += 9
+        model = model or self.model
+        features = self.message_features(messages, model)
+        return int(self._apply(features, model, has_function_call))
 
-        num_tokens += 3
+    @staticmethod
+    def _split_content(content: Any, model: str) -> Tuple[List[str], int]:
+        """
+        Splits the value of a message field into its texts and the estimated tokens of its images.
 
-        return num_tokens
+        :param content: A string, or a list of content parts as built by `generate_chat_response`.
+        :param model: The model name, which determines the image token costs.
+        :return: A tuple of (the texts to encode, the image tokens).
+        """
+        if isinstance(content, str):
+            return [content], 0
+        texts: List[str] = []
+        content_image_tokens = 0
+        if isinstance(content, list):
+            for part in content:
+                if not isinstance(part, dict):
+                    continue
+                if part.get("type") == "text" and isinstance(part.get("text"), str):
+                    texts.append(part["text"])
+                elif part.get("type") == "image_url":
+                    image = part.get("image_url") or {}
+                    if isinstance(image, str):
+                        image = {"url": image}
+                    content_image_tokens += estimate_image_tokens(
+                        image.get("url"), image.get("detail", "auto"), model
+                    )
+        return texts, content_image_tokens
 
     def estimate_tokens_completion(
         self,
@@ -102,12 +611,233 @@ class AzureOpenAITokenizer:
 
         :return (int): The estimated number of tokens for the provided text.
         """
-        try:
-            encoding = tiktoken.encoding_for_model(model)
-        except KeyError:
-            logger.warning(f"Model {model} not found. Using cl100k_base encoding.")
-            encoding = tiktoken.get_encoding("cl100k_base")
+        model = model or self.model
+        encoding = get_encoding_for_model(model)
 
-        num_tokens = len(encoding.encode(response))
+        num_tokens = len(encoding.encode_ordinary(response))
 
         return num_tokens
+
+    def count_many(
+        self,
+        texts: Sequence[str],
+        model: Optional[str] = None,
+        num_threads: int = 8,
+    ) -> np.ndarray:
+        """
+        Counts the tokens of many texts at once, encoding them on a thread pool.
+
+        tiktoken releases the GIL while encoding, so large batches (e.g. OCR outputs of thousands of documents)
+        are counted in parallel. Texts are encoded in slices of `COUNT_BATCH_SIZE` so the token lists of the whole
+        batch are never held in memory together.
+
+        :param texts: The texts to count.
+        :param model: The model name, which determines the encoding. Defaults to the tokenizer's model.
+        :param num_threads: The threads encoding each slice.
+        :return: An int64 array with the token count of each text, in input order.
+        """
+        encoding = get_encoding_for_model(model or self.model)
+        counts = np.zeros(len(texts), dtype=np.int64)
+        for start in range(0, len(texts), COUNT_BATCH_SIZE):
+            batch = list(texts[start : start + COUNT_BATCH_SIZE])
+            counts[start : start + len(batch)] = [
+                len(tokens)
+                for tokens in encoding.encode_ordinary_batch(
+                    batch, num_threads=num_threads
+                )
+            ]
+        return counts
+
+    def count_conversations(
+        self,
+        conversations: Sequence[List[Dict[str, Union[str, int]]]],
+        model: Optional[str] = None,
+        has_function_call: bool = False,
+        num_threads: int = 8,
+    ) -> np.ndarray:
+        """
+        Estimates the prompt tokens of many conversations at once, with the rules of `estimate_tokens_azure_openai`.
+
+        The texts of every message of every conversation are counted in a single `count_many` call.
+
+        :param conversations: The conversations, each a list of messages.
+        :param model: The model name, which determines the encoding and formatting rules. Defaults to the
+            tokenizer's model.
+        :param has_function_call: Whether the conversations include a function call.
+        :param num_threads: The threads encoding the texts.
+        :return: An int64 array with the estimated token count of each conversation, in input order.
+        """
+        model = model or self.model
+        features = np.zeros((len(conversations), len(ESTIMATION_FEATURES)))
+        texts: List[str] = []
+        owners: List[int] = []
+        for index, messages in enumerate(conversations):
+            features[index], conversation_texts = self._structure_features(
+                messages, model
+            )
+            texts.extend(conversation_texts)
+            owners.extend([index] * len(conversation_texts))
+
+        np.add.at(
+            features[:, 0],
+            np.asarray(owners, dtype=np.intp),
+            self.count_many(texts, model, num_threads),
+        )
+        return self._apply(features, model, has_function_call)
+
+    def chunk_text(
+        self,
+        text: Union[str, Iterable[str]],
+        max_tokens: int,
+        overlap_tokens: int = 0,
+        model: Optional[str] = None,
+    ) -> Iterator[str]:
+        """
+        Splits a text into chunks of at most `max_tokens` tokens, on markdown and paragraph boundaries when
+        possible, then on line breaks, then on sentence ends, and on token boundaries as a last resort.
+
+        The text is read line by line and only the block being split is encoded, so arbitrarily large inputs
+        (e.g. a file object) are chunked without holding the tokens of the whole document. Without overlap the
+        chunks concatenate back to the original text, except for chunks made only of whitespace, which are skipped.
+
+        :param text: The text, or an iterable of text pieces such as the lines of a file.
+        :param max_tokens: The maximum number of tokens of a chunk.
+        :param overlap_tokens: The number of tokens each chunk repeats from the end of the previous one. The
+            repeated text is made of whole boundary units when they fit.
+        :param model: The model name, which determines the encoding. Defaults to the tokenizer's model.
+        :return: A generator of chunks.
+        :raises ValueError: If `overlap_tokens` is not smaller than `max_tokens`.
+        """
+        if max_tokens < 1 or not 0 <= overlap_tokens < max_tokens:
+            raise ValueError(
+                "overlap_tokens must be at least 0 and less than max_tokens"
+            )
+        encoding = get_encoding_for_model(model or self.model)
+
+        chunk: Deque[Tuple[str, int]] = collections.deque()
+        chunk_tokens = 0
+        has_new_text = False
+        for block in self._iter_blocks(text, max_tokens):
+            for unit, unit_tokens in self._split_units(block, encoding, max_tokens):
+                if has_new_text and chunk_tokens + unit_tokens > max_tokens:
+                    chunk_text = "".join(part for part, _ in chunk)
+                    if chunk_text.strip():
+                        yield chunk_text
+                    chunk = self._overlap(chunk, overlap_tokens, encoding)
+                    chunk_tokens = sum(tokens for _, tokens in chunk)
+                    has_new_text = False
+                    while chunk and chunk_tokens + unit_tokens > max_tokens:
+                        chunk_tokens -= chunk.popleft()[1]
+                chunk.append((unit, unit_tokens))
+                chunk_tokens += unit_tokens
+                has_new_text = True
+        chunk_text = "".join(part for part, _ in chunk)
+        if has_new_text and chunk_text.strip():
+            yield chunk_text
+
+    @staticmethod
+    def _iter_blocks(text: Union[str, Iterable[str]], max_tokens: int) -> Iterator[str]:
+        """
+        Groups the lines of a text into blocks: paragraphs ended by a blank line, with a new block at every
+        markdown heading. A block longer than `CHUNK_BLOCK_CHARACTERS_PER_TOKEN` characters per max token is cut
+        at a line break.
+
+        :param text: The text, or an iterable of text pieces.
+        :param max_tokens: The maximum number of tokens of a chunk.
+        :return: A generator of blocks, which concatenate back to the text.
+        """
+
+        def lines() -> Iterator[str]:
+            if isinstance(text, str):
+                yield from io.StringIO(text)
+                return
+            pending = ""
+            for piece in text:
+                parts = (pending + piece).splitlines(keepends=True)
+                pending = parts.pop() if parts and not parts[-1].endswith("\n") else ""
+                yield from parts
+            if pending:
+                yield pending
+
+        max_characters = max_tokens * CHUNK_BLOCK_CHARACTERS_PER_TOKEN
+        block: List[str] = []
+        block_characters = 0
+        for line in lines():
+            if block and (
+                line.lstrip().startswith("#") or block_characters >= max_characters
+            ):
+                yield "".join(block)
+                block, block_characters = [], 0
+            block.append(line)
+            block_characters += len(line)
+            if not line.strip():
+                yield "".join(block)
+                block, block_characters = [], 0
+        if block:
+            yield "".join(block)
+
+    def _split_units(
+        self, text: str, encoding: tiktoken.Encoding, max_tokens: int, level: int = 0
+    ) -> Iterator[Tuple[str, int]]:
+        """
+        Splits a block into units of at most `max_tokens` tokens, on the coarsest boundaries that suffice.
+
+        :param text: The text to split.
+        :param encoding: The encoding tokens are counted with.
+        :param max_tokens: The maximum number of tokens of a unit.
+        :param level: The index of the first pattern of `CHUNK_SPLIT_PATTERNS` to split on.
+        :return: A generator of (unit, token count), which concatenate back to the text.
+        """
+        tokens = encoding.encode_ordinary(text)
+        if len(tokens) <= max_tokens:
+            yield text, len(tokens)
+            return
+        for index in range(level, len(CHUNK_SPLIT_PATTERNS)):
+            parts = [part for part in CHUNK_SPLIT_PATTERNS[index].split(text) if part]
+            if len(parts) > 1:
+                for part in parts:
+                    yield from self._split_units(part, encoding, max_tokens, index + 1)
+                return
+
+        # No boundary left: cut on token boundaries, carrying characters split across tokens to the next unit
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        for start in range(0, len(tokens), max_tokens):
+            window = tokens[start : start + max_tokens]
+            unit = decoder.decode(
+                encoding.decode_bytes(window), final=start + max_tokens >= len(tokens)
+            )
+            if unit:
+                yield unit, len(window)
+
+    @staticmethod
+    def _overlap(
+        chunk: Deque[Tuple[str, int]],
+        overlap_tokens: int,
+        encoding: tiktoken.Encoding,
+    ) -> Deque[Tuple[str, int]]:
+        """
+        Returns the end of a chunk to repeat at the start of the next one.
+
+        :param chunk: The units of the chunk, with their token counts.
+        :param overlap_tokens: The maximum number of tokens to repeat.
+        :param encoding: The encoding tokens are counted with.
+        :return: The trailing units that fit, or the last tokens of the last unit if none does.
+        """
+        overlap: Deque[Tuple[str, int]] = collections.deque()
+        if not overlap_tokens or not chunk:
+            return overlap
+        overlap_total = 0
+        for unit, unit_tokens in reversed(chunk):
+            if overlap_total + unit_tokens > overlap_tokens:
+                break
+            overlap.appendleft((unit, unit_tokens))
+            overlap_total += unit_tokens
+        if not overlap:
+            tail = encoding.encode_ordinary(chunk[-1][0])[-overlap_tokens:]
+            overlap.append(
+                (
+                    encoding.decode_bytes(tail).decode("utf-8", errors="ignore"),
+                    len(tail),
+                )
+            )
+        return overlap
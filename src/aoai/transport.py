@@ -0,0 +1,169 @@
+"""
+`transport.py` is a module providing the process-wide, pooled HTTP clients shared by every manager.
+
+Creating a `requests.Session` per call (or calling `requests.post` without one) pays a TCP and TLS handshake on
+every request. The clients below keep connections alive and are reused across calls, threads and Streamlit
+sessions: a `requests.Session` for the raw REST calls, and an `httpx.Client` for the OpenAI SDK clients, which
+can optionally negotiate HTTP/2.
+
+Pool size, timeouts and HTTP/2 are read from the environment variables "AZURE_HTTP_POOL_MAXSIZE",
+"AZURE_HTTP_TIMEOUT", "AZURE_HTTP_CONNECT_TIMEOUT" and "AZURE_HTTP2".
+"""
+
+import importlib.util
+import os
+import threading
+from typing import Any, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.ml_logging import get_logger
+
+# Set up logger
+logger = get_logger()
+
+DEFAULT_POOL_MAXSIZE = 32
+DEFAULT_TIMEOUT = 120.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+
+
+def _env_float(name: str, default: float) -> float:
+    """
+    Reads a float from the environment, falling back to a default.
+
+    :param name: The environment variable.
+    :param default: The value used when the variable is unset or malformed.
+    :return: The parsed value.
+    """
+    try:
+        return float(os.getenv(name) or default)
+    except ValueError:
+        logger.warning(f"Ignoring malformed {name}; using {default}")
+        return default
+
+
+class _TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    An HTTP adapter applying a default timeout to requests that do not set one.
+    """
+
+    def __init__(self, timeout: Any, *args, **kwargs):
+        """
+        Initialize the adapter.
+
+        :param timeout: The default timeout, as accepted by `requests` (seconds or a (connect, read) tuple).
+        """
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        """
+        Sends the request, applying the default timeout if none was given.
+        """
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_session(
+    pool_maxsize: Optional[int] = None,
+    timeout: Optional[float] = None,
+    connect_timeout: Optional[float] = None,
+) -> requests.Session:
+    """
+    Creates a keep-alive `requests.Session` with a sized connection pool and default timeouts.
+
+    :param pool_maxsize: The maximum number of connections kept per host. Defaults to "AZURE_HTTP_POOL_MAXSIZE" or 32.
+    :param timeout: The default read timeout, in seconds. Defaults to "AZURE_HTTP_TIMEOUT" or 120.
+    :param connect_timeout: The default connect timeout, in seconds. Defaults to "AZURE_HTTP_CONNECT_TIMEOUT" or 10.
+    :return: The session.
+    """
+    pool_maxsize = pool_maxsize or int(
+        _env_float("AZURE_HTTP_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE)
+    )
+    adapter = _TimeoutHTTPAdapter(
+        timeout=(
+            connect_timeout
+            or _env_float("AZURE_HTTP_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT),
+            timeout or _env_float("AZURE_HTTP_TIMEOUT", DEFAULT_TIMEOUT),
+        ),
+        pool_connections=pool_maxsize,
+        pool_maxsize=pool_maxsize,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def create_http_client(
+    pool_maxsize: Optional[int] = None,
+    timeout: Optional[float] = None,
+    connect_timeout: Optional[float] = None,
+    http2: Optional[bool] = None,
+) -> httpx.Client:
+    """
+    Creates a keep-alive `httpx.Client` for the OpenAI SDK clients.
+
+    :param pool_maxsize: The maximum number of connections. Defaults to "AZURE_HTTP_POOL_MAXSIZE" or 32.
+    :param timeout: The default read timeout, in seconds. Defaults to "AZURE_HTTP_TIMEOUT" or 120.
+    :param connect_timeout: The default connect timeout, in seconds. Defaults to "AZURE_HTTP_CONNECT_TIMEOUT" or 10.
+    :param http2: Whether to negotiate HTTP/2. Defaults to "AZURE_HTTP2"; requires the `h2` package.
+    :return: The client.
+    """
+    pool_maxsize = pool_maxsize or int(
+        _env_float("AZURE_HTTP_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE)
+    )
+    if http2 is None:
+        http2 = os.getenv("AZURE_HTTP2", "").lower() in ("1", "true", "yes")
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning(
+            "HTTP/2 requested but the 'h2' package is not installed; using HTTP/1.1"
+        )
+        http2 = False
+    return httpx.Client(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize
+        ),
+        timeout=httpx.Timeout(
+            timeout or _env_float("AZURE_HTTP_TIMEOUT", DEFAULT_TIMEOUT),
+            connect=connect_timeout
+            or _env_float("AZURE_HTTP_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT),
+        ),
+    )
+
+
+_shared_session: Optional[requests.Session] = None
+_shared_http_client: Optional[httpx.Client] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_session() -> requests.Session:
+    """
+    Returns the process-wide pooled `requests.Session` used for raw REST calls.
+
+    Request-specific headers must be passed per call, never set on the shared session.
+
+    :return: The shared session.
+    """
+    global _shared_session
+    with _shared_lock:
+        if _shared_session is None:
+            _shared_session = create_session()
+        return _shared_session
+
+
+def get_shared_http_client() -> httpx.Client:
+    """
+    Returns the process-wide pooled `httpx.Client` used by the synchronous OpenAI SDK clients.
+
+    :return: The shared client.
+    """
+    global _shared_http_client
+    with _shared_lock:
+        if _shared_http_client is None:
+            _shared_http_client = create_http_client()
+        return _shared_http_client
@@ -2,7 +2,7 @@
 This script contains a utility function for interacting with the Azure OpenAI API.
 """
 
-from typing import Dict, List, Optional
+from typing import Dict, List, Mapping, Optional
 
 import matplotlib.patches as mpatches
 import matplotlib.pyplot as plt
@@ -16,6 +16,58 @@ from utils.ml_logging import get_logger
 logger = get_logger()
 
 
+def _parse_int_header(value: Optional[str]) -> Optional[int]:
+    """
+    Parses an integer header value, returning None if it is missing or malformed.
+
+    :param value: The raw header value.
+    :return: The parsed integer or None.
+    """
+    try:
+        return int(float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+def extract_rate_limit_headers(headers: Mapping[str, str]) -> Dict[str, Optional[int]]:
+    """
+    Extracts the remaining request and token quota from Azure OpenAI response headers.
+
+    :param headers: The response headers (requests or httpx, both are case-insensitive mappings).
+    :return: A dictionary containing the remaining requests and remaining tokens, None when absent.
+    """
+    return {
+        "remaining-requests": _parse_int_header(
+            headers.get("x-ratelimit-remaining-requests")
+        ),
+        "remaining-tokens": _parse_int_header(
+            headers.get("x-ratelimit-remaining-tokens")
+        ),
+    }
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Parses the delay advertised by a throttled response, preferring the millisecond precision header.
+
+    :param headers: The response headers.
+    :return: The delay in seconds, or None if no usable header is present.
+    """
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000.0)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after is not None:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            return None
+    return None
+
+
 def extract_rate_limit_and_usage_info(response: Response) -> Dict[str, Optional[int]]:
     """
     Extracts rate limiting information from the Azure Open API response headers and usage information from the payload.
@@ -24,11 +76,9 @@ def extract_rate_limit_and_usage_info(response: Response) -> Dict[str, Optional[
     :return: A dictionary containing the remaining requests, remaining tokens, and usage information
             including prompt tokens, completion tokens, and total tokens.
     """
-    headers = response.headers
     usage = response.json().get("usage", {})
     return {
-        "remaining-requests": headers.get("x-ratelimit-remaining-requests"),
-        "remaining-tokens": headers.get("x-ratelimit-remaining-tokens"),
+        **extract_rate_limit_headers(response.headers),
         "prompt-tokens": usage.get("prompt_tokens"),
         "completion_tokens": usage.get("completion_tokens"),
         "total_tokens": usage.get("total_tokens"),
@@ -70,6 +120,36 @@ def display_token_results_table(results: List[Dict[str, int]]) -> None:
     print(df.to_string())
 
 
+def summarize_token_estimation_results(results: pd.DataFrame) -> pd.DataFrame:
+    """
+    Summarizes the accuracy of token estimates per model: bias and variance of the estimation error.
+
+    :param results: One row per conversation with the columns "model", "estimated_tokens" and "actual_tokens".
+    :return: One row per model with the number of conversations, mean actual tokens, bias (mean of estimated minus
+        actual), relative bias, variance and standard deviation of the error, mean absolute error and the share of
+        exact estimates.
+    """
+    error = results["estimated_tokens"] - results["actual_tokens"]
+    actual = results["actual_tokens"].where(results["actual_tokens"] > 0)
+    frame = results.assign(
+        error=error,
+        absolute_error=error.abs(),
+        relative_error=error / actual,
+        exact=error == 0,
+    )
+    summary = frame.groupby("model").agg(
+        conversations=("error", "size"),
+        mean_actual_tokens=("actual_tokens", "mean"),
+        bias=("error", "mean"),
+        relative_bias=("relative_error", "mean"),
+        error_variance=("error", lambda e: e.var(ddof=0)),
+        error_std=("error", lambda e: e.std(ddof=0)),
+        mean_absolute_error=("absolute_error", "mean"),
+        exact_rate=("exact", "mean"),
+    )
+    return summary.sort_values("conversations", ascending=False)
+
+
 def plot_token_analysis_results(
     results: List[Dict[str, int]], total_estimated: int, total_actual: int
 ) -> None:
@@ -5,9 +5,9 @@ import tempfile
 
 import dotenv
 import streamlit as st
-import tiktoken
 
 from src.aoai.azure_openai import AzureOpenAIManager
+from src.aoai.conversation import ConversationHistory
 from src.app.outputformatting import markdown_to_docx
 from src.app.prompts import generate_system_message
 from src.extractors.blob_data_extractor import AzureBlobDataExtractor
@@ -24,7 +24,7 @@ logger = get_logger()
 # Initialize session state variables if they don't exist
 session_vars = ["conversation_history", "ai_response", "chat_history", "messages"]
 initial_values = {
-    "conversation_history": [],
+    "conversation_history": ConversationHistory(max_tokens=8000),
     "ai_response": "",
     "chat_history": [],
     "messages": [
@@ -292,18 +292,55 @@ with st.sidebar:
     submit_to_ai = st.sidebar.button("Submit to AI")
 
 
-async def generate_ai_response(user_query, system_message):
+async def generate_ai_response(user_query, system_message, conversation_history=None):
+    """
+    Streams the AI response to a query into the page.
+
+    :param user_query: The query.
+    :param system_message: The system message.
+    :param conversation_history: The history sent with the query. Defaults to the session's conversation history;
+        pass a new list for standalone requests, e.g. the parts of a long document.
+    :return: The response, or None if it could not be generated.
+    """
+    if conversation_history is None:
+        conversation_history = st.session_state.conversation_history
+    try:
+        placeholder = st.empty()
+        ai_response = ""
+        async for chunk in st.session_state.azure_openai_manager.async_stream_chat_response(
+            conversation_history=conversation_history,
+            system_message_content=system_message,
+            query=user_query,
+            max_tokens=3000,
+        ):
+            if isinstance(chunk, str):
+                ai_response += chunk
+                placeholder.markdown(ai_response + "▌")
+        # The final response is rendered with the rest of the page
+        placeholder.empty()
+        if not ai_response:
+            st.error("The AI response could not be generated. Please try again.")
+            return None
+        st.balloons()
+        return ai_response
+    except Exception as e:
+        st.error(f"An error occurred while generating the AI response: {e}")
+        return None
+
+
+def stream_ai_response(user_query, system_message):
     try:
-        with st.spinner("🤖 Thinking..."):
-            ai_response, _ = await asyncio.to_thread(
-                st.session_state.azure_openai_manager.generate_chat_response,
+        ai_response = st.write_stream(
+            chunk
+            for chunk in st.session_state.azure_openai_manager.stream_chat_response(
                 conversation_history=st.session_state.conversation_history,
                 system_message_content=system_message,
                 query=user_query,
                 max_tokens=3000,
             )
-        st.balloons()
-        return ai_response
+            if isinstance(chunk, str)
+        )
+        return ai_response or None
     except Exception as e:
         st.error(f"An error occurred while generating the AI response: {e}")
         return None
@@ -364,8 +401,7 @@ async def process_single_file(semaphore, uploaded_file):
                     temp_file_path = temp_file.name
                     logger.info(f"Temporary file created at {temp_file_path}")
                     try:
-                        result_ocr = await asyncio.to_thread(
-                            st.session_state.azure_openai_manager.transcribe_audio_with_whisper,
+                        result_ocr = await st.session_state.azure_openai_manager.async_transcribe_audio_with_whisper(
                             audio_file_path=temp_file_path,
                         )
                     except Exception as e:
@@ -379,13 +415,11 @@ async def process_single_file(semaphore, uploaded_file):
                                 logger.error(f"Failed to remove temporary file: {e}")
             elif mime_type in ["image/png", "image/jpg", "image/jpeg"]:
                 file_bytes = uploaded_file.read()
-                result_ocr, _ = await asyncio.to_thread(
-                    st.session_state.azure_openai_manager.generate_chat_response,
+                result_ocr, _ = await st.session_state.azure_openai_manager.async_generate_chat_response(
                     system_message_content="""You are an expert OCR AI model. Please analyze the image and provide a detailed summary.""",
                     query="""Focus on the details and make sure you extract all the details and return a detailed write-up of the content of the image""",
                     conversation_history=[],
                     image_bytes=[file_bytes],
-                    stream=False,
                     max_tokens=1000,
                 )
             elif mime_type in ["application/pdf"]:
@@ -490,8 +524,9 @@ async def process_and_generate_response(
             "Please follow the standard formatting guidelines mentioned."
         )
 
-    enc = tiktoken.get_encoding("cl100k_base")
-    token_count = len(enc.encode(markdown_content))
+    token_count = st.session_state["azure_openai_manager"].count_tokens(
+        markdown_content
+    )
 
     if token_count > 125000:
         st.error('''Content exceeds the maximum allowed token count of 12,500. Please submit less content by reducing the number of files. 
@@ -538,7 +573,6 @@ async def process_and_generate_response(
         - The minimum length of the document should be {max_tokens} tokens.
         """
 
-    st.session_state.conversation_history.append({"role": "user", "content": query})
     ai_response = await generate_ai_response(
         query, generate_system_message(document_type, document_focus_areas)
     )
@@ -548,8 +582,9 @@ async def process_and_generate_response(
 
 
 async def process_and_generate_translation(
-    uploaded_files, target_language, max_tokens=3000
+    uploaded_files, target_language, max_tokens=2000
 ):
+    # Parts stay well under the 3000-token completion limit, as a translation can take more tokens than its source
     markdown_content = ""
     semaphore = asyncio.Semaphore(5)
 
@@ -569,42 +604,55 @@ async def process_and_generate_translation(
             st.error("No content was extracted from the uploaded files.")
             return
 
-        enc = tiktoken.get_encoding("cl100k_base")
-        token_count = len(enc.encode(markdown_content))
-
-        if token_count > max_tokens:
-            st.warning(
-                f"The content exceeds the maximum token limit of {max_tokens}. Only the first {max_tokens} tokens will be translated."
-            )
-            markdown_content = markdown_content[
-                :max_tokens
-            ]  # Truncate content to max_tokens
+        token_count = st.session_state["azure_openai_manager"].count_tokens(
+            markdown_content
+        )
 
         st.toast(
             f"The processed content has a total of {token_count} tokens.", icon="📊"
         )
 
-        query = f"""
-        Translate the following content into {target_language}. The translation should be accurate, context-aware, and preserve the original meaning and tone of the content.
-        
-        Translation Instructions:
-        Please follow these steps carefully:
-
-        1. Translate the document from the source language to the target language, focusing on a detailed, word-by-word translation.
-        2. Ensure that the translation preserves the original meaning and context of the document.
-        3. Pay attention to any idiomatic expressions, technical terms, or specialized vocabulary to provide accurate and appropriate translations.
-        4. Maintain the document's formatting, structure, and any specific instructions or annotations present in the original text.
-       
-        Content to be Translated:
-        {markdown_content}
-        """
+        # Content over the limit is translated part by part, split on markdown, paragraph and sentence boundaries
+        chunks = list(
+            st.session_state["azure_openai_manager"].chunk_text(
+                markdown_content, max_tokens
+            )
+        )
+        if len(chunks) > 1:
+            st.info(
+                f"The content exceeds the maximum token limit of {max_tokens}. It will be translated in {len(chunks)} parts."
+            )
 
         system_message = f"""
         You are a professional translator tasked with translating the provided content into {target_language}. Ensure the translation is accurate, context-aware, and preserves the original meaning and tone.
         """
 
-        st.session_state.conversation_history.append({"role": "user", "content": query})
-        ai_response = await generate_ai_response(query, system_message)
+        translations = []
+        for chunk in chunks:
+            query = f"""
+            Translate the following content into {target_language}. The translation should be accurate, context-aware, and preserve the original meaning and tone of the content.
+            
+            Translation Instructions:
+            Please follow these steps carefully:
+
+            1. Translate the document from the source language to the target language, focusing on a detailed, word-by-word translation.
+            2. Ensure that the translation preserves the original meaning and context of the document.
+            3. Pay attention to any idiomatic expressions, technical terms, or specialized vocabulary to provide accurate and appropriate translations.
+            4. Maintain the document's formatting, structure, and any specific instructions or annotations present in the original text.
+           
+            Content to be Translated:
+            {chunk}
+            """
+
+            # Each part is sent on its own, without the previous parts and their translations
+            translation = await generate_ai_response(
+                query, system_message, conversation_history=[]
+            )
+            if translation is None:
+                return
+            translations.append(translation)
+
+        ai_response = "\n\n".join(translations)
 
         st.session_state["ai_response"] = ai_response
         st.session_state.chat_history.append({"role": "ai", "content": ai_response})
@@ -612,7 +660,9 @@ async def process_and_generate_translation(
         st.error(f"An error occurred: {str(e)}")
 
 
-async def process_and_generate_summarization(uploaded_files, summarization_preference):
+async def process_and_generate_summarization(
+    uploaded_files, summarization_preference, max_tokens=100000
+):
     markdown_content = ""
     semaphore = asyncio.Semaphore(5)
 
@@ -627,11 +677,41 @@ async def process_and_generate_summarization(uploaded_files, summarization_prefe
         if result:
             markdown_content += result + "\n\n"
 
-    enc = tiktoken.get_encoding("cl100k_base")
-    token_count = len(enc.encode(markdown_content))
+    token_count = st.session_state["azure_openai_manager"].count_tokens(
+        markdown_content
+    )
 
     st.toast(f"The processed content has a total of {token_count} tokens.", icon="📊")
 
+    # Content over the limit is condensed part by part first, and the summary is written from the partial summaries
+    if token_count > max_tokens:
+        chunks = list(
+            st.session_state["azure_openai_manager"].chunk_text(
+                markdown_content, max_tokens, overlap_tokens=200
+            )
+        )
+        st.info(
+            f"The content exceeds the maximum token limit of {max_tokens}. It will be summarized in {len(chunks)} parts first."
+        )
+        partial_summaries = []
+        for chunk in chunks:
+            partial_summary = await generate_ai_response(
+                f"""
+                Summarize the following part of a larger document. Keep every major point and important detail,
+                as the summaries of all parts will be combined into a final summary.
+
+                Content to be summarized:
+                {chunk}
+                """,
+                "You are an expert summarizer AI. Summarize the provided part of a document accurately.",
+                # Each part is sent on its own, without the previous parts and their summaries
+                conversation_history=[],
+            )
+            if partial_summary is None:
+                return
+            partial_summaries.append(partial_summary)
+        markdown_content = "\n\n".join(partial_summaries)
+
     query = f"""
     Please summarize the following content. The summarization preference is '{summarization_preference}'.
 
@@ -650,7 +730,6 @@ async def process_and_generate_summarization(uploaded_files, summarization_prefe
     You are an expert summarizer AI. Your task is to summarize the provided content based on the preference '{summarization_preference}'. Ensure the summary is accurate and covers all key points.
     """
 
-    st.session_state.conversation_history.append({"role": "user", "content": query})
     ai_response = await generate_ai_response(query, system_message)
 
     st.session_state["ai_response"] = ai_response
@@ -702,18 +781,14 @@ if st.session_state.ai_response:
         with st.chat_message("user"):
             st.markdown(feedback_prompt)
 
-        ai_response = asyncio.run(
-            generate_ai_response(
-                feedback_prompt,
-                generate_system_message(document_type, document_focus_areas),
-            )
+        st.markdown("### Updated AI Response")
+        ai_response = stream_ai_response(
+            feedback_prompt,
+            generate_system_message(document_type, document_focus_areas),
         )
         st.session_state.ai_response = ai_response
         st.session_state.messages.append({"role": "assistant", "content": ai_response})
 
-        st.markdown("### Updated AI Response")
-        st.markdown(ai_response, unsafe_allow_html=True)
-
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
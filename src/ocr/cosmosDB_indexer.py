@@ -1,5 +1,5 @@
 import os
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 from azure.cosmos import (
     ContainerProxy,
@@ -9,6 +9,7 @@ from azure.cosmos import (
     exceptions,
 )
 
+from src.aoai.telemetry import CallRecord, MetricsRegistry, get_metrics
 from utils.ml_logging import get_logger
 
 # Initialize logging
@@ -22,6 +23,7 @@ class CosmosDBIndexer:
         credential_id: Optional[str] = None,
         database_name: Optional[str] = None,
         container_name: Optional[str] = None,
+        metrics: Optional[MetricsRegistry] = None,
     ):
         """
         Initialize the CosmosDBIndexer with connection details to Azure Cosmos DB.
@@ -30,7 +32,10 @@ class CosmosDBIndexer:
         :param credential_id: Credential ID for the Azure Cosmos DB account.
         :param database_name: The name of the database to use.
         :param container_name: The name of the container to index data into.
+        :param metrics: The registry recording the latency and request units of every operation. Defaults to the
+            process-wide registry.
         """
+        self.metrics = metrics or get_metrics()
         try:
             self.client = CosmosClient(
                 endpoint_url or os.getenv("AZURE_COSMOSDB_ENDPOINT"),
@@ -48,6 +53,29 @@ class CosmosDBIndexer:
                 container_name
             )
 
+    @staticmethod
+    def _request_charge_hook(call: CallRecord) -> Callable[[Any, Any], None]:
+        """
+        Returns a `response_hook` adding the request units charged for each response of an operation to its record,
+        so every page of a query is counted. The hook gets the headers of its own response, unlike the
+        connection's `last_response_headers`, which concurrent operations overwrite.
+
+        :param call: The record of the operation.
+        :return: The hook.
+        """
+
+        def record(headers: Any, result: Any) -> None:
+            # A query also calls the hook once when it returns its lazy iterator, before any page is fetched
+            if hasattr(result, "by_page"):
+                return
+            try:
+                charge = float(headers["x-ms-request-charge"])
+            except (KeyError, TypeError, ValueError):
+                return
+            call.request_units = (call.request_units or 0.0) + charge
+
+        return record
+
     def create_database(self, database_name: str) -> None:
         """
         Create a new database if it does not exist.
@@ -55,7 +83,8 @@ class CosmosDBIndexer:
         :param database_name: The name of the database to create.
         :return: None
         """
-        self.database = self.client.create_database_if_not_exists(id=database_name)
+        with self.metrics.track("cosmosdb", "create_database", database_name):
+            self.database = self.client.create_database_if_not_exists(id=database_name)
         logger.info(f"Database '{database_name}' created successfully.")
 
     def create_container(
@@ -89,16 +118,17 @@ class CosmosDBIndexer:
         }
 
         # Create a new container if it does not exist
-        self.container = self.database.create_container_if_not_exists(
-            id=container_settings["id"],
-            partition_key=container_settings["partition_key"],
-            offer_throughput=throughput,
-            indexing_policy=indexing_policy,
-            default_ttl=default_ttl,
-            unique_key_policy=unique_key_policy,
-            conflict_resolution_policy=conflict_resolution_policy,
-            analytical_storage_ttl=analytical_storage_ttl,
-        )
+        with self.metrics.track("cosmosdb", "create_container", container_name):
+            self.container = self.database.create_container_if_not_exists(
+                id=container_settings["id"],
+                partition_key=container_settings["partition_key"],
+                offer_throughput=throughput,
+                indexing_policy=indexing_policy,
+                default_ttl=default_ttl,
+                unique_key_policy=unique_key_policy,
+                conflict_resolution_policy=conflict_resolution_policy,
+                analytical_storage_ttl=analytical_storage_ttl,
+            )
 
         logger.info(
             f"Container '{container_name}' in database '{self.database.id}' created successfully."
@@ -136,7 +166,12 @@ class CosmosDBIndexer:
                     continue
 
                 logger.info("Upserting data item into Cosmos DB")
-                response = self.container.upsert_item(processed_data)
+                with self.metrics.track(
+                    "cosmosdb", "upsert_item", self.container.id
+                ) as call:
+                    response = self.container.upsert_item(
+                        processed_data, response_hook=self._request_charge_hook(call)
+                    )
                 logger.info(
                     f"Data indexed successfully with id: {processed_data['id']}"
                 )
@@ -186,11 +221,16 @@ class CosmosDBIndexer:
         """
         try:
             # Execute the query
-            items = list(
-                self.container.query_items(
-                    query=query, enable_cross_partition_query=True
+            with self.metrics.track(
+                "cosmosdb", "query_items", self.container.id
+            ) as call:
+                items = list(
+                    self.container.query_items(
+                        query=query,
+                        enable_cross_partition_query=True,
+                        response_hook=self._request_charge_hook(call),
+                    )
                 )
-            )
 
             if items:
                 logger.info(
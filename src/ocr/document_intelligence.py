@@ -1,3 +1,4 @@
+import hashlib
 import os
 from functools import lru_cache
 from typing import Any, Dict, Iterator, List, Optional, Union
@@ -11,6 +12,8 @@ from azure.core.polling import LROPoller
 from dotenv import load_dotenv
 from langchain_core.documents import Document as LangchainDocument
 
+from src.aoai.single_flight import SingleFlight, get_shared_single_flight
+from src.aoai.telemetry import MetricsRegistry, get_metrics
 from src.extractors.blob_data_extractor import AzureBlobDataExtractor
 from utils.ml_logging import get_logger
 
@@ -28,6 +31,8 @@ class AzureDocumentIntelligenceManager:
         azure_endpoint: Optional[str] = None,
         azure_key: Optional[str] = None,
         container_name: Optional[str] = None,
+        single_flight: Optional[SingleFlight] = None,
+        metrics: Optional[MetricsRegistry] = None,
     ):
         """
         Initialize the class with configurations for Azure's Document Analysis Client.
@@ -35,6 +40,10 @@ class AzureDocumentIntelligenceManager:
         :param azure_endpoint: Endpoint URL for Azure's Document Analysis Client.
         :param azure_key: API key for Azure's Document Analysis Client.
         :param container_client: Azure Container Client specific to the container.
+        :param single_flight: The group coalescing identical in-flight analyses into one call. Defaults to the
+            process-wide shared group.
+        :param metrics: The registry recording the latency and payload sizes of every analysis. Defaults to the
+            process-wide registry.
         """
         self.azure_endpoint = azure_endpoint
         self.azure_key = azure_key
@@ -48,6 +57,8 @@ class AzureDocumentIntelligenceManager:
             )
 
         self.blob_manager = AzureBlobDataExtractor(container_name=container_name)
+        self.single_flight = single_flight or get_shared_single_flight()
+        self.metrics = metrics or get_metrics()
 
         self.document_analysis_client = DocumentIntelligenceClient(
             endpoint=self.azure_endpoint,
@@ -140,18 +151,8 @@ class AzureDocumentIntelligenceManager:
 
         # Check if the document_input is a URL
         if isinstance(document_input, bytes):
-            poller = self.document_analysis_client.begin_analyze_document(
-                model_id=model_type,
-                analyze_request=AnalyzeDocumentRequest(bytes_source=document_input),
-                pages=pages,
-                locale=locale,
-                string_index_type=string_index_type,
-                features=features,
-                query_fields=query_fields,
-                output_content_format=output_format if output_format else "text",
-                content_type=content_type,
-                **kwargs,
-            )
+            analyze_request = AnalyzeDocumentRequest(bytes_source=document_input)
+            source = hashlib.sha256(document_input).hexdigest()
         elif document_input.startswith(("http://", "https://")):
             # If it's an HTTP URL, raise an error
             if document_input.startswith("http://"):
@@ -160,47 +161,52 @@ class AzureDocumentIntelligenceManager:
             elif "blob.core.windows.net" in document_input:
                 logger.info("Blob URL detected. Extracting content.")
                 content_bytes = self.blob_manager.extract_content(document_input)
-                poller = self.document_analysis_client.begin_analyze_document(
-                    model_id=model_type,
-                    analyze_request=AnalyzeDocumentRequest(base64_source=content_bytes),
-                    pages=pages,
-                    locale=locale,
-                    string_index_type=string_index_type,
-                    features=features,
-                    query_fields=query_fields,
-                    output_content_format=output_format if output_format else "text",
-                    content_type=content_type,
-                    **kwargs,
-                )
+                analyze_request = AnalyzeDocumentRequest(base64_source=content_bytes)
+                source = hashlib.sha256(content_bytes).hexdigest()
             else:
-                poller = self.document_analysis_client.begin_analyze_document(
-                    model_id=model_type,
-                    analyze_request=AnalyzeDocumentRequest(url_source=document_input),
-                    pages=pages,
-                    locale=locale,
-                    string_index_type=string_index_type,
-                    features=features,
-                    query_fields=query_fields,
-                    output_content_format=output_format if output_format else "text",
-                    content_type=content_type,
-                    **kwargs,
-                )
+                analyze_request = AnalyzeDocumentRequest(url_source=document_input)
+                source = document_input
         else:
             with open(document_input, "rb") as f:
                 file_content = f.read()
-                poller = self.document_analysis_client.begin_analyze_document(
-                    model_id=model_type,
-                    analyze_request=AnalyzeDocumentRequest(bytes_source=file_content),
-                    pages=pages,
-                    locale=locale,
-                    string_index_type=string_index_type,
-                    features=features,
-                    query_fields=query_fields,
-                    output_content_format=output_format if output_format else "text",
-                    content_type=content_type,
-                    **kwargs,
-                )
-        return poller.result()
+            analyze_request = AnalyzeDocumentRequest(bytes_source=file_content)
+            source = hashlib.sha256(file_content).hexdigest()
+
+        request = dict(
+            model_id=model_type,
+            pages=pages,
+            locale=locale,
+            string_index_type=string_index_type,
+            features=features,
+            query_fields=query_fields,
+            output_content_format=output_format if output_format else "text",
+            content_type=content_type,
+            **kwargs,
+        )
+        # Identical documents submitted concurrently (e.g. from several sessions) share one analysis
+        key = self.single_flight.make_key(self.azure_endpoint, source, **request)
+        return self.single_flight.do(key, self._analyze, analyze_request, request)
+
+    def _analyze(
+        self, analyze_request: AnalyzeDocumentRequest, request: Dict[str, Any]
+    ) -> Any:
+        """
+        Submits a document for analysis and waits for the result.
+
+        :param analyze_request: The document to analyze.
+        :param request: The analysis parameters.
+        :return: The AnalyzeResult.
+        """
+        with self.metrics.track(
+            "document_intelligence", "analyze", request.get("model_id")
+        ) as call:
+            source = analyze_request.bytes_source or analyze_request.base64_source
+            if source is not None:
+                call.request_bytes = len(source)
+            poller = self.document_analysis_client.begin_analyze_document(
+                analyze_request=analyze_request, **request
+            )
+            return poller.result()
 
     def process_invoice(self, invoice: Document) -> Dict:
         """
@@ -10,6 +10,12 @@ from dotenv import load_dotenv
 from IPython.display import Image, display
 from requests.exceptions import RequestException
 
+from src.aoai.rate_limiter import AdaptiveRateLimiter, get_shared_rate_limiter
+from src.aoai.retry import RetryPolicy
+from src.aoai.scheduler import PriorityScheduler, get_shared_scheduler
+from src.aoai.telemetry import MetricsRegistry, get_metrics
+from src.aoai.tokenizer import AzureOpenAITokenizer, get_encoding_registry
+from src.aoai.transport import get_shared_session
 from src.extractors.blob_data_extractor import AzureBlobDataExtractor
 from utils.ml_logging import get_logger
 
@@ -35,6 +41,11 @@ class GPT4VisionManager:
         openai_api_version: Optional[str] = None,
         openai_api_key: Optional[str] = None,
         container_name: Optional[str] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        http_session: Optional[requests.Session] = None,
+        metrics: Optional[MetricsRegistry] = None,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        scheduler: Optional[PriorityScheduler] = None,
     ):
         """
         Initialize the GPT4Vision class with OpenAI API configurations.
@@ -44,6 +55,14 @@ class GPT4VisionManager:
         :param openai_api_version: API version.
         :param openai_api_key: OpenAI API key.
         :param container_client: Azure Container Client specific to the container.
+        :param retry_policy: The policy used to retry transient failures. Defaults to `RetryPolicy()`.
+        :param http_session: The pooled session used for REST calls. Defaults to the process-wide shared session.
+        :param metrics: The registry recording the latency, tokens and payload sizes of every call. Defaults to
+            the process-wide registry.
+        :param rate_limiter: The client-side rate limiter gating every call, with the estimated tokens of its text
+            and images. Defaults to the process-wide shared limiter.
+        :param scheduler: The scheduler admitting requests to the rate limiter by priority class and tenant.
+            Defaults to the process-wide scheduler of `rate_limiter`.
         """
         self.openai_api_base = openai_api_base
         self.deployment_name = deployment_name
@@ -52,12 +71,19 @@ class GPT4VisionManager:
         if not self.openai_api_base or not self.openai_api_key:
             self.load_environment_variables_from_env_file()
 
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.http_session = http_session or get_shared_session()
+        self.metrics = metrics or get_metrics()
+        self.rate_limiter = rate_limiter or get_shared_rate_limiter()
+        self.scheduler = scheduler or get_shared_scheduler(self.rate_limiter)
+        self.tokenizer = AzureOpenAITokenizer()
         self.blob_manager = AzureBlobDataExtractor(container_name=container_name)
         self.azure_endpoint_vision = os.getenv("AZURE_ENDPOINT_VISION")
         self.azure_key_vision = os.getenv("AZURE_KEY_VISION")
         self.video_indexer = VideoIndexer(
             vision_api_endpoint=self.azure_endpoint_vision,
             vision_api_key=self.azure_key_vision,
+            http_session=self.http_session,
         )
 
     def load_environment_variables_from_env_file(self):
@@ -195,6 +221,74 @@ class GPT4VisionManager:
             )
             raise
 
+    def _estimate_request_tokens(self, payload: Dict[str, Any]) -> int:
+        """
+        Estimates the quota a request consumes: the tokens of its text and images plus `max_tokens`.
+
+        :param payload: The request payload.
+        :return: The estimated token cost, or a characters/4 heuristic if the tokenizer is unavailable.
+        """
+        try:
+            tokens = self.tokenizer.estimate_tokens_azure_openai(
+                payload.get("messages") or [],
+                get_encoding_registry().model_for(self.deployment_name),
+            )
+        except Exception as e:
+            logger.debug(f"Token estimation failed, using heuristic: {e}")
+            tokens = len(json.dumps(payload.get("messages"), default=str)) // 4
+        return tokens + (payload.get("max_tokens") or 0)
+
+    def _post(
+        self,
+        operation: str,
+        api_url: str,
+        headers: Dict[str, str],
+        payload: Dict[str, Any],
+    ) -> requests.Response:
+        """
+        Sends a request once admitted through the scheduler and rate limiter, and feeds the response headers back.
+
+        :param operation: The operation recorded in the metrics.
+        :param api_url: The URL of the request.
+        :param headers: The HTTP headers of the request.
+        :param payload: The request payload.
+        :return: The response.
+        :raises requests.HTTPError: If the response status is not successful.
+        """
+        rate_limit_key = f"{self.openai_api_base}|{self.deployment_name}"
+        tokens = self._estimate_request_tokens(payload)
+        self.scheduler.acquire(rate_limit_key, tokens)
+        with self.metrics.track("openai", operation, self.deployment_name) as call:
+            try:
+                response = self.http_session.post(
+                    api_url, headers=headers, json=payload
+                )
+            except Exception:
+                self.rate_limiter.release(rate_limit_key, tokens)
+                raise
+            if response.status_code == 429:
+                self.rate_limiter.penalize(rate_limit_key, tokens, response.headers)
+            else:
+                self.rate_limiter.update_from_headers(
+                    rate_limit_key, tokens, response.headers
+                )
+            call.request_bytes = len(response.request.body or b"")
+            call.response_bytes = len(response.content)
+            response.raise_for_status()
+            body = response.json()
+            call.set_usage(body.get("usage"), body.get("model"))
+            # Extensions (OCR, grounding, video) add prompt tokens the estimate does not count
+            if "enhancements" not in payload and "dataSources" not in payload:
+                try:
+                    self.tokenizer.record_usage(
+                        payload.get("messages"),
+                        (body.get("usage") or {}).get("prompt_tokens"),
+                        get_encoding_registry().model_for(self.deployment_name),
+                    )
+                except Exception as e:
+                    logger.debug(f"Token calibration failed: {e}")
+            return response
+
     def call_gpt4v_image(
         self,
         image_file_paths: Union[str, List[str]],
@@ -328,8 +422,10 @@ class GPT4VisionManager:
 
             # Send the request
             logger.info(f"Sending request to {api_url} with payload: {payload}")
-            response = requests.post(api_url, headers=headers, json=payload)
-            response.raise_for_status()
+
+            response = self.retry_policy.call(
+                self._post, "vision.chat.completions", api_url, headers, payload
+            )
             logger.info("Request successful.")
             content = response.json()["choices"][0]["message"]["content"]
 
@@ -412,8 +508,9 @@ class GPT4VisionManager:
 
         # Send the request and handle the response
         try:
-            response = requests.post(api_url, headers=headers, json=payload)
-            response.raise_for_status()  # Raise an error for bad HTTP status codes
+            response = self.retry_policy.call(
+                self._post, "vision.video.chat.completions", api_url, headers, payload
+            )
             return response.json()
         except requests.RequestException as e:
             logger.info(f"Failed to make the request. Error: {e}")
@@ -426,15 +523,22 @@ class VideoIndexer:
     add videos to indexes, and wait for the ingestion process to complete.
     """
 
-    def __init__(self, vision_api_endpoint: str, vision_api_key: str) -> None:
+    def __init__(
+        self,
+        vision_api_endpoint: str,
+        vision_api_key: str,
+        http_session: Optional[requests.Session] = None,
+    ) -> None:
         """
         Initializes the VideoIndexer with the necessary API endpoint and key.
 
         :param vision_api_endpoint: The endpoint URL for the vision API.
         :param vision_api_key: The subscription key for the vision API.
+        :param http_session: The pooled session used for REST calls. Defaults to the process-wide shared session.
         """
         self.vision_api_endpoint: str = vision_api_endpoint
         self.vision_api_key: str = vision_api_key
+        self.http_session: requests.Session = http_session or get_shared_session()
 
     def create_video_index(self, index_name: str) -> requests.Response:
         """
@@ -450,7 +554,9 @@ class VideoIndexer:
         }
         data: dict = {"features": [{"name": "vision", "domain": "surveillance"}]}
         try:
-            response = requests.put(url, headers=headers, data=json.dumps(data))
+            response = self.http_session.put(
+                url, headers=headers, data=json.dumps(data)
+            )
             response.raise_for_status()  # Raises stored HTTPError, if one occurred.
         except requests.exceptions.RequestException as e:
             logger.error(f"Failed to create video index '{index_name}': {e}")
@@ -479,7 +585,9 @@ class VideoIndexer:
             ]
         }
         try:
-            response = requests.put(url, headers=headers, data=json.dumps(data))
+            response = self.http_session.put(
+                url, headers=headers, data=json.dumps(data)
+            )
             response.raise_for_status()
         except requests.exceptions.RequestException as e:
             logger.error(
@@ -510,7 +618,9 @@ class VideoIndexer:
             )
             time.sleep(15)  # Wait before polling again
             try:
-                response: requests.Response = requests.get(url, headers=headers)
+                response: requests.Response = self.http_session.get(
+                    url, headers=headers
+                )
                 response.raise_for_status()
                 logger.info(f"Received response: {response.status_code}.")
                 state_data: dict = response.json()
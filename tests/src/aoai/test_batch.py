@@ -0,0 +1,133 @@
+from types import SimpleNamespace
+
+import pytest
+
+from src.aoai.batch import BatchJobManager, LocalBatchExecutor, read_jsonl
+
+
+class EchoExecutor:
+    """Completes every job at once, answering each chat request with its last message."""
+
+    def __init__(self):
+        self.jobs = {}
+
+    def submit(self, input_path, endpoint, completion_window):
+        self.jobs["job-1"] = (list(read_jsonl(input_path)), endpoint)
+        return "job-1"
+
+    def retrieve(self, job_id):
+        return "completed", {"request_counts": {"total": len(self.jobs[job_id][0])}}
+
+    def read_output(self, job_id):
+        requests, _ = self.jobs[job_id]
+        # Results come back out of order, and the last request is lost
+        for request in reversed(requests[:-1]):
+            content = request["body"]["messages"][-1]["content"]
+            if content == "bad":
+                yield {
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 400,
+                        "body": {
+                            "error": {"code": "content_filter", "message": "Filtered"}
+                        },
+                    },
+                    "error": None,
+                }
+                continue
+            yield {
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "body": {"echo": content}},
+                "error": None,
+            }
+
+
+@pytest.fixture
+def batch_manager():
+    manager = SimpleNamespace(chat_model_name="gpt-4o", embedding_model_name="ada")
+    return BatchJobManager(manager, executor=EchoExecutor(), poll_interval=0)
+
+
+def test_results_are_reassociated_by_custom_id(batch_manager, tmp_path):
+    requests = [
+        batch_manager.chat_request(
+            [{"role": "user", "content": f"q{i}"}], temperature=0
+        )
+        for i in range(3)
+    ]
+    results = batch_manager.run(requests, str(tmp_path / "input.jsonl"))
+
+    assert results["request-0"]["body"] == {"echo": "q0"}
+    assert results["request-1"]["body"] == {"echo": "q1"}
+    assert results["request-2"]["error"]["code"] == "missing"
+    line = next(read_jsonl(str(tmp_path / "input.jsonl")))
+    assert line["url"] == "/chat/completions"
+    assert line["body"]["model"] == "gpt-4o"
+
+
+def test_rejected_requests_are_failures(batch_manager, tmp_path):
+    requests = [
+        batch_manager.chat_request([{"role": "user", "content": content}])
+        for content in ("bad", "good", "lost")
+    ]
+    results = batch_manager.run(requests, str(tmp_path / "input.jsonl"))
+
+    assert results["request-0"]["status_code"] == 400
+    assert results["request-0"]["error"] == {
+        "code": "content_filter",
+        "message": "Filtered",
+    }
+    assert results["request-1"]["error"] is None
+
+
+def test_mixed_endpoints_and_duplicate_ids_are_rejected(batch_manager, tmp_path):
+    path = str(tmp_path / "input.jsonl")
+    with pytest.raises(ValueError):
+        batch_manager.submit(
+            [
+                batch_manager.chat_request([{"role": "user", "content": "q"}]),
+                batch_manager.embedding_request("text"),
+            ],
+            path,
+        )
+    with pytest.raises(ValueError):
+        batch_manager.submit(
+            [batch_manager.embedding_request("a", custom_id="x")] * 2, path
+        )
+
+
+class RecordingManager:
+    """Answers every request at once, recording the deployment each estimate was made for."""
+
+    chat_model_name = "gpt-4o"
+    embedding_model_name = "ada"
+
+    def __init__(self):
+        self.estimated_for = []
+        create = SimpleNamespace(with_raw_response=SimpleNamespace(create=None))
+        self.openai_client = SimpleNamespace(
+            chat=SimpleNamespace(completions=create), embeddings=create
+        )
+
+    def _estimate_request_tokens(
+        self, messages=None, text=None, max_tokens=None, deployment=None
+    ):
+        self.estimated_for.append(deployment)
+        return 1
+
+    def _call_with_rate_limit(self, create, deployment, tokens, **body):
+        return SimpleNamespace(model_dump=lambda: {"model": deployment})
+
+
+def test_local_requests_are_estimated_for_their_deployment(tmp_path):
+    manager = RecordingManager()
+    batch_manager = BatchJobManager(
+        manager, executor=LocalBatchExecutor(manager), poll_interval=0
+    )
+
+    results = batch_manager.run(
+        [batch_manager.embedding_request("text")], str(tmp_path / "input.jsonl")
+    )
+
+    assert results["request-0"]["body"] == {"model": "ada"}
+    assert manager.estimated_for == ["ada"]
@@ -0,0 +1,79 @@
+import base64
+import cProfile
+import json
+import pstats
+
+from src.aoai.benchmark import build_scenarios, compare_results, overhead_breakdown
+
+
+def test_scenarios_sweep_concurrency_payload_and_streaming():
+    scenarios = build_scenarios(
+        [1, 8],
+        ["text", "multi_image"],
+        [False, True],
+        ["AzureOpenAIManager", "GPT4VisionManager"],
+    )
+    names = [scenario.name for scenario in scenarios]
+
+    assert len(names) == 10
+    assert "AzureOpenAIManager/multi_image/stream/c8" in names
+    assert "GPT4VisionManager/multi_image/complete/c1" in names
+    assert not any(name.startswith("GPT4VisionManager/text") for name in names)
+
+
+def test_overhead_breakdown_attributes_profiled_time_without_double_counting():
+    payload = {"messages": [{"role": "user", "content": "x" * 2000}] * 50}
+
+    def request():
+        json.loads(json.dumps(payload))
+        base64.b64encode(b"x" * 100_000)
+
+    profiler = cProfile.Profile()
+    for _ in range(20):
+        profiler.runcall(request)
+    stats = pstats.Stats(profiler)
+
+    breakdown = overhead_breakdown(stats)
+
+    assert breakdown["json"] > 0
+    assert breakdown["base64"] > 0
+    assert breakdown["logging"] == 0
+    assert breakdown["json"] + breakdown["base64"] <= stats.total_tt * 1.01
+
+
+def test_compare_results_flags_throughput_and_cpu_regressions():
+    baseline = {
+        "scenarios": [
+            {
+                "name": "a",
+                "requests_per_second": 100.0,
+                "cpu_seconds_per_request": 0.010,
+            },
+            {
+                "name": "b",
+                "requests_per_second": 100.0,
+                "cpu_seconds_per_request": 0.010,
+            },
+        ]
+    }
+    current = {
+        "scenarios": [
+            {
+                "name": "a",
+                "requests_per_second": 70.0,
+                "cpu_seconds_per_request": 0.011,
+            },
+            {
+                "name": "b",
+                "requests_per_second": 95.0,
+                "cpu_seconds_per_request": 0.015,
+            },
+            {"name": "c", "requests_per_second": 1.0, "cpu_seconds_per_request": 1.0},
+        ]
+    }
+
+    regressions = compare_results(baseline, current, tolerance=0.2)
+
+    assert len(regressions) == 2
+    assert regressions[0].startswith("a: throughput fell")
+    assert regressions[1].startswith("b: CPU per request rose")
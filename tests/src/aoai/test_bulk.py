@@ -0,0 +1,112 @@
+import asyncio
+import json
+import random
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.aoai.bulk import BulkRunner
+
+
+class Crash(BaseException):
+    """Simulates the process dying mid-run."""
+
+
+class FakeManager:
+    def __init__(self, crash_at=None, fail_at=None, tokens=10):
+        self.crash_at = crash_at
+        self.fail_at = fail_at
+        self.tokens = tokens
+        self.calls = []
+
+    def estimate_request_tokens(self, messages, max_tokens=None):
+        return self.tokens
+
+    async def async_create_chat_completion(self, messages, tokens=None, **params):
+        query = messages[-1]["content"]
+        self.calls.append(query)
+        if query == self.crash_at:
+            raise Crash()
+        if query == self.fail_at:
+            raise ValueError("bad request")
+        await asyncio.sleep(random.random() / 100)
+        return SimpleNamespace(
+            choices=[
+                SimpleNamespace(
+                    message=SimpleNamespace(content=query.upper()), finish_reason="stop"
+                )
+            ],
+            usage=SimpleNamespace(prompt_tokens=5, completion_tokens=1),
+        )
+
+
+def read_records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_results_are_written_in_input_order(tmp_path):
+    output = str(tmp_path / "out.jsonl")
+    requests = [{"query": f"q{i}", "temperature": 0} for i in range(50)]
+    runner = BulkRunner(FakeManager(fail_at="q7"), output, concurrency=5)
+
+    stats = runner.run(requests)
+
+    records = read_records(output)
+    assert [r["index"] for r in records] == list(range(50))
+    assert records[3]["response"] == "Q3"
+    assert records[7]["error"] == "ValueError: bad request"
+    assert stats["completed"] == 50 and stats["errors"] == 1
+
+
+def test_crashed_run_resumes_from_checkpoint(tmp_path):
+    output = str(tmp_path / "out.jsonl")
+    requests = [{"custom_id": f"id-{i}", "query": f"q{i}"} for i in range(40)]
+
+    with pytest.raises(Crash):
+        BulkRunner(
+            FakeManager(crash_at="q25"), output, concurrency=4, checkpoint_every=10
+        ).run(requests)
+
+    manager = FakeManager()
+    stats = BulkRunner(manager, output, concurrency=4, checkpoint_every=10).run(
+        requests
+    )
+
+    records = read_records(output)
+    assert [r["custom_id"] for r in records] == [f"id-{i}" for i in range(40)]
+    assert stats["resumed"] >= 10
+    assert "q0" not in manager.calls
+
+
+def test_finished_run_is_not_run_again(tmp_path):
+    output = str(tmp_path / "out.jsonl")
+    requests = [{"query": f"q{i}"} for i in range(5)]
+    BulkRunner(FakeManager(), output).run(requests)
+
+    manager = FakeManager()
+    stats = BulkRunner(manager, output).run(requests)
+
+    assert manager.calls == []
+    assert stats["resumed"] == 5 and stats["completed"] == 0
+    assert len(read_records(output)) == 5
+
+
+def test_budget_bounds_tokens_per_minute(tmp_path):
+    # 6000 TPM refills 100 tokens per second: the first 60 requests fit the full bucket,
+    # the next 2 must wait for it to refill even though few requests are in flight
+    requests = [{"query": f"q{i}"} for i in range(62)]
+    runner = BulkRunner(
+        FakeManager(tokens=100),
+        str(tmp_path / "out.jsonl"),
+        concurrency=4,
+        tokens_per_minute=6000,
+    )
+
+    started_at = time.monotonic()
+    stats = runner.run(requests)
+    elapsed = time.monotonic() - started_at
+
+    assert stats["completed"] == 62 and stats["errors"] == 0
+    assert elapsed >= 0.9 * (62 * 100 - 6000) / 100
@@ -0,0 +1,88 @@
+import random
+
+import numpy as np
+
+from src.aoai.calibration import TokenCalibrator
+from src.aoai.tokenizer import AzureOpenAITokenizer
+
+
+class WordEncoding:
+    def encode_ordinary(self, text):
+        return text.split()
+
+    def encode_ordinary_batch(self, texts, num_threads=8):
+        return [self.encode_ordinary(text) for text in texts]
+
+
+PRIOR = np.array([1.0, 1.0, 3.0, 1.0, 3.0])
+
+
+def _billed(features):
+    # A format costing 4 tokens per message and 5 per prompt, unlike the prior
+    return int(features[0] + 4 * features[2] + 5)
+
+
+def _train(calibrator, samples=50):
+    rng = random.Random(3)
+    for _ in range(samples):
+        features = np.array([rng.randint(10, 2000), 0, rng.randint(1, 12), 0, 1.0])
+        calibrator.record("gpt-4o", features, _billed(features), PRIOR)
+
+
+def test_fit_corrects_the_prior_and_keeps_unseen_features():
+    calibrator = TokenCalibrator(min_samples=20, refit_every=10)
+    assert calibrator.coefficients("gpt-4o") is None
+
+    _train(calibrator)
+    coefficients = calibrator.coefficients("gpt-4o")
+
+    features = np.array([500, 0, 6, 0, 1.0])
+    assert abs(features @ coefficients - _billed(features)) / _billed(features) < 0.01
+    assert coefficients[1] == 1.0  # no image was seen
+    assert calibrator.snapshot()["gpt-4o"]["mean_absolute_error"] < 0.01
+
+
+def test_calibration_is_persisted(tmp_path):
+    path = str(tmp_path / "calibration.json")
+    calibrator = TokenCalibrator(path=path, save_interval=0)
+    _train(calibrator)
+
+    restored = TokenCalibrator(path=path)
+
+    assert np.allclose(
+        restored.coefficients("gpt-4o"), calibrator.coefficients("gpt-4o")
+    )
+    assert restored.snapshot()["gpt-4o"]["samples"] == 50
+
+
+def test_processes_sharing_a_file_keep_each_others_samples(tmp_path):
+    path = str(tmp_path / "calibration.json")
+    first = TokenCalibrator(path=path, save_interval=0)
+    second = TokenCalibrator(path=path, save_interval=0)
+    _train(first, samples=30)
+    _train(second, samples=25)
+    second.save()
+
+    restored = TokenCalibrator(path=path)
+
+    assert restored.snapshot()["gpt-4o"]["samples"] == 55
+
+
+def test_tokenizer_estimates_use_calibrated_coefficients(monkeypatch):
+    monkeypatch.setattr(
+        "src.aoai.tokenizer.get_encoding_for_model", lambda model: WordEncoding()
+    )
+    tokenizer = AzureOpenAITokenizer(calibrator=TokenCalibrator(sample_rate=1.0))
+    conversations = [
+        [{"role": "user", "content": "word " * size}] * (size % 5 + 1)
+        for size in range(1, 40)
+    ]
+    for messages in conversations:
+        features = tokenizer.message_features(messages, "gpt-4o")
+        tokenizer.record_usage(messages, _billed(features), "gpt-4o")
+
+    messages = [{"role": "system", "content": "be brief"}] + conversations[7]
+    expected = _billed(tokenizer.message_features(messages, "gpt-4o"))
+
+    assert tokenizer.estimate_tokens_azure_openai(messages, "gpt-4o") == expected
+    assert tokenizer.count_conversations([messages], "gpt-4o").tolist() == [expected]
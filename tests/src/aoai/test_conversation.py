@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+
+from src.aoai.conversation import (
+    SUMMARY_PREFIX,
+    TRUNCATION_MARKER,
+    ConversationHistory,
+)
+
+
+def test_eviction_keeps_recent_messages_within_budget():
+    history = ConversationHistory(
+        max_tokens=60, min_recent_messages=2, system_message="Be brief."
+    )
+    for i in range(5):
+        history.add_turn(
+            {"role": "user", "content": f"question {i} " * 5}, f"answer {i} " * 5
+        )
+
+    evicted = history.evict_over_budget()
+
+    assert evicted[0]["content"].startswith("question 0")
+    assert history.tokens <= history.max_tokens
+    assert len(history.messages) >= 2
+    assert history.messages[-1]["content"].startswith("answer 4")
+
+
+def test_min_recent_messages_are_never_evicted():
+    history = ConversationHistory(max_tokens=1, min_recent_messages=2)
+    history.add_turn({"role": "user", "content": "hello"}, "hi there")
+
+    assert history.evict_over_budget() == []
+    assert len(history.messages) == 2
+
+
+def test_images_are_replaced_by_placeholder():
+    history = ConversationHistory()
+    history.add_message(
+        "user",
+        [
+            {"type": "text", "text": "What is this?"},
+            {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}},
+        ],
+    )
+
+    assert history.messages == [{"role": "user", "content": "What is this?\n[image]"}]
+
+
+def test_to_messages_puts_summary_after_system_message():
+    history = ConversationHistory(system_message="Be brief.")
+    history.add_turn({"role": "user", "content": "hello"}, "hi")
+    history.set_summary("The user greeted the assistant.")
+
+    messages = history.to_messages()
+
+    assert [m["role"] for m in messages] == ["system", "system", "user", "assistant"]
+    assert messages[1]["content"] == SUMMARY_PREFIX + "The user greeted the assistant."
+
+
+def test_message_larger_than_the_budget_is_truncated():
+    history = ConversationHistory(max_tokens=100)
+    document = "word " * 2000
+
+    history.add_turn({"role": "user", "content": document}, "done")
+
+    assert history.tokens <= history.max_tokens
+    assert history.messages[0]["content"].startswith("word word")
+    assert "truncated" in history.messages[0]["content"]
+    assert history.messages[1]["content"] == "done"
+
+
+def test_truncation_cuts_on_token_boundaries():
+    history = ConversationHistory(max_tokens=100, max_message_tokens=3)
+    history._encoding = SimpleNamespace(
+        encode_ordinary=lambda text: list(text.encode("utf-8")),
+        decode=lambda tokens: bytes(tokens).decode("utf-8"),
+    )
+
+    history.add_message("user", "abcdef")
+
+    assert history.messages[0]["content"] == "abc" + TRUNCATION_MARKER.format(tokens=3)
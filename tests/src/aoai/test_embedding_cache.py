@@ -0,0 +1,37 @@
+import numpy as np
+
+from src.aoai.embedding_cache import EmbeddingCache
+
+
+def test_round_trip_and_stats(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), max_entries=10)
+    vectors = np.random.rand(2, 8).astype(np.float32)
+    cache.put_many("ada", None, ["a", "b"], vectors)
+
+    results = cache.get_many("ada", None, ["b", "c", "a"])
+    np.testing.assert_array_equal(results[0], vectors[1])
+    assert results[1] is None
+    np.testing.assert_array_equal(results[2], vectors[0])
+    assert cache.get_many("ada", 256, ["a"]) == [None]
+    assert cache.snapshot()["hits"] == 2 and cache.snapshot()["misses"] == 2
+
+
+def test_lru_eviction_recycles_slots(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), max_entries=2)
+    cache.put_many("ada", None, ["a", "b"], np.ones((2, 4), dtype=np.float32))
+    cache.get_many("ada", None, ["a"])
+    cache.put_many("ada", None, ["c"], np.full((1, 4), 3.0, dtype=np.float32))
+
+    a, b, c = cache.get_many("ada", None, ["a", "b", "c"])
+    assert b is None
+    np.testing.assert_array_equal(a, np.ones(4))
+    np.testing.assert_array_equal(c, np.full(4, 3.0))
+    assert cache.snapshot()["evictions"] == 1
+
+
+def test_shared_between_instances(tmp_path):
+    EmbeddingCache(str(tmp_path)).put_many(
+        "ada", None, ["a"], np.ones((1, 4), dtype=np.float32)
+    )
+    (vector,) = EmbeddingCache(str(tmp_path)).get_many("ada", None, ["a"])
+    np.testing.assert_array_equal(vector, np.ones(4))
@@ -0,0 +1,26 @@
+import base64
+from types import SimpleNamespace
+
+import numpy as np
+
+from src.aoai.azure_openai import AzureOpenAIManager
+
+
+def test_batches_respect_input_and_token_limits():
+    batches = AzureOpenAIManager._plan_embedding_batches(
+        [10, 10, 10, 50, 10], max_inputs=2, max_batch_tokens=40
+    )
+    assert batches == [(0, 2), (2, 3), (3, 4), (4, 5)]
+
+
+def test_base64_embeddings_are_decoded_in_input_order():
+    vectors = np.arange(6, dtype=np.float32).reshape(3, 2)
+    data = [
+        SimpleNamespace(index=i, embedding=base64.b64encode(v.tobytes()).decode())
+        for i, v in reversed(list(enumerate(vectors)))
+    ]
+    out = AzureOpenAIManager._assemble_embeddings(
+        4, [(1, 4)], [SimpleNamespace(data=data)]
+    )
+    assert out.dtype == np.float32 and out.shape == (4, 2)
+    np.testing.assert_array_equal(out[1:], vectors)
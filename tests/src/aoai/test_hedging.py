@@ -0,0 +1,132 @@
+import asyncio
+import contextlib
+import threading
+import time
+
+import pytest
+
+from src.aoai.azure_openai import AzureOpenAIManager
+from src.aoai.hedging import HedgingPolicy
+from src.aoai.mock_server import LatencyModel, MockAzureOpenAIServer
+from src.aoai.rate_limiter import AdaptiveRateLimiter
+from src.aoai.router import DeploymentEndpoint, DeploymentRouter
+
+
+def _trained_policy(**kwargs):
+    policy = HedgingPolicy(min_samples=5, min_delay=0.01, **kwargs)
+    for _ in range(200):
+        policy.record_latency(0.02)
+    return policy
+
+
+def test_no_hedge_until_latencies_are_learned():
+    policy = HedgingPolicy(min_samples=5)
+    assert policy.hedge_delay() is None
+    assert policy.run(lambda: "primary", lambda: "hedge") == "primary"
+    assert policy.snapshot()["hedges"] == 0
+
+
+def test_slow_request_is_hedged_and_the_fastest_answer_wins():
+    policy = _trained_policy(max_hedge_rate=1.0)
+    released = threading.Event()
+
+    def slow():
+        released.wait(2)
+        return "primary"
+
+    assert policy.run(slow, lambda: "hedge") == "hedge"
+    released.set()
+    snapshot = policy.snapshot()
+    assert snapshot["hedges"] == 1
+    assert snapshot["hedge_wins"] == 1
+
+
+def test_hedge_rate_is_bounded_by_the_budget():
+    policy = _trained_policy(max_hedge_rate=0.25)
+
+    def slow():
+        time.sleep(0.05)
+        return "primary"
+
+    results = [policy.run(slow, lambda: "hedge") for _ in range(8)]
+
+    assert policy.snapshot()["hedges"] == 2
+    assert results.count("hedge") == 2
+
+
+def test_async_loser_is_cancelled():
+    policy = _trained_policy(max_hedge_rate=1.0)
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(2)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "primary"
+
+    async def fast():
+        return "hedge"
+
+    assert asyncio.run(policy.async_run(slow, fast)) == "hedge"
+    assert cancelled == [True]
+    # Both attempts are recorded, the cancelled loser as a lower bound of its latency
+    assert len(policy._latencies) == 202
+
+
+def test_failed_hedge_falls_back_to_the_original_attempt():
+    policy = _trained_policy(max_hedge_rate=1.0)
+
+    def slow():
+        time.sleep(0.1)
+        return "primary"
+
+    def failing():
+        raise ConnectionError()
+
+    assert policy.run(slow, failing) == "primary"
+    with pytest.raises(ValueError):
+        HedgingPolicy(quantile=1.5)
+
+
+def test_primary_fails_over_past_the_hedge_deployment():
+    policy = _trained_policy(max_hedge_rate=1.0)
+    servers = [
+        MockAzureOpenAIServer(latency=LatencyModel(mean=0.2), faults=[503]),
+        MockAzureOpenAIServer(latency=LatencyModel(mean=0.5)),
+        MockAzureOpenAIServer(),
+    ]
+    with contextlib.ExitStack() as stack:
+        for server in servers:
+            stack.enter_context(server)
+        # Decreasing weights fix the order of the candidates
+        router = DeploymentRouter(
+            [
+                DeploymentEndpoint(s.endpoint, "test", "chat", "2024-10-21", weight)
+                for s, weight in zip(servers, (4.0, 2.0, 1.0))
+            ]
+        )
+        manager = AzureOpenAIManager(
+            api_key="test",
+            api_version="2024-10-21",
+            azure_endpoint=servers[0].endpoint,
+            chat_model_name="chat",
+            rate_limiter=AdaptiveRateLimiter(),
+            router=router,
+            hedging=policy,
+        )
+
+        response = asyncio.run(
+            manager._async_call_chat_completions(
+                10, messages=[{"role": "user", "content": "hi"}], max_tokens=3
+            )
+        )
+        # Let the hedged deployment answer the cancelled request
+        time.sleep(0.5)
+
+    assert response.choices[0].message.content
+    # The primary failed over to the third deployment, not to the one the hedge was sent to
+    assert [sum(s.stats()["statuses"].values()) for s in servers] == [1, 1, 1]
+    # Only the HTTP attempts are timed: the failed one is not recorded
+    assert len(policy._latencies) == 202
@@ -0,0 +1,91 @@
+import base64
+import random
+
+import numpy as np
+import pytest
+from openai import AzureOpenAI, RateLimitError
+
+from src.aoai.mock_server import LatencyModel, MockAzureOpenAIServer
+from src.aoai.retry import RetryPolicy
+
+
+@pytest.fixture
+def server():
+    with MockAzureOpenAIServer(seed=7, completion_tokens=5, faults=[429, 503]) as mock:
+        yield mock
+
+
+def _client(server):
+    return AzureOpenAI(
+        api_key="test",
+        api_version="2024-10-21",
+        azure_endpoint=server.endpoint,
+        max_retries=0,
+    )
+
+
+def test_injected_faults_are_retried_with_advertised_retry_after(server):
+    server.retry_after = 0.01
+    client = _client(server)
+    policy = RetryPolicy(max_attempts=3, base_delay=0.001)
+
+    response = policy.call(
+        client.chat.completions.create,
+        model="chat",
+        messages=[{"role": "user", "content": "hello"}],
+    )
+
+    assert response.choices[0].message.content == "mock mock mock mock mock"
+    assert response.usage.completion_tokens == 5
+    assert server.stats()["statuses"] == {429: 1, 503: 1, 200: 1}
+
+
+def test_streams_chunks_with_usage(server):
+    server.faults.clear()
+    client = _client(server)
+
+    stream = client.chat.completions.create(
+        model="chat",
+        messages=[{"role": "user", "content": "hello"}],
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    events = list(stream)
+
+    content = "".join(
+        event.choices[0].delta.content or "" for event in events if event.choices
+    )
+    assert content == "mock mock mock mock mock"
+    assert events[-1].usage.completion_tokens == 5
+
+
+def test_embeddings_are_deterministic_and_quota_throttles(server):
+    server.faults.clear()
+    server.tokens_per_minute = 10
+    client = _client(server)
+
+    raw = client.embeddings.with_raw_response.create(
+        model="embed", input=["a", "b", "a"], encoding_format="base64"
+    )
+    vectors = [
+        np.frombuffer(base64.b64decode(item.embedding), dtype="<f4")
+        for item in raw.parse().data
+    ]
+    assert np.array_equal(vectors[0], vectors[2])
+    assert vectors[0].shape == (1536,)
+    assert raw.headers["x-ratelimit-remaining-tokens"] == "6"
+
+    server.tokens_per_minute = 4
+    with pytest.raises(RateLimitError) as error:
+        client.embeddings.create(model="embed", input="a")
+    assert error.value.status_code == 429
+    assert int(error.value.response.headers["retry-after-ms"]) > 0
+
+
+def test_latency_models_are_reproducible():
+    model = LatencyModel("lognormal", mean=0.2, spread=0.5)
+    first = [model.sample(random.Random(1)) for _ in range(3)]
+    second = [model.sample(random.Random(1)) for _ in range(3)]
+    assert first == second
+    with pytest.raises(ValueError):
+        LatencyModel("pareto")
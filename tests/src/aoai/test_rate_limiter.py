@@ -0,0 +1,55 @@
+import asyncio
+
+from src.aoai.rate_limiter import AdaptiveRateLimiter, TokenBucket
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(capacity=600, refill_period=60.0)
+    assert bucket.wait_time(600, now=bucket.updated_at) == 0.0
+
+    bucket.consume(600)
+
+    # 10 tokens per second refill, so 100 tokens take 10 seconds
+    assert bucket.wait_time(100, now=bucket.updated_at) == 10.0
+
+
+def test_token_bucket_admits_oversized_request_when_full():
+    bucket = TokenBucket(capacity=100, refill_period=60.0)
+    assert bucket.wait_time(1_000, now=bucket.updated_at) == 0.0
+
+
+def test_unconfigured_limiter_admits_until_headers_arrive():
+    limiter = AdaptiveRateLimiter()
+    assert limiter.acquire("deployment", 10_000) == 0.0
+
+    limiter.update_from_headers(
+        "deployment",
+        10_000,
+        {"x-ratelimit-remaining-tokens": "0", "x-ratelimit-remaining-requests": "10"},
+    )
+
+    assert limiter._try_acquire("deployment", 500) > 0
+
+
+def test_update_from_headers_accounts_for_in_flight_requests():
+    limiter = AdaptiveRateLimiter(tokens_per_minute=10_000, headroom=0.0)
+    limiter.acquire("deployment", 1_000)
+    limiter.acquire("deployment", 2_000)
+
+    limiter.update_from_headers(
+        "deployment", 1_000, {"x-ratelimit-remaining-tokens": "8000"}
+    )
+
+    snapshot = limiter.snapshot("deployment")
+    assert snapshot["tokens-in-flight"] == 2_000
+    assert 6_000 <= snapshot["tokens-available"] < 6_100
+
+
+def test_penalize_blocks_deployment_for_retry_after():
+    limiter = AdaptiveRateLimiter(tokens_per_minute=10_000)
+    limiter.acquire("deployment", 100)
+
+    limiter.penalize("deployment", 100, {"retry-after-ms": "50"})
+
+    assert limiter._try_acquire("deployment", 1) > 0
+    assert asyncio.run(limiter.async_acquire("other-deployment", 1)) == 0.0
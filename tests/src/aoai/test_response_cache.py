@@ -0,0 +1,54 @@
+import time
+
+from src.aoai.azure_openai import AzureOpenAIManager
+from src.aoai.mock_server import MockAzureOpenAIServer
+from src.aoai.rate_limiter import AdaptiveRateLimiter
+from src.aoai.response_cache import ResponseCache
+
+
+def test_key_is_canonical():
+    first = ResponseCache.make_key("gpt-4o", {"seed": 42, "temperature": 0})
+    second = ResponseCache.make_key("gpt-4o", {"temperature": 0, "seed": 42})
+    assert first == second
+    assert first != ResponseCache.make_key("gpt-4o", {"temperature": 0, "seed": 7})
+
+
+def test_memory_tier_expires_and_is_bounded():
+    cache = ResponseCache(ttl=0.05, max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.set(key, key.upper())
+    assert cache.get("a") is None
+    assert cache.get("c") == "C"
+    time.sleep(0.06)
+    assert cache.get("c") is None
+
+
+def test_disk_tier_is_shared(tmp_path):
+    ResponseCache(directory=str(tmp_path)).set("a", "A")
+    cache = ResponseCache(directory=str(tmp_path))
+    assert cache.get("a") == "A"
+    assert cache.get("a") == "A"
+    assert cache.snapshot()["disk_hits"] == 1
+    assert cache.snapshot()["memory_hits"] == 1
+
+
+def test_only_temperature_zero_or_opted_in_requests_are_cached():
+    with MockAzureOpenAIServer(seed=7, completion_tokens=3) as server:
+        manager = AzureOpenAIManager(
+            api_key="test",
+            api_version="2024-10-21",
+            azure_endpoint=server.endpoint,
+            chat_model_name="chat",
+            response_cache=ResponseCache(),
+            rate_limiter=AdaptiveRateLimiter(),
+        )
+
+        # The default parameters sample at temperature 0.7 with a seed
+        for _ in range(2):
+            manager.generate_chat_response("hello", max_tokens=3)
+        for _ in range(2):
+            manager.generate_chat_response("hello", temperature=0, max_tokens=3)
+        for _ in range(2):
+            manager.generate_chat_response("hi", max_tokens=3, cache_response=True)
+
+        assert server.stats()["statuses"] == {200: 4}
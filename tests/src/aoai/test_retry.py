@@ -0,0 +1,94 @@
+import asyncio
+
+import httpx
+import pytest
+import requests
+
+from src.aoai.retry import RetryPolicy, RetryStats
+
+
+def _http_error(status_code: int, headers=None) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return requests.HTTPError(response=response)
+
+
+def test_retries_transient_failures_until_success():
+    stats = RetryStats()
+    policy = RetryPolicy(max_attempts=3, base_delay=0.0, max_delay=0.0, stats=stats)
+    failures = [_http_error(503), requests.ConnectionError()]
+
+    def flaky():
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+
+    assert policy.call(flaky) == "ok"
+    snapshot = stats.snapshot()
+    assert snapshot["attempts"] == 3
+    assert snapshot["retries"] == 2
+    assert snapshot["retries_by_reason"] == {"503": 1, "ConnectionError": 1}
+
+
+@pytest.mark.parametrize("status_code", [400, 409])
+def test_does_not_retry_client_errors(status_code):
+    stats = RetryStats()
+    policy = RetryPolicy(base_delay=0.0, stats=stats)
+
+    def bad_request():
+        raise _http_error(status_code)
+
+    with pytest.raises(requests.HTTPError):
+        policy.call(bad_request)
+    assert stats.snapshot()["attempts"] == 1
+
+
+def test_gives_up_after_max_attempts():
+    stats = RetryStats()
+    policy = RetryPolicy(max_attempts=2, base_delay=0.0, max_delay=0.0, stats=stats)
+
+    def throttled():
+        raise _http_error(429)
+
+    with pytest.raises(requests.HTTPError):
+        policy.call(throttled)
+    assert stats.snapshot()["exhausted"] == 1
+
+
+def test_retry_after_header_takes_precedence_and_respects_deadline():
+    stats = RetryStats()
+    policy = RetryPolicy(base_delay=0.0, deadline=1.0, stats=stats)
+    error = _http_error(429, {"retry-after-ms": "5000"})
+
+    assert policy.next_delay(0.0, error) == 5.0
+
+    def throttled():
+        raise error
+
+    with pytest.raises(requests.HTTPError):
+        policy.call(throttled)
+    assert stats.snapshot()["deadline_exceeded"] == 1
+
+
+def test_decorrelated_jitter_stays_within_bounds():
+    policy = RetryPolicy(base_delay=0.5, max_delay=4.0, stats=RetryStats())
+    error = httpx.ConnectError("boom")
+    delay = policy.base_delay
+    for _ in range(50):
+        delay = policy.next_delay(delay, error)
+        assert 0.5 <= delay <= 4.0
+
+
+def test_async_call_retries():
+    policy = RetryPolicy(base_delay=0.0, max_delay=0.0, stats=RetryStats())
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 2:
+            raise httpx.ReadTimeout("slow")
+        return "ok"
+
+    assert asyncio.run(policy.async_call(flaky)) == "ok"
+    assert len(calls) == 2
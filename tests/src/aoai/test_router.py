@@ -0,0 +1,47 @@
+import httpx
+import openai
+
+from src.aoai.router import DeploymentEndpoint, DeploymentRouter
+
+
+def _rate_limit_error(headers):
+    request = httpx.Request("POST", "https://example.openai.azure.com")
+    response = httpx.Response(429, headers=headers, request=request)
+    return openai.RateLimitError("throttled", response=response, body=None)
+
+
+def _router(**kwargs):
+    deployments = [
+        DeploymentEndpoint("https://a.openai.azure.com", "key", "gpt-4o"),
+        DeploymentEndpoint("https://b.openai.azure.com", "key", "gpt-4o"),
+    ]
+    return DeploymentRouter(deployments, **kwargs)
+
+
+def test_throttled_deployment_is_tried_last():
+    router = _router()
+    first, second = router.deployments
+    router.record_failure(first, _rate_limit_error({"retry-after-ms": "5000"}))
+    assert router.candidates() == [second, first]
+
+
+def test_faster_deployment_is_preferred():
+    router = _router()
+    first, second = router.deployments
+    router.record_success(first, 2.0)
+    router.record_success(second, 0.2)
+    assert router.candidates()[0] is second
+
+
+def test_unhealthy_after_consecutive_failures():
+    router = _router(failure_threshold=2)
+    first, _ = router.deployments
+    error = openai.APIConnectionError(
+        request=httpx.Request("POST", "https://a.openai.azure.com")
+    )
+    router.record_failure(first, error)
+    assert all(entry["healthy"] for entry in router.status())
+    router.record_failure(first, error)
+    assert not router.status()[0]["healthy"]
+    router.record_success(first, 0.1)
+    assert first.consecutive_failures == 0
@@ -0,0 +1,72 @@
+import asyncio
+import heapq
+import threading
+import time
+
+import pytest
+
+from src.aoai.rate_limiter import AdaptiveRateLimiter
+from src.aoai.scheduler import PriorityScheduler, current_priority, request_priority
+
+
+def drained_scheduler(used=60_000, reserves=None):
+    limiter = AdaptiveRateLimiter()
+    limiter.configure("dep", tokens_per_minute=60_000)
+    limiter.acquire("dep", used)
+    return PriorityScheduler(limiter, reserves=reserves, poll_interval=0.005)
+
+
+def test_interactive_requests_overtake_queued_background_work():
+    scheduler = drained_scheduler(reserves={"background": 0.0})
+    order = []
+
+    def request(priority):
+        with request_priority(priority):
+            scheduler.acquire("dep", 100)
+        order.append(priority)
+
+    background = threading.Thread(target=request, args=("background",))
+    background.start()
+    time.sleep(0.01)
+    interactive = threading.Thread(target=request, args=("interactive",))
+    interactive.start()
+    background.join()
+    interactive.join()
+
+    assert order == ["interactive", "background"]
+    assert scheduler.snapshot()["background"]["admitted"] == 1
+
+
+def test_tenants_share_a_class_by_weight():
+    scheduler = PriorityScheduler(
+        AdaptiveRateLimiter(), tenant_weights={"heavy": 3, "light": 1}
+    )
+    for _ in range(4):
+        scheduler._enqueue("dep", 30, "standard", "heavy")
+        scheduler._enqueue("dep", 30, "standard", "light")
+
+    heap = list(scheduler._queues["dep"].heap)
+    served = [heapq.heappop(heap).tenant for _ in range(5)]
+    assert served == ["heavy", "heavy", "light", "heavy", "heavy"]
+
+
+def test_background_is_held_back_by_the_reserve():
+    scheduler = drained_scheduler(used=50_000)
+
+    assert scheduler.acquire("dep", 100) < 0.05
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(
+            asyncio.wait_for(
+                scheduler.async_acquire("dep", 100, priority="background"), 0.05
+            )
+        )
+    assert scheduler.snapshot()["background"]["queued"] == 0
+
+
+def test_request_priority_is_scoped():
+    with request_priority("background", tenant="nightly"):
+        assert current_priority() == ("background", "nightly")
+    assert current_priority() == ("interactive", "default")
+    with pytest.raises(ValueError):
+        with request_priority("urgent"):
+            pass
@@ -0,0 +1,26 @@
+import numpy as np
+
+from src.aoai.semantic_cache import (
+    SemanticResponseCache,
+    context_fingerprint,
+    normalize_query,
+)
+
+
+def test_normalize_query():
+    assert normalize_query("  Summarize   THIS document? ") == "summarize this document"
+
+
+def test_hit_above_threshold_within_same_context():
+    cache = SemanticResponseCache(threshold=0.9)
+    context = context_fingerprint(deployment="gpt-4o", history=[])
+    cache.store(context, np.array([1.0, 0.0, 0.0]), "It is 42.", tokens=120)
+
+    assert cache.lookup(context, np.array([0.95, 0.1, 0.0]))[0] == "It is 42."
+    assert cache.lookup(context, np.array([0.0, 1.0, 0.0])) is None
+    other = context_fingerprint(deployment="gpt-4o", history=[{"role": "user"}])
+    assert cache.lookup(other, np.array([1.0, 0.0, 0.0])) is None
+
+    snapshot = cache.snapshot()
+    assert snapshot["hits"] == 1 and snapshot["lookups"] == 3
+    assert snapshot["saved_tokens"] == 120
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.aoai.single_flight import SingleFlight
+
+
+def test_concurrent_identical_calls_share_one_call():
+    group = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def slow_call(value):
+        calls.append(value)
+        started.set()
+        time.sleep(0.2)
+        return value * 2
+
+    key = SingleFlight.make_key("endpoint", "deployment", messages=["hi"])
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        leader = pool.submit(group.do, key, slow_call, 21)
+        started.wait()
+        waiters = [pool.submit(group.do, key, slow_call, 21) for _ in range(3)]
+        results = [leader.result()] + [w.result() for w in waiters]
+
+    assert results == [42] * 4
+    assert calls == [21]
+    assert group.snapshot() == {"calls": 1, "coalesced": 3, "in_flight": 0}
+
+
+def test_errors_reach_every_waiter_and_are_not_kept():
+    group = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream failed")
+
+    async def run():
+        return await asyncio.gather(
+            group.async_do("key", failing),
+            group.async_do("key", failing),
+            return_exceptions=True,
+        )
+
+    errors = asyncio.run(run())
+    assert [str(e) for e in errors] == ["upstream failed"] * 2
+    assert group.snapshot()["calls"] == 1
+
+    async def succeeding():
+        return "ok"
+
+    assert asyncio.run(group.async_do("key", succeeding)) == "ok"
+
+
+def test_keys_depend_on_every_parameter():
+    key = SingleFlight.make_key("endpoint", "deployment", temperature=0)
+    assert key == SingleFlight.make_key("endpoint", "deployment", temperature=0)
+    assert key != SingleFlight.make_key("endpoint", "deployment", temperature=1)
+    assert key != SingleFlight.make_key("endpoint", "other", temperature=0)
+
+
+def test_leader_error_is_raised():
+    def failing():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        SingleFlight().do("key", failing)
+
+
+def test_cancelled_leader_is_replaced_by_a_waiter():
+    group = SingleFlight()
+    calls = []
+
+    async def slow_call(value):
+        calls.append(value)
+        await asyncio.sleep(0.1)
+        return value * 2
+
+    async def run():
+        leader = asyncio.ensure_future(group.async_do("key", slow_call, 21))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(group.async_do("key", slow_call, 21))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    assert asyncio.run(run()) == 42
+    assert calls == [21, 21]
+    assert group.snapshot()["in_flight"] == 0
@@ -0,0 +1,23 @@
+from types import SimpleNamespace
+
+from src.aoai.streaming import StreamMetrics
+
+
+def test_metrics_prefer_reported_usage():
+    metrics = StreamMetrics()
+    assert metrics.time_to_first_token is None
+    metrics.on_delta("Hel")
+    metrics.on_delta("lo")
+    metrics.usage = SimpleNamespace(prompt_tokens=5, completion_tokens=2)
+    metrics.finish(completion_tokens=99)
+
+    assert metrics.content == "Hello"
+    assert metrics.completion_tokens == 2
+    assert 0 <= metrics.time_to_first_token <= metrics.duration
+    assert metrics.to_dict()["prompt_tokens"] == 5
+
+
+def test_metrics_fall_back_to_estimated_tokens():
+    metrics = StreamMetrics()
+    metrics.on_delta("Hello")
+    assert metrics.finish(completion_tokens=1).completion_tokens == 1
@@ -0,0 +1,60 @@
+import urllib.request
+
+import pytest
+
+from src.aoai.telemetry import Histogram, MetricsRegistry
+
+
+def test_histogram_quantiles_interpolate_within_buckets():
+    histogram = Histogram(buckets=(1.0, 2.0, 4.0))
+    for value in (0.5, 1.5, 1.5, 3.0):
+        histogram.observe(value)
+
+    assert histogram.count == 4
+    assert histogram.sum == pytest.approx(6.5)
+    assert histogram.quantile(0.5) == pytest.approx(1.5)
+    assert histogram.quantile(0.99) == pytest.approx(3.92)
+
+
+def test_track_records_latency_tokens_and_cost_per_deployment():
+    metrics = MetricsRegistry(prices={"gpt-4": (0.03, 0.06), "gpt-4o": (0.005, 0.015)})
+    with metrics.track("openai", "chat.completions", "chat-eu") as call:
+        call.set_usage(
+            {"prompt_tokens": 1000, "completion_tokens": 500}, "gpt-4o-2024-05-13"
+        )
+        call.request_bytes = 2048
+
+    with pytest.raises(TimeoutError):
+        with metrics.track("openai", "chat.completions", "chat-eu"):
+            raise TimeoutError()
+
+    statuses = {row["status"]: row["count"] for row in metrics.summary()}
+    assert statuses == {"ok": 1, "TimeoutError": 1}
+
+    counters = metrics.snapshot()
+    cost = list(counters["azure_estimated_cost_usd_total"].items())
+    assert cost[0][0] == (
+        ("model", "gpt-4o-2024-05-13"),
+        ("service", "openai"),
+        ("target", "chat-eu"),
+    )
+    assert cost[0][1] == pytest.approx(0.0125)
+    assert sum(counters["azure_tokens_total"].values()) == 1500
+    assert sum(counters["azure_request_bytes_total"].values()) == 2048
+
+
+def test_prometheus_endpoint_serves_histograms_and_counters():
+    metrics = MetricsRegistry(latency_buckets=(0.1, 1.0))
+    metrics.observe("azure_request_duration_seconds", 0.5, target='a"b')
+    metrics.record_retry("429")
+
+    text = metrics.to_prometheus()
+    assert 'azure_request_duration_seconds_bucket{target="a\\"b",le="1"} 1' in text
+    assert 'azure_request_duration_seconds_bucket{target="a\\"b",le="+Inf"} 1' in text
+    assert 'azure_retries_total{reason="429"} 1' in text
+
+    metrics.start_http_server(0, address="127.0.0.1")
+    port = metrics._server.server_address[1]
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+        assert response.read().decode("utf-8") == metrics.to_prometheus()
+    metrics._server.shutdown()
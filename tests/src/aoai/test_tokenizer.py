@@ -0,0 +1,183 @@
+import base64
+import io
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.aoai.tokenizer import (
+    AzureOpenAITokenizer,
+    EncodingRegistry,
+    image_dimensions,
+    image_tokens,
+)
+
+
+class WordEncoding:
+    def encode_ordinary(self, text):
+        return text.split()
+
+    def encode_ordinary_batch(self, texts, num_threads=8):
+        return [self.encode_ordinary(text) for text in texts]
+
+
+@pytest.fixture
+def loaded(monkeypatch):
+    loaded = []
+
+    def get_encoding(name):
+        loaded.append(name)
+        return SimpleNamespace(name=name)
+
+    monkeypatch.setattr("tiktoken.get_encoding", get_encoding)
+    return loaded
+
+
+def test_azure_model_names_resolve_to_their_encodings():
+    assert EncodingRegistry.encoding_name_for_model("gpt-4o-2024-08-06") == "o200k_base"
+    assert EncodingRegistry.encoding_name_for_model("gpt-4o-mini") == "o200k_base"
+    assert EncodingRegistry.encoding_name_for_model("gpt-4-32k-0314") == "cl100k_base"
+    assert EncodingRegistry.encoding_name_for_model("gpt-35-turbo-16k") == "cl100k_base"
+    assert EncodingRegistry.encoding_name_for_model("my-deployment") is None
+
+
+def test_deployments_resolve_through_configured_and_learned_models(loaded):
+    registry = EncodingRegistry({"legacy": "gpt-35-turbo"})
+
+    assert registry.for_deployment("legacy").name == "cl100k_base"
+    assert registry.for_deployment("chat").name == "o200k_base"
+    assert registry.for_deployment("embed", "cl100k_base").name == "cl100k_base"
+
+    registry.learn_from_response("chat", SimpleNamespace(model="gpt-4-0613"))
+    assert registry.for_deployment("chat").name == "cl100k_base"
+    assert loaded == ["cl100k_base", "o200k_base"]
+
+
+def test_warm_up_loads_encodings_once_in_the_background(loaded):
+    registry = EncodingRegistry({"chat": "gpt-4o"})
+
+    thread = registry.warm_up()
+    thread.join()
+
+    assert registry.warm_up() is thread
+    assert sorted(loaded) == ["cl100k_base", "o200k_base"]
+
+
+def test_invalid_deployment_models_are_ignored(monkeypatch):
+    monkeypatch.setenv("AZURE_OPENAI_DEPLOYMENT_MODELS", "[1, 2]")
+    assert EncodingRegistry.from_env().model_for("chat") == "chat"
+
+    monkeypatch.setenv("AZURE_OPENAI_DEPLOYMENT_MODELS", '{"chat": "gpt-4o"}')
+    assert EncodingRegistry.from_env().model_for("chat") == "gpt-4o"
+
+
+def test_batched_counts_match_single_estimates(monkeypatch):
+    monkeypatch.setattr(
+        "src.aoai.tokenizer.get_encoding_for_model", lambda model: WordEncoding()
+    )
+    monkeypatch.setattr("src.aoai.tokenizer.COUNT_BATCH_SIZE", 2)
+    tokenizer = AzureOpenAITokenizer()
+    conversations = [
+        [{"role": "user", "content": "one two three"}],
+        [],
+        [
+            {"role": "system", "content": "be brief"},
+            {"role": "user", "name": "ann", "content": "hi"},
+        ],
+    ]
+
+    counts = tokenizer.count_many(["a b", "", "c d e", "f"])
+    totals = tokenizer.count_conversations(conversations)
+
+    assert counts.dtype == np.int64
+    assert counts.tolist() == [2, 0, 3, 1]
+    assert totals.tolist() == [
+        tokenizer.estimate_tokens_azure_openai(messages) for messages in conversations
+    ]
+
+
+def _data_url(width, height, image_format="PNG"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height)).save(buffer, format=image_format)
+    encoded = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    return f"data:image/{image_format.lower()};base64,{encoded}"
+
+
+def test_image_tokens_follow_the_tile_formula():
+    assert image_tokens(1024, 1024) == 85 + 170 * 4
+    assert image_tokens(2048, 4096, "high") == 85 + 170 * 6
+    assert image_tokens(300, 200) == 85 + 170
+    assert image_tokens(4096, 4096, "low") == 85
+    assert image_tokens(None, None) == 85 + 170 * 8
+    assert image_tokens(512, 512, model="gpt-4o-mini-2024-07-18") == 2833 + 5667
+
+
+def test_image_parts_are_counted_from_their_header(monkeypatch):
+    monkeypatch.setattr(
+        "src.aoai.tokenizer.get_encoding_for_model", lambda model: WordEncoding()
+    )
+    url = _data_url(1600, 900, "JPEG")
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": "describe this"},
+                {"type": "image_url", "image_url": {"url": url}},
+                {"type": "image_url", "image_url": {"url": url, "detail": "low"}},
+            ],
+        }
+    ]
+
+    assert image_dimensions(url) == (1600, 900)
+    assert image_dimensions("https://example.com/cat.png") is None
+    assert AzureOpenAITokenizer().estimate_tokens_azure_openai(messages) == (
+        3 + 1 + 2 + image_tokens(1600, 900) + 85 + 3
+    )
+
+
+class ByteEncoding:
+    def encode_ordinary(self, text):
+        return list(text.encode("utf-8"))
+
+    def decode_bytes(self, tokens):
+        return bytes(tokens)
+
+
+MARKDOWN = (
+    "# Title\n\nShort paragraph.\n\n## Section\n"
+    "First sentence here. Second one is a bit longer! Third?\n" + "é" * 50 + "\n\nend\n"
+)
+
+
+def test_chunks_fit_and_split_on_boundaries(monkeypatch):
+    monkeypatch.setattr(
+        "src.aoai.tokenizer.get_encoding_for_model", lambda model: ByteEncoding()
+    )
+    tokenizer = AzureOpenAITokenizer()
+
+    chunks = list(tokenizer.chunk_text(MARKDOWN, 30))
+    pieces = [MARKDOWN[i : i + 7] for i in range(0, len(MARKDOWN), 7)]
+
+    assert "".join(chunks) == MARKDOWN
+    assert all(len(chunk.encode("utf-8")) <= 30 for chunk in chunks)
+    assert chunks[0] == "# Title\n\nShort paragraph.\n\n"
+    assert "First sentence here." in chunks
+    assert list(tokenizer.chunk_text(iter(pieces), 30)) == chunks
+
+
+def test_chunks_overlap_with_the_previous_chunk(monkeypatch):
+    monkeypatch.setattr(
+        "src.aoai.tokenizer.get_encoding_for_model", lambda model: ByteEncoding()
+    )
+    tokenizer = AzureOpenAITokenizer()
+
+    chunks = list(tokenizer.chunk_text(MARKDOWN, 40, overlap_tokens=12))
+
+    assert all(len(chunk.encode("utf-8")) <= 40 for chunk in chunks)
+    # Whole units are repeated when they fit, otherwise the last tokens of the last one
+    assert chunks[0].endswith("## Section\n")
+    assert chunks[1] == "## Section\nFirst sentence here."
+    assert chunks[2].startswith("ntence here. Second")
+    with pytest.raises(ValueError):
+        next(tokenizer.chunk_text(MARKDOWN, 10, overlap_tokens=10))
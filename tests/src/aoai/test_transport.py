@@ -0,0 +1,25 @@
+from src.aoai.transport import (
+    create_http_client,
+    create_session,
+    get_shared_http_client,
+    get_shared_session,
+)
+
+
+def test_shared_clients_are_singletons():
+    assert get_shared_session() is get_shared_session()
+    assert get_shared_http_client() is get_shared_http_client()
+
+
+def test_session_pool_and_default_timeout():
+    adapter = create_session(pool_maxsize=8, timeout=5, connect_timeout=1).get_adapter(
+        "https://example.openai.azure.com"
+    )
+    assert adapter._pool_maxsize == 8
+    assert adapter.timeout == (1, 5)
+
+
+def test_http2_falls_back_without_h2(monkeypatch):
+    monkeypatch.setattr("importlib.util.find_spec", lambda name: None)
+    client = create_http_client(http2=True)
+    assert client.timeout.read == 120.0
@@ -0,0 +1,24 @@
+import pandas as pd
+import pytest
+
+from src.aoai.utils import summarize_token_estimation_results
+
+
+def test_summary_reports_bias_and_variance_per_model():
+    results = pd.DataFrame(
+        {
+            "model": ["gpt-4o", "gpt-4o", "gpt-4o", "gpt-35-turbo"],
+            "estimated_tokens": [12, 10, 14, 20],
+            "actual_tokens": [10, 10, 10, 20],
+        }
+    )
+
+    summary = summarize_token_estimation_results(results)
+
+    assert list(summary.index) == ["gpt-4o", "gpt-35-turbo"]
+    gpt4o = summary.loc["gpt-4o"]
+    assert gpt4o["conversations"] == 3
+    assert gpt4o["bias"] == pytest.approx(2.0)
+    assert gpt4o["error_variance"] == pytest.approx(8 / 3)
+    assert gpt4o["exact_rate"] == pytest.approx(1 / 3)
+    assert summary.loc["gpt-35-turbo", "mean_absolute_error"] == 0